@@ -0,0 +1,130 @@
+"""Бенчмарк рассылки: 100k пользователей, отзывчивость обработчиков во время рассылки, продолжение после остановки.
+
+Сессия подменена: 2% пользователей «заблокировали бота», каждая отправка занимает --latency мс.
+Рассылка останавливается на середине и продолжается новым Broadcaster из файла прогресса.
+
+Запуск: python benchmarks/bench_broadcast.py [--users 100000] [--rate 5000] [--latency 5]
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def percentile(samples: list, q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def make_session(latency: float):
+    from aiogram import methods
+    from aiogram.exceptions import TelegramForbiddenError
+    from mocked_bot import MockedSession
+
+    class BroadcastSession(MockedSession):
+        def __init__(self):
+            super().__init__()
+            self.received = collections.Counter()
+
+        async def make_request(self, bot, method, timeout=None):
+            if isinstance(method, methods.CopyMessage):
+                await asyncio.sleep(latency)
+                if method.chat_id % 50 == 0:
+                    raise TelegramForbiddenError(method=method, message="Forbidden: bot was blocked by the user")
+                self.received[method.chat_id] += 1
+            return await super().make_request(bot, method, timeout)
+
+    return BroadcastSession()
+
+
+async def measure_handlers(bot_module, bot, dp, stop: asyncio.Event, first_id: int) -> list:
+    from mocked_bot import message_update
+    timings = []
+    update_id = first_id
+    while not stop.is_set():
+        update_id += 1
+        start = time.perf_counter()
+        await dp.feed_update(bot, message_update(update_id, 10_000_000 + update_id, "🎮 Список игр"))
+        timings.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.02)
+    return timings
+
+
+async def run(bot_module, args):
+    from aiogram import Bot
+
+    session = make_session(args.latency / 1000)
+    bot = Bot(token="123:ABC", session=session)
+    dp = bot_module.create_dispatcher()
+    progress = {
+        "from_chat_id": 1, "message_id": 1, "status_chat_id": 1, "status_message_id": 2,
+        "cursor": 0, "total": args.users, "sent": 0, "failed": 0, "inactive": 0, "started": "",
+    }
+
+    idle_stop = asyncio.Event()
+    idle = asyncio.create_task(measure_handlers(bot_module, bot, dp, idle_stop, 0))
+    await asyncio.sleep(1)
+    idle_stop.set()
+    idle_timings = await idle
+
+    broadcaster = bot_module.Broadcaster(rate=args.rate)
+    busy_stop = asyncio.Event()
+    busy = asyncio.create_task(measure_handlers(bot_module, bot, dp, busy_stop, 100_000))
+    start = time.perf_counter()
+    broadcaster.start(bot, progress)
+    while broadcaster.done < args.users // 2:
+        await asyncio.sleep(0.05)
+    await broadcaster.stop()
+    print(f"stopped at {broadcaster.done} processed, checkpoint cursor {json.load(open(bot_module.BROADCAST_FILE))['cursor']}")
+
+    # «Перезапуск»: новый Broadcaster читает файл прогресса
+    resumed = bot_module.Broadcaster(rate=args.rate)
+    await resumed.resume(bot)
+    await resumed._task
+    elapsed = time.perf_counter() - start
+    busy_stop.set()
+    busy_timings = await busy
+
+    expected = args.users - args.users // 50
+    duplicates = sum(count - 1 for count in session.received.values())
+    print(f"broadcast: {len(session.received)}/{expected} delivered, {duplicates} re-sent after resume, "
+          f"{resumed.progress['inactive']} marked inactive, {resumed.progress['failed']} failed, {elapsed:.1f}s, {args.users / elapsed:.0f} users/s")
+    assert len(session.received) == expected
+    assert not os.path.exists(bot_module.BROADCAST_FILE)
+    for label, timings in (("handlers idle", idle_timings), ("handlers during broadcast", busy_timings)):
+        print(f"{label}: {len(timings)} updates, p50={statistics.median(timings):.2f} ms, "
+              f"p99={percentile(timings, 0.99):.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--rate", type=float, default=5000, help="скорость рассылки, сообщ./с")
+    parser.add_argument("--latency", type=float, default=5, help="задержка одной отправки, мс")
+    args = parser.parse_args()
+
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="gambot_bench_")
+    os.environ["BROADCAST_WORKERS"] = str(max(8, int(args.rate * args.latency / 1000) + 8))
+    import logging
+    import bot
+    logging.disable(logging.WARNING)
+    bot.init_files()
+    users = {str(1000 + i): {"username": f"user_{i}", "first_name": "U", "last_name": None, "joined": ""}
+             for i in range(args.users)}
+    with open(bot.USERS_FILE, "w", encoding="utf-8") as f:
+        json.dump(users, f)
+    bot.user_index.load()
+    bot.games_catalog.all()
+
+    asyncio.run(run(bot, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Бенчмарк импорта и экспорта каталога: время и пик памяти на больших манифестах.
+
+Запуск: python benchmarks/bench_catalog_import.py [--games 10000 50000]
+Манифест читается потоком, поэтому пик памяти при проверке не растет вместе с размером файла.
+"""
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def write_manifest(path: str, games: int):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(("name", "description", "original_url"))
+        for i in range(games):
+            writer.writerow((f"Game {i}", "Описание " * 30, f"https://example.com/{i}"))
+
+
+def measure(label: str, func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"  {label}: {elapsed:.2f}s, peak {peak / 1e6:.1f} MB")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, nargs="+", default=[10000, 50000])
+    args = parser.parse_args()
+
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="gambot_bench_")
+    import logging
+    import bot
+    logging.disable(logging.INFO)
+    bot.init_files()
+
+    for games in args.games:
+        path = os.path.join(bot.DATA_DIR, f"manifest_{games}.csv")
+        write_manifest(path, games)
+        print(f"{games} games, manifest {os.path.getsize(path) / 1e6:.1f} MB")
+        report, _, _ = measure("dry run", bot.scan_manifest, path, ".csv", {})
+        _, updates, _ = measure("apply (collect games)", bot.scan_manifest, path, ".csv", {}, True)
+        catalog = list(updates.items())
+        del updates
+        for csv_format in (False, True):
+            export = measure(f"export {'csv' if csv_format else 'json'}", bot.write_catalog_export,
+                             catalog, csv_format, False)
+            os.remove(export)
+        assert report["new"] == games and not report["errors"]
+
+
+if __name__ == "__main__":
+    main()
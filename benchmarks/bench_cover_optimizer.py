@@ -0,0 +1,83 @@
+"""Бенчмарк пережатия обложек: догоняющая оптимизация каталога в пуле процессов.
+
+Запуск: python benchmarks/bench_cover_optimizer.py [--covers 24] [--side 3000] [--workers 1 2 4]
+Показывает время, задержку цикла событий во время работы и экономию объема. Нужен Pillow.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def make_cover(path: str, side: int, seed: int):
+    from PIL import Image
+    # Шум поверх градиента: сжимается примерно как фотография, а не как заливка
+    gradient = Image.linear_gradient("L").resize((side, side * 2 // 3))
+    noise = Image.effect_noise((side, side * 2 // 3), 40 + seed % 20)
+    Image.merge("RGB", (gradient, noise, gradient.rotate(180))).save(path, "JPEG", quality=95)
+
+
+async def measure_lag(stop: asyncio.Event, interval: float = 0.01) -> float:
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--covers", type=int, default=24)
+    parser.add_argument("--side", type=int, default=3000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="gambot_bench_")
+    import logging
+    import bot
+    logging.disable(logging.INFO)
+    if not bot.CoverOptimizer().available:
+        sys.exit("Pillow не установлен")
+    bot.init_files()
+
+    games = {}
+    for i in range(args.covers):
+        photo = f"Game {i}_photo.jpg"
+        make_cover(os.path.join(bot.DATA_DIR, photo), args.side, i)
+        games[f"Game {i}"] = {"description": "", "photo": photo}
+    bot.storage.save_games(games)
+    source_bytes = sum(os.path.getsize(os.path.join(bot.DATA_DIR, game["photo"])) for game in games.values())
+
+    async def run(workers: int):
+        await bot.games_catalog.refresh()
+        optimizer = bot.CoverOptimizer(workers)
+        # Процессы поднимаются заранее, чтобы не мерить их запуск
+        await asyncio.gather(*(asyncio.get_running_loop().run_in_executor(optimizer._pool(), time.sleep, 0.1)
+                               for _ in range(workers)))
+        stop = asyncio.Event()
+        lag = asyncio.create_task(measure_lag(stop))
+        start = time.perf_counter()
+        done, total = await optimizer.backfill(force=True)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await optimizer.stop()
+        catalog = bot.games_catalog.all().values()
+        variant_bytes = sum(os.path.getsize(os.path.join(bot.DATA_DIR, game["photo_optimized"])) for game in catalog)
+        thumb_bytes = sum(os.path.getsize(os.path.join(bot.DATA_DIR, game["photo_thumb"])) for game in catalog)
+        print(f"workers={workers}: {done}/{total} covers, {elapsed:.2f}s, {total / elapsed:.1f} covers/s, "
+              f"max loop lag {await lag * 1000:.1f} ms")
+        return variant_bytes, thumb_bytes
+
+    for workers in args.workers:
+        variant_bytes, thumb_bytes = asyncio.run(run(workers))
+    print(f"size: source {source_bytes / 1e6:.1f} MB -> optimized {variant_bytes / 1e6:.1f} MB, "
+          f"thumbnails {thumb_bytes / 1e3:.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
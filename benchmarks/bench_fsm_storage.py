@@ -0,0 +1,107 @@
+"""Проверка и бенчмарк хранилищ FSM: SQLite между процессами, истечение TTL, Redis (если доступен).
+
+Состояние, записанное одним процессом, должно читаться другим; брошенный диалог исчезает через FSM_TTL
+и не оживает при следующей записи.
+Redis проверяется, если установлен пакет redis и по REDIS_URL отвечает сервер (например, локальный redis-server).
+
+Запуск: python benchmarks/bench_fsm_storage.py [--ops 2000]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def key(chat_id: int):
+    from aiogram.fsm.storage.base import StorageKey
+    return StorageKey(bot_id=1, chat_id=chat_id, user_id=chat_id)
+
+
+def write_in_child(path: str):
+    import bot
+
+    async def run():
+        fsm = bot.SqliteFSMStorage(path)
+        await fsm.set_state(key(7), bot.AdminStates.waiting_for_game_description)
+        await fsm.update_data(key(7), {"game_name": "Ведьмак 3"})
+        await fsm.close()
+
+    asyncio.run(run())
+
+
+async def check_roundtrip(fsm, ops: int, label: str):
+    import bot
+    start = time.perf_counter()
+    for i in range(ops):
+        await fsm.set_state(key(i), bot.AdminStates.waiting_for_game_name)
+        await fsm.update_data(key(i), {"game_name": f"Game {i}"})
+        assert await fsm.get_state(key(i)) == bot.AdminStates.waiting_for_game_name.state
+    elapsed = time.perf_counter() - start
+    for i in range(ops):
+        await fsm.set_state(key(i), None)
+        await fsm.set_data(key(i), {})
+        assert await fsm.get_data(key(i)) == {}
+    print(f"{label}: {ops} admin steps (set_state + update_data + get_state), {ops / elapsed:.0f} steps/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=2000)
+    args = parser.parse_args()
+
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="gambot_bench_")
+    import logging
+    import bot
+    logging.disable(logging.INFO)
+    bot.init_files()
+
+    # Запись из другого процесса видна здесь
+    child = multiprocessing.Process(target=write_in_child, args=(bot.FSM_SQLITE_FILE,))
+    child.start()
+    child.join()
+    assert child.exitcode == 0
+
+    async def run():
+        fsm = bot.SqliteFSMStorage(bot.FSM_SQLITE_FILE)
+        assert await fsm.get_state(key(7)) == bot.AdminStates.waiting_for_game_description.state
+        assert await fsm.get_data(key(7)) == {"game_name": "Ведьмак 3"}
+        print("sqlite: state written by another process is visible")
+        await check_roundtrip(fsm, args.ops, "sqlite")
+        await fsm.close()
+
+        short = bot.SqliteFSMStorage(bot.FSM_SQLITE_FILE, ttl=1)
+        await short.set_state(key(8), bot.AdminStates.waiting_for_username_to_block)
+        await asyncio.sleep(1.1)
+        assert await short.get_state(key(8)) is None
+        print("sqlite: abandoned state expired after ttl")
+        # Новая запись в истекший диалог не возвращает его прежнее состояние
+        await short.update_data(key(8), {"y": 2})
+        assert await short.get_state(key(8)) is None
+        assert await short.get_data(key(8)) == {"y": 2}
+        print("sqlite: update after expiry does not revive the old state")
+        await short.close()
+
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError:
+            print("redis: skipped (pip install redis)")
+            return
+        redis_fsm = RedisStorage.from_url(bot.REDIS_URL, state_ttl=bot.FSM_TTL, data_ttl=bot.FSM_TTL)
+        try:
+            await redis_fsm.redis.ping()
+        except Exception as e:
+            print(f"redis: skipped ({bot.REDIS_URL} unavailable: {e})")
+        else:
+            await check_roundtrip(redis_fsm, args.ops, "redis")
+        await redis_fsm.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
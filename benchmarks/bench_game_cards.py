@@ -0,0 +1,95 @@
+"""Бенчмарк готовых карточек и меню: время и выделения памяти на один просмотр.
+
+Запуск: python benchmarks/bench_game_cards.py [--games 1000] [--views 20000]
+Сравнивает сборку карточки игры и меню на каждый вызов (как было) с готовыми из кэша.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def build_card(bot, game_name: str, game: dict):
+    """Прежняя сборка карточки в handle_game_selection"""
+    from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+    keyboard = []
+    if game.get("file"):
+        keyboard.append([InlineKeyboardButton(text="🏴‍☠️ Пиратская версия", callback_data=bot.game_callback("pirate", game_name))])
+    if game.get("original_url"):
+        keyboard.append([InlineKeyboardButton(text="🛒 Оригинал (лицензия)", callback_data=bot.game_callback("original", game_name))])
+    keyboard.append([InlineKeyboardButton(text="🔙 Назад к списку", callback_data="back_to_games_list")])
+    markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
+    description = game.get("description", "Описание отсутствует")
+    caption = f"🎮 <b>{game_name}</b>\n\n{description}\n\n➡️ Выберите тип игры:"
+    return caption, markup
+
+
+def build_menu(bot, user):
+    """Прежняя сборка главного меню и админ-меню на каждый вызов"""
+    from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+    return bot.build_main_keyboard(bot.is_admin(user.username)), InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=button.text, callback_data=button.callback_data) for button in row]
+        for row in bot.ADMIN_MENU_KEYBOARD.inline_keyboard
+    ])
+
+
+def profile(label: str, func, calls: list):
+    start = time.perf_counter()
+    for args in calls:
+        func(*args)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    sample = calls[:1000]
+    kept = [func(*args) for args in sample]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    allocated = sum(stat.size_diff for stat in stats if stat.size_diff > 0)
+    blocks = sum(stat.count_diff for stat in stats if stat.count_diff > 0)
+    del kept
+    print(f"{label}: {elapsed / len(calls) * 1e6:.2f} us/view, "
+          f"{allocated / len(sample):.0f} bytes and {blocks / len(sample):.1f} blocks retained per view")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--views", type=int, default=20000)
+    args = parser.parse_args()
+
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="gambot_bench_")
+    import logging
+    import bot
+    from aiogram import types
+    logging.disable(logging.INFO)
+    bot.init_files()
+    bot.storage.save_games({
+        f"Game {i}": {"description": "Описание " * 30, "file": f"{i}.zip", "original_url": "https://example.com"}
+        for i in range(args.games)
+    })
+    games = bot.games_catalog.all()
+
+    rnd = random.Random(42)
+    names = list(games)
+    # Популярные игры смотрят чаще: распределение просмотров с длинным хвостом
+    views = [(name, games[name]) for name in rnd.choices(names, weights=[1 / (i + 1) for i in range(len(names))],
+                                                         k=args.views)]
+    print(f"{args.games} games, {args.views} views")
+    profile("card rebuilt per view", lambda name, game: build_card(bot, name, game), views)
+    profile("card from cache", bot.game_cards.get, views)
+
+    user = types.User(id=1, is_bot=False, first_name="Admin", username=bot.ADMINS[0])
+    menus = [(user,)] * args.views
+    profile("menus rebuilt per call", lambda user: build_menu(bot, user), menus)
+    profile("menus prebuilt", lambda user: (bot.get_main_keyboard(user), bot.ADMIN_MENU_KEYBOARD), menus)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Бенчмарк логирования под потоком ошибок: задержка обработчика, который пишет в лог.
+
+Запуск: python benchmarks/bench_logging.py [--updates 5000] [--errors 3] [--write-ms 0.2]
+Сравнивает прямую запись в поток (прежний logging.basicConfig) с очередью и отсевом повторов.
+Медленный вывод (--write-ms на запись) имитирует переполненный pipe или журнал systemd.
+"""
+import argparse
+import asyncio
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+class SlowStream(io.StringIO):
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+        self.writes = 0
+
+    def write(self, text: str) -> int:
+        self.writes += 1
+        time.sleep(self.delay)
+        return len(text)
+
+
+async def flood(log: logging.Logger, updates: int, errors: int) -> list:
+    """Обработчик, у которого каждая отправка падает, как при недоступном Bot API"""
+    latencies = []
+    for update_id in range(updates):
+        start = time.perf_counter()
+        for attempt in range(errors):
+            try:
+                raise ConnectionError("Cannot connect to host api.telegram.org")
+            except ConnectionError as e:
+                log.error("Error sending file: %s", e, exc_info=attempt == 0)
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0)
+    return sorted(latencies)
+
+
+def report(label: str, latencies: list, stream: SlowStream):
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print(f"{label}: p50 {p50 * 1e6:.0f} us, p99 {p99 * 1e6:.0f} us, "
+          f"total {sum(latencies):.2f}s, {stream.writes} lines written")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--errors", type=int, default=3)
+    parser.add_argument("--write-ms", type=float, default=0.2)
+    args = parser.parse_args()
+
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="gambot_bench_")
+    import bot
+    root = logging.getLogger()
+    log = logging.getLogger("bench")
+
+    # Как было: форматирование и запись в потоке обработчика
+    stream = SlowStream(args.write_ms / 1000)
+    direct = logging.StreamHandler(stream)
+    direct.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    root.handlers = [direct]
+    report("direct StreamHandler", asyncio.run(flood(log, args.updates, args.errors)), stream)
+
+    # burst=0 отключает отсев: видно, сколько дает сама очередь
+    for label, burst in (("queue, no sampling", 0), ("queue + sampling", bot.LOG_SAMPLE_BURST)):
+        stream = SlowStream(args.write_ms / 1000)
+        output = logging.StreamHandler(stream)
+        output.setFormatter(bot.JsonLogFormatter())
+        handler = bot.LogQueueHandler(bot.queue.Queue(bot.LOG_QUEUE_SIZE), bot.LogSampler(burst=burst))
+        listener = logging.handlers.QueueListener(handler.queue, output)
+        root.handlers = [handler]
+        listener.start()
+        latencies = asyncio.run(flood(log, args.updates, args.errors))
+        listener.stop()
+        report(label, latencies, stream)
+        print(f"  suppressed {handler.sampler.suppressed}, dropped {handler.dropped}")
+
+
+if __name__ == "__main__":
+    main()
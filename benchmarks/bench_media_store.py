@@ -0,0 +1,97 @@
+"""Бенчмарк хранилища медиа: память при потоковой загрузке большого файла, дедупликация и сборка мусора.
+
+Загрузка идет через подменную сессию, которая отдает синтетический файл порциями.
+Пик памяти Python (tracemalloc) не должен зависеть от размера файла.
+
+Запуск: python benchmarks/bench_media_store.py [--size-mb 256]
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def make_session(size: int, seed: bytes):
+    from aiogram import methods, types
+    from mocked_bot import MockedSession
+
+    class UploadSession(MockedSession):
+        async def make_request(self, bot, method, timeout=None):
+            if isinstance(method, methods.GetFile):
+                return types.File(file_id=method.file_id, file_unique_id="u", file_size=size, file_path="documents/file")
+            return await super().make_request(bot, method, timeout)
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            block = (seed * (chunk_size // len(seed) + 1))[:chunk_size]
+            sent = 0
+            while sent < size:
+                chunk = block[:min(chunk_size, size - sent)]
+                sent += len(chunk)
+                yield chunk
+
+    return UploadSession()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=256)
+    args = parser.parse_args()
+
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="gambot_bench_")
+    import logging
+    import bot
+    from aiogram import Bot
+    logging.disable(logging.INFO)
+    bot.init_files()
+    bot.games_catalog.all()
+
+    async def run():
+        size = args.size_mb * 1024 * 1024
+        mocked = Bot(token="123:ABC", session=make_session(size, b"gambot"))
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        path = await bot.media_store.download(mocked, "FILE1", ".zip")
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"streamed {args.size_mb} MB in {elapsed:.2f}s ({args.size_mb / elapsed:.0f} MB/s), "
+              f"python peak {peak / 1024 / 1024:.2f} MB, chunk {bot.MEDIA_CHUNK_SIZE // 1024} KB")
+
+        digest = hashlib.sha256()
+        with open(os.path.join(bot.DATA_DIR, path), "rb") as f:
+            while chunk := f.read(1 << 20):
+                digest.update(chunk)
+        assert path.endswith(digest.hexdigest() + ".zip"), path
+
+        # Та же загрузка для другой игры - второй копии на диске нет
+        small = Bot(token="123:ABC", session=make_session(1024 * 1024, b"cover"))
+        first = await bot.media_store.download(small, "PHOTO1", ".jpg")
+        second = await bot.media_store.download(small, "PHOTO2", ".jpg")
+        assert first == second
+        await bot.games_catalog.set("Game A", {"description": "", "photo": first, "file": path})
+        await bot.games_catalog.set("Game B", {"description": "", "photo": second})
+        media_files = [name for _, _, names in os.walk(bot.MEDIA_DIR) for name in names]
+        print(f"dedup: 3 uploads -> {len(media_files)} files on disk")
+        assert len(media_files) == 2
+
+        await bot.games_catalog.delete("Game A")
+        await bot.media_store.collect()
+        assert os.path.exists(os.path.join(bot.DATA_DIR, first))
+        assert not os.path.exists(os.path.join(bot.DATA_DIR, path))
+        await bot.games_catalog.delete("Game B")
+        await bot.media_store.collect()
+        assert not os.path.exists(os.path.join(bot.DATA_DIR, first))
+        print("gc: shared cover kept until its last game was deleted")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
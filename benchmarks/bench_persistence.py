@@ -0,0 +1,60 @@
+"""Бенчмарк отложенной записи: всплеск новых пользователей через save_user.
+
+Запуск: python benchmarks/bench_persistence.py [--users 10000] [--naive 1000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def make_user(types, i: int):
+    return types.User(id=100000 + i, is_bot=False, first_name=f"User{i}", username=f"user_{i}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--naive", type=int, default=1000, help="сколько пользователей прогнать старым способом")
+    args = parser.parse_args()
+
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="gambot_bench_")
+    import logging
+    import bot
+    from aiogram import types
+    logging.disable(logging.INFO)
+    bot.init_files()
+
+    # Write-behind: запись на диск только по порогу + финальный сброс
+    async def burst():
+        for i in range(args.users):
+            await bot.save_user(make_user(types, i))
+        await bot.run_io(bot.storage.flush)
+
+    start = time.perf_counter()
+    asyncio.run(burst())
+    elapsed = time.perf_counter() - start
+    print(f"write-behind: {args.users} users, {bot.storage.users.writes} file writes, {elapsed:.3f}s")
+    assert len(bot.load_json(bot.USERS_FILE)) == args.users
+
+    # Старое поведение: полная перезапись users.json на каждого пользователя
+    naive_file = os.path.join(os.environ["DATA_DIR"], "naive_users.json")
+    users = {}
+    start = time.perf_counter()
+    for i in range(args.naive):
+        user = make_user(types, i)
+        users[str(user.id)] = {"username": user.username, "first_name": user.first_name,
+                               "last_name": user.last_name, "joined": ""}
+        with open(naive_file, "w", encoding="utf-8") as f:
+            json.dump(users, f, ensure_ascii=False, indent=2)
+    elapsed = time.perf_counter() - start
+    print(f"full rewrite: {args.naive} users, {args.naive} file writes, {elapsed:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Бенчмарк ограничителя исходящих запросов против имитации лимитов Telegram.
+
+Имитация отвечает 429 (TelegramRetryAfter), если за последнюю секунду было больше 30 отправок
+всего или больше RATE_LIMIT_CHAT_BURST в один чат. Всплеск отправляется без ограничителя и с ним.
+
+Запуск: python benchmarks/bench_rate_limit.py [--messages 300] [--chats 100]
+"""
+import argparse
+import asyncio
+import collections
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def make_flood_session(global_limit: int, chat_limit: int):
+    from aiogram.exceptions import TelegramRetryAfter
+    from mocked_bot import MockedSession
+
+    class FloodSession(MockedSession):
+        def __init__(self):
+            super().__init__()
+            self.sent = collections.deque()
+            self.per_chat = collections.defaultdict(collections.deque)
+            self.flood_errors = 0
+
+        async def make_request(self, bot, method, timeout=None):
+            chat_id = getattr(method, "chat_id", None)
+            if chat_id is not None:
+                now = time.monotonic()
+                for window in (self.sent, self.per_chat[chat_id]):
+                    while window and window[0] <= now - 1:
+                        window.popleft()
+                if len(self.sent) >= global_limit or len(self.per_chat[chat_id]) >= chat_limit:
+                    self.flood_errors += 1
+                    raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=1)
+                self.sent.append(now)
+                self.per_chat[chat_id].append(now)
+            return await super().make_request(bot, method, timeout)
+
+    return FloodSession()
+
+
+async def burst(bot_module, limiter, messages: int, chats: int):
+    from aiogram import Bot
+    from aiogram.exceptions import TelegramRetryAfter
+
+    session = make_flood_session(30, bot_module.RATE_LIMIT_CHAT_BURST)
+    bot = Bot(token="123:ABC", session=session)
+    if limiter is not None:
+        bot.session.middleware(limiter)
+    rnd = random.Random(42)
+    # Часть сообщений уходит в несколько «горячих» чатов
+    targets = [rnd.randint(1, 5) if rnd.random() < 0.1 else rnd.randint(10, 10 + chats) for _ in range(messages)]
+    failed = 0
+
+    async def send(chat_id: int):
+        nonlocal failed
+        try:
+            await bot.send_message(chat_id, "🎮")
+        except TelegramRetryAfter:
+            failed += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send(chat_id) for chat_id in targets))
+    elapsed = time.perf_counter() - start
+    delivered = messages - failed
+    return delivered, failed, session.flood_errors, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--chats", type=int, default=100)
+    args = parser.parse_args()
+
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="gambot_bench_")
+    import logging
+    import bot
+    logging.disable(logging.WARNING)
+
+    delivered, failed, errors, elapsed = asyncio.run(burst(bot, None, args.messages, args.chats))
+    print(f"no limiter: {delivered} delivered, {failed} failed, {errors} x 429, {elapsed:.2f}s")
+
+    limiter = bot.OutboundRateLimiter()
+    delivered, failed, errors, elapsed = asyncio.run(burst(bot, limiter, args.messages, args.chats))
+    stats = limiter.stats()
+    print(f"limiter: {delivered} delivered, {failed} failed, {errors} x 429, {elapsed:.2f}s, "
+          f"{delivered / elapsed:.1f} msg/s, avg wait {stats['avg_wait']:.2f}s, max wait {stats['max_wait']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
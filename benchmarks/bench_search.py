@@ -0,0 +1,88 @@
+"""Бенчмарк поиска по каталогу: задержка GameSearchIndex.search на синтетическом каталоге.
+
+Запуск: python benchmarks/bench_search.py [--games 10000] [--queries 2000]
+Цель: p99 без кэша запросов < 5 мс на 10k игр.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+LATIN_WORDS = ["dark", "souls", "grand", "theft", "auto", "space", "legend", "racing", "hero", "city",
+               "night", "shadow", "war", "empire", "dragon", "quest", "storm", "galaxy", "ranger", "force"]
+CYRILLIC_WORDS = ["тёмные", "души", "герой", "город", "ночь", "тень", "война", "империя", "дракон",
+                  "поход", "буря", "галактика", "странник", "сила", "метро", "сталкер", "ведьмак"]
+
+
+def make_catalog(count: int, rnd: random.Random) -> dict:
+    games = {}
+    words = LATIN_WORDS + CYRILLIC_WORDS
+    while len(games) < count:
+        name = " ".join(rnd.choice(words).capitalize() for _ in range(rnd.randint(1, 3))) + f" {len(games)}"
+        description = " ".join(rnd.choice(words) for _ in range(rnd.randint(20, 60)))
+        games[name] = {"description": description, "added_by": "bench", "added_date": ""}
+    return games
+
+
+def make_queries(count: int, rnd: random.Random) -> list:
+    words = LATIN_WORDS + CYRILLIC_WORDS
+    queries = []
+    for _ in range(count):
+        word = rnd.choice(words)
+        kind = rnd.random()
+        if kind < 0.4:
+            queries.append(word[:rnd.randint(2, len(word))])
+        elif kind < 0.7:
+            # Опечатка: пропущенная буква
+            position = rnd.randrange(len(word))
+            queries.append(word[:position] + word[position + 1:])
+        else:
+            queries.append(f"{word} {rnd.choice(words)[:3]}")
+    return queries
+
+
+def percentile(samples: list, q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="gambot_bench_")
+    import logging
+    import bot
+    logging.disable(logging.INFO)
+    bot.init_files()
+    with open(bot.DB_FILE, "w", encoding="utf-8") as f:
+        json.dump(make_catalog(args.games, rnd), f, ensure_ascii=False)
+
+    start = time.perf_counter()
+    bot.search_index.rebuild(bot.games_catalog.all())
+    print(f"index build: {args.games} games, {time.perf_counter() - start:.3f}s")
+
+    queries = make_queries(args.queries, rnd)
+    for label, clear_cache in (("cold", True), ("cached", False)):
+        timings = []
+        for query in queries:
+            if clear_cache:
+                bot.search_index._results.clear()
+            start = time.perf_counter()
+            bot.search_index.search(query)
+            timings.append((time.perf_counter() - start) * 1000)
+        print(f"{label}: p50={statistics.median(timings):.3f} ms, "
+              f"p99={percentile(timings, 0.99):.3f} ms, max={max(timings):.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""Набор микробенчмарков: хранилище, клавиатуры и горячие пути обработчиков на синтетических данных.
+
+Каждый набор данных (10/1k/100k игр, 1k/1M пользователей) прогоняется в отдельном процессе со своим DATA_DIR,
+запросы к Bot API идут в подменную сессию. Результаты пишутся в JSON; --compare сравнивает с прошлым прогоном
+и завершается с кодом 1, если лучшее время какого-либо замера (min_us, меньше всего зависит от шума)
+выросло больше порога.
+
+Запуск: python benchmarks/bench_suite.py [--games 10,1000,100000] [--users 1000,1000000]
+                                        [--output bench_results.json] [--compare old.json] [--threshold 0.2]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+WORDS = ["dark", "souls", "grand", "theft", "auto", "space", "legend", "racing", "hero", "city",
+         "тёмные", "души", "герой", "город", "ночь", "тень", "война", "империя", "дракон", "ведьмак"]
+
+
+def result(name: str, dataset: str, ops: int, timings: list) -> dict:
+    """timings - время одного повтора из ops операций, секунды"""
+    per_op = [elapsed / ops * 1e6 for elapsed in timings]
+    return {"benchmark": name, "dataset": dataset, "ops": ops, "repeat": len(timings),
+            "median_us": round(statistics.median(per_op), 3), "min_us": round(min(per_op), 3)}
+
+
+def measure(func, ops: int, repeat: int) -> list:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(ops):
+            func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+async def ameasure(func, ops: int, repeat: int) -> list:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(ops):
+            await func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def make_users(count: int) -> dict:
+    return {str(100000 + i): {"username": f"user_{i}", "first_name": f"User{i}", "last_name": None,
+                              "joined": "2024-01-01T00:00:00"} for i in range(count)}
+
+
+def make_games(count: int, rnd: random.Random) -> dict:
+    games = {}
+    for i in range(count):
+        name = " ".join(rnd.choice(WORDS).capitalize() for _ in range(rnd.randint(1, 3))) + f" {i}"
+        game = {"description": " ".join(rnd.choice(WORDS) for _ in range(40)), "added_by": "bench",
+                "added_date": "2024-01-01T00:00:00", "file": f"{i}.zip", "original_url": "https://example.com"}
+        if i % 10 == 0:
+            game.update(photo=f"{i}.jpg", photo_file_id=f"FILE{i}")
+        games[name] = game
+    return games
+
+
+def run_users(count: int, repeat: int) -> list:
+    import bot
+    from aiogram import types
+    dataset = f"users={count}"
+    results = []
+    users = make_users(count)
+    bot.save_json(users, bot.USERS_FILE)
+    bot.save_json({str(100000 + i): "2024-01-01T00:00:00" for i in range(0, count, 100)}, bot.BLOCKED_USERS_FILE)
+
+    file_repeat = repeat if count <= 100000 else 1
+    results.append(result("load_json", dataset, 1, measure(lambda: bot.load_json(bot.USERS_FILE), 1, file_repeat)))
+    target = os.path.join(bot.DATA_DIR, "users_copy.json")
+    results.append(result("save_json", dataset, 1, measure(lambda: bot.save_json(users, target), 1, file_repeat)))
+    del users
+
+    bot.user_index.load()
+    rnd = random.Random(42)
+    ids = [100000 + rnd.randrange(count) for _ in range(10000)]
+    names = [f"user_{rnd.randrange(count)}" for _ in range(10000)]
+    lookups = iter(ids * (repeat + 1))
+    results.append(result("is_user_blocked", dataset, len(ids),
+                          measure(lambda: bot.is_user_blocked(next(lookups)), len(ids), repeat)))
+    lookups = iter(names * (repeat + 1))
+    results.append(result("get_user_id_by_username", dataset, len(names),
+                          measure(lambda: bot.get_user_id_by_username(next(lookups)), len(names), repeat)))
+
+    new_users = iter([types.User(id=10_000_000 + i, is_bot=False, first_name="New", username=f"new_{i}")
+                      for i in range(1000 * repeat)])
+
+    async def save_users():
+        timings = await ameasure(lambda: bot.save_user(next(new_users)), 1000, repeat)
+        await bot.run_io(bot.storage.flush)
+        return timings
+
+    results.append(result("save_user", dataset, 1000, asyncio.run(save_users())))
+    results.append(result("render_users_page", dataset, 100,
+                          asyncio.run(ameasure(lambda: bot.render_users_page("new", "active"), 100, repeat))))
+
+    # Без ограничения очереди: меряется постановка события, а не отбрасывание
+    event_log = bot.EventLog(maxsize=0)
+    results.append(result("event_log_emit", dataset, 10000,
+                          measure(lambda: event_log.emit("view", 100000, g="Game"), 10000, repeat)))
+    return results
+
+
+def run_games(count: int, repeat: int) -> list:
+    import bot
+    from aiogram import Bot, types
+    from mocked_bot import MockedSession, callback_update, message_update
+    dataset = f"games={count}"
+    results = []
+    games = make_games(count, random.Random(42))
+    bot.save_json(games, bot.DB_FILE)
+    results.append(result("load_json", dataset, 1, measure(lambda: bot.load_json(bot.DB_FILE), 1, repeat)))
+    target = os.path.join(bot.DATA_DIR, "games_copy.json")
+    results.append(result("save_json", dataset, 1, measure(lambda: bot.save_json(games, target), 1, repeat)))
+    bot.games_catalog.all()
+    bot.user_index.load()
+
+    user = types.User(id=1, is_bot=False, first_name="Bench", username="bench")
+    results.append(result("get_main_keyboard", dataset, 10000,
+                          measure(lambda: bot.get_main_keyboard(user), 10000, repeat)))
+
+    def render_cold():
+        bot.game_picker_keyboards._version = None
+        bot.render_game_picker("games")
+
+    cold_ops = 1 if count >= 100000 else 20
+    results.append(result("render_game_picker_cold", dataset, cold_ops, measure(render_cold, cold_ops, repeat)))
+    results.append(result("render_game_picker_warm", dataset, 10000,
+                          measure(lambda: bot.render_game_picker("games", 3), 10000, repeat)))
+
+    async def handlers():
+        session = MockedSession()
+        mocked = Bot(token="123:ABC", session=session)
+        dp = bot.create_dispatcher()
+        message = message_update(1, 1, "🎮 Список игр").message.as_(mocked)
+        out = [result("show_games_list", dataset, 1000,
+                      await ameasure(lambda: bot.show_games_list(message), 1000, repeat))]
+
+        game_ids = [game["id"] for game in bot.games_catalog.all().values()]
+        rnd = random.Random(7)
+        updates = iter([
+            callback_update(10 + i, 1000 + i % 50, bot.GameCallback(action="view", game_id=rnd.choice(game_ids)).pack())
+            for i in range(1000 * repeat)
+        ])
+        out.append(result("handle_game_selection", dataset, 1000,
+                          await ameasure(lambda: dp.feed_update(mocked, next(updates)), 1000, repeat)))
+        return out
+
+    results.extend(asyncio.run(handlers()))
+    return results
+
+
+def run_worker(kind: str, count: int, repeat: int, output: str):
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="gambot_bench_")
+    os.environ["METRICS_PORT"] = "0"
+    import logging
+    import bot
+    logging.disable(logging.WARNING)
+    bot.init_files()
+    results = run_users(count, repeat) if kind == "users" else run_games(count, repeat)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f)
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list, baseline_file: str, threshold: float) -> bool:
+    with open(baseline_file, encoding="utf-8") as f:
+        baseline = {(item["benchmark"], item["dataset"]): item for item in json.load(f)["results"]}
+    ok = True
+    for item in results:
+        old = baseline.get((item["benchmark"], item["dataset"]))
+        if not old:
+            continue
+        change = item["min_us"] / old["min_us"] - 1 if old["min_us"] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            ok = False
+        print(f"{item['benchmark']:<28} {item['dataset']:<14} {old['min_us']:>12.2f} -> "
+              f"{item['min_us']:>12.2f} us ({change:+.0%}){flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", default="10,1000,100000")
+    parser.add_argument("--users", default="1000,1000000")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="JSON прошлого прогона")
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимый рост времени, доля")
+    parser.add_argument("--worker", nargs=2, metavar=("KIND", "COUNT"), help=argparse.SUPPRESS)
+    parser.add_argument("--worker-output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker[0], int(args.worker[1]), args.repeat, args.worker_output)
+        return
+
+    datasets = [("users", int(count)) for count in args.users.split(",") if count] + \
+               [("games", int(count)) for count in args.games.split(",") if count]
+    results = []
+    for kind, count in datasets:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
+            worker_output = tmp.name
+        started = time.perf_counter()
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", kind, str(count),
+                        "--repeat", str(args.repeat), "--worker-output", worker_output], check=True)
+        with open(worker_output, encoding="utf-8") as f:
+            dataset_results = json.load(f)
+        os.remove(worker_output)
+        print(f"{kind}={count}: {time.perf_counter() - started:.1f}s")
+        for item in dataset_results:
+            print(f"  {item['benchmark']:<28} median {item['median_us']:>12.2f} us/op  min {item['min_us']:>12.2f}")
+        results.extend(dataset_results)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.compare and not compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Бенчмарк режима webhook: синтетические обновления через локальный aiohttp-сервер против polling.
+
+Задержка считается от отправки обновления до первого исходящего вызова Bot API из обработчика.
+Заодно проверяется, что запрос без секрета отклоняется, а /health отвечает.
+
+Запуск: python benchmarks/bench_webhook.py [--updates 2000] [--concurrency 50]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+SECRET = "bench-secret"
+
+
+def percentile(samples: list, q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def report(label: str, timings: list, elapsed: float):
+    print(f"{label}: {len(timings)} updates, {len(timings) / elapsed:.0f} upd/s, "
+          f"p50={statistics.median(timings):.2f} ms, p99={percentile(timings, 0.99):.2f} ms")
+
+
+async def bench_webhook(bot_module, session, count: int, concurrency: int, first_id: int):
+    from aiogram import Bot
+    from aiohttp import ClientSession, web
+    from mocked_bot import message_update
+
+    bot = Bot(token="123:ABC", session=session)
+    dp = bot_module.create_dispatcher()
+    runner = web.AppRunner(bot_module.create_webhook_app(bot, dp))
+    await runner.setup()
+    site = web.TCPSite(runner, host="127.0.0.1", port=0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}{bot_module.WEBHOOK_PATH}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+
+    async with ClientSession() as client:
+        async with client.get(f"http://127.0.0.1:{port}/health") as response:
+            assert response.status == 200, response.status
+        async with client.post(url, json=message_update(1, 1, "/start").model_dump(mode="json", exclude_none=True)) as response:
+            assert response.status == 401, f"запрос без секрета принят: {response.status}"
+
+        timings = []
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send(update_id: int):
+            async with semaphore:
+                update = message_update(update_id, update_id, "/start")
+                done = session.wait_for_chat(update_id)
+                start = time.perf_counter()
+                async with client.post(url, json=update.model_dump(mode="json", exclude_none=True),
+                                       headers=headers) as response:
+                    assert response.status == 200, response.status
+                timings.append((await done - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(send(first_id + i) for i in range(count)))
+        elapsed = time.perf_counter() - start
+    await runner.cleanup()
+    return timings, elapsed
+
+
+async def bench_polling(bot_module, session, count: int, concurrency: int, first_id: int):
+    from aiogram import Bot
+    from mocked_bot import message_update
+
+    bot = Bot(token="123:ABC", session=session)
+    dp = bot_module.create_dispatcher()
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+
+    timings = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(update_id: int):
+        async with semaphore:
+            done = session.wait_for_chat(update_id)
+            start = time.perf_counter()
+            session.updates.put_nowait(message_update(update_id, update_id, "/start"))
+            timings.append((await done - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send(first_id + i) for i in range(count)))
+    elapsed = time.perf_counter() - start
+    await dp.stop_polling()
+    await polling
+    return timings, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="gambot_bench_")
+    os.environ["WEBHOOK_SECRET"] = SECRET
+    import logging
+    import bot
+    from mocked_bot import MockedSession
+    logging.disable(logging.INFO)
+    bot.init_files()
+    bot.user_index.load()
+    bot.games_catalog.all()
+
+    async def run():
+        timings, elapsed = await bench_webhook(bot, MockedSession(), args.updates, args.concurrency, 1000)
+        report("webhook", timings, elapsed)
+        timings, elapsed = await bench_polling(bot, MockedSession(), args.updates, args.concurrency, 1000 + args.updates)
+        report("polling", timings, elapsed)
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""Нагрузочный тест всего бота: локальный фейковый Bot API на aiohttp и тысячи синтетических пользователей.
+
+Бот запускается отдельным процессом (python bot.py) с TELEGRAM_API_URL, указывающим на фейковый сервер.
+Сервер отдает getUpdates из сценария, принимает sendMessage/editMessageText/sendPhoto и остальные вызовы,
+может добавлять задержку и отвечать 429. Задержка обновления считается от его появления в очереди getUpdates
+до первого ответа бота в этот чат.
+
+Сценарий по умолчанию: каждый пользователь отправляет /start, открывает «🎮 Список игр» и нажимает случайную
+игру из присланной клавиатуры, и так --rounds раз. --record сохраняет действия в JSONL, --replay проигрывает
+такой файл: строки {"user_id": ..., "text": ...} или {"user_id": ..., "callback_data": ...}, действия одного
+пользователя идут по порядку, разные пользователи - параллельно.
+
+Запуск: python benchmarks/loadgen.py [--users 2000] [--rounds 3] [--games 1000] [--latency 20]
+                                    [--error-rate 0.01] [--real-limits] [--record FILE | --replay FILE]
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import signal
+import statistics
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Методы, на которые сервер добавляет задержку и может ответить 429
+SEND_METHODS = {"sendMessage", "editMessageText", "sendPhoto", "sendDocument", "copyMessage", "editMessageReplyMarkup"}
+REPLY_TIMEOUT = 30
+
+
+def percentile(samples: list, q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def rss_mb(pid: int) -> float | None:
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+class FakeBotAPI:
+    """Заглушка Bot API: очередь обновлений для getUpdates и ответы на исходящие вызовы"""
+
+    def __init__(self, latency: float, error_rate: float, rnd: random.Random):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rnd = rnd
+        self.pending = collections.deque()
+        self.has_updates = asyncio.Event()
+        self.polled = asyncio.Event()
+        self.waiters: dict = {}
+        self.calls = collections.Counter()
+        self.injected_429 = 0
+        self._update_id = 0
+        self._message_id = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    def push(self, update: dict) -> None:
+        self._update_id += 1
+        update["update_id"] = self._update_id
+        self.pending.append(update)
+        self.has_updates.set()
+
+    def wait_for_reply(self, chat_id: int) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[chat_id] = future
+        return future
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        form = await request.post()
+        params = {key: value for key, value in form.items() if isinstance(value, str)}
+        self.calls[method] += 1
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self.get_updates(params)})
+        if method in SEND_METHODS:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if self.error_rate and self.rnd.random() < self.error_rate:
+                self.injected_429 += 1
+                return web.json_response({"ok": False, "error_code": 429,
+                                          "description": "Too Many Requests: retry after 1",
+                                          "parameters": {"retry_after": 1}})
+        return web.json_response({"ok": True, "result": self.result(method, params)})
+
+    async def get_updates(self, params: dict) -> list:
+        self.polled.set()
+        offset = int(params.get("offset") or 0)
+        while self.pending and self.pending[0]["update_id"] < offset:
+            self.pending.popleft()
+        if not self.pending:
+            self.has_updates.clear()
+            try:
+                await asyncio.wait_for(self.has_updates.wait(), timeout=float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                return []
+        limit = int(params.get("limit") or 100)
+        return [self.pending[i] for i in range(min(limit, len(self.pending)))]
+
+    def result(self, method: str, params: dict):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Load", "username": "load_bot"}
+        if method not in SEND_METHODS or "chat_id" not in params:
+            return True
+        chat_id = int(params["chat_id"])
+        future = self.waiters.pop(chat_id, None)
+        if future is not None and not future.done():
+            future.set_result(params)
+        self._message_id += 1
+        if method == "copyMessage":
+            return {"message_id": self._message_id}
+        message = {"message_id": self._message_id, "date": int(time.time()),
+                   "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", "")}
+        if method == "sendPhoto":
+            message["photo"] = [{"file_id": f"PHOTO{self._message_id}", "file_unique_id": f"U{self._message_id}",
+                                 "width": 1, "height": 1}]
+        return message
+
+
+def user_dict(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user_{user_id}"}
+
+
+def make_update(action: dict) -> dict:
+    user_id = action["user_id"]
+    message = {"message_id": random.randint(1, 10 ** 9), "date": int(time.time()),
+               "chat": {"id": user_id, "type": "private"}, "from": user_dict(user_id)}
+    if "callback_data" in action:
+        message["text"] = "🎮"
+        return {"callback_query": {"id": str(random.randint(1, 10 ** 9)), "from": user_dict(user_id),
+                                   "chat_instance": "load", "data": action["callback_data"], "message": message}}
+    message["text"] = action["text"]
+    return {"message": message}
+
+
+def game_buttons(reply: dict) -> list:
+    markup = json.loads(reply.get("reply_markup") or "{}")
+    return [button["callback_data"] for row in markup.get("inline_keyboard", []) for button in row
+            if button.get("callback_data", "").startswith("g:")]
+
+
+class LoadRun:
+    def __init__(self, api: FakeBotAPI):
+        self.api = api
+        self.latencies = []
+        self.lost = 0
+        self.recorded = []
+
+    async def act(self, action: dict) -> dict | None:
+        self.recorded.append(action)
+        reply = self.api.wait_for_reply(action["user_id"])
+        start = time.perf_counter()
+        self.api.push(make_update(action))
+        try:
+            params = await asyncio.wait_for(reply, timeout=REPLY_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.lost += 1
+            return None
+        self.latencies.append((time.perf_counter() - start) * 1000)
+        return params
+
+    async def scenario_user(self, user_id: int, rounds: int, rnd: random.Random, think: float):
+        await asyncio.sleep(rnd.random() * think)
+        for _ in range(rounds):
+            await self.act({"user_id": user_id, "text": "/start"})
+            reply = await self.act({"user_id": user_id, "text": "🎮 Список игр"})
+            buttons = game_buttons(reply) if reply else []
+            if buttons:
+                await self.act({"user_id": user_id, "callback_data": rnd.choice(buttons)})
+            await asyncio.sleep(rnd.random() * think)
+
+    async def replay_user(self, actions: list):
+        for action in actions:
+            await self.act(action)
+
+
+def write_games(data_dir: str, count: int, rnd: random.Random):
+    games = {}
+    for i in range(count):
+        game = {"description": f"Описание игры {i}", "added_by": "load", "added_date": "",
+                "file": f"{i}.zip", "original_url": "https://example.com"}
+        if i % 10 == 0:
+            game.update(photo=f"{i}.jpg", photo_file_id=f"FILE{i}")
+        games[f"Game {i} {rnd.choice(['Souls', 'Racing', 'Quest', 'Empire'])}"] = game
+    with open(os.path.join(data_dir, "games.json"), "w", encoding="utf-8") as f:
+        json.dump(games, f, ensure_ascii=False)
+
+
+async def run(args):
+    rnd = random.Random(42)
+    api = FakeBotAPI(args.latency / 1000, args.error_rate, rnd)
+    runner = web.AppRunner(api.app())
+    await runner.setup()
+    site = web.TCPSite(runner, host="127.0.0.1", port=0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    data_dir = tempfile.mkdtemp(prefix="gambot_load_")
+    write_games(data_dir, args.games, rnd)
+    env = dict(os.environ, BOT_TOKEN="123:ABC", TELEGRAM_API_URL=f"http://127.0.0.1:{port}",
+               DATA_DIR=data_dir, METRICS_PORT="0", BOT_MODE="polling")
+    if not args.real_limits:
+        # Меряем сам бот, а не ограничитель исходящих запросов
+        env.update(RATE_LIMIT_GLOBAL="1000000", RATE_LIMIT_PER_CHAT="1000000", RATE_LIMIT_CHAT_BURST="1000")
+    log = open(os.path.join(data_dir, "bot.log"), "wb")
+    proc = await asyncio.create_subprocess_exec(sys.executable, os.path.join(ROOT, "bot.py"), env=env,
+                                                stdout=log, stderr=log)
+    try:
+        await asyncio.wait_for(api.polled.wait(), timeout=60)
+        await asyncio.sleep(0.5)
+        rss_start = rss_mb(proc.pid)
+        rss_peak = rss_start or 0.0
+
+        load = LoadRun(api)
+        if args.replay:
+            per_user = collections.defaultdict(list)
+            with open(args.replay, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        action = json.loads(line)
+                        per_user[action["user_id"]].append(action)
+            users = [load.replay_user(actions) for actions in per_user.values()]
+        else:
+            users = [load.scenario_user(1000 + i, args.rounds, random.Random(i), args.think)
+                     for i in range(args.users)]
+
+        start = time.perf_counter()
+        work = asyncio.ensure_future(asyncio.gather(*users))
+        while not work.done():
+            await asyncio.wait([work], timeout=0.5)
+            rss_peak = max(rss_peak, rss_mb(proc.pid) or 0.0)
+        elapsed = time.perf_counter() - start
+        rss_end = rss_mb(proc.pid)
+    finally:
+        if proc.returncode is None:
+            proc.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(proc.wait(), timeout=15)
+            except asyncio.TimeoutError:
+                proc.kill()
+        log.close()
+        await runner.cleanup()
+
+    latencies = load.latencies
+    print(f"updates: {len(latencies)} answered, {load.lost} lost, {elapsed:.1f}s, "
+          f"{len(latencies) / elapsed:.0f} updates/s")
+    if latencies:
+        print(f"latency: p50={statistics.median(latencies):.1f} ms, p99={percentile(latencies, 0.99):.1f} ms, "
+              f"max={max(latencies):.1f} ms")
+    print(f"injected 429: {api.injected_429}; api calls: {dict(api.calls)}")
+    if rss_start is not None:
+        print(f"bot RSS: {rss_start:.1f} MB at start, {rss_peak:.1f} MB peak, {rss_end or 0:.1f} MB at end "
+              f"(+{(rss_end or 0) - rss_start:.1f} MB)")
+    print(f"bot log: {os.path.join(data_dir, 'bot.log')}")
+    if args.record:
+        with open(args.record, "w", encoding="utf-8") as f:
+            for action in load.recorded:
+                f.write(json.dumps(action, ensure_ascii=False) + "\n")
+        print(f"recorded {len(load.recorded)} actions to {args.record}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--think", type=float, default=2.0, help="пауза пользователя между кругами, до N секунд")
+    parser.add_argument("--latency", type=float, default=20, help="задержка фейкового API на отправку, мс")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля отправок, получающих 429")
+    parser.add_argument("--real-limits", action="store_true", help="не ослаблять ограничитель исходящих запросов")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--record", help="сохранить действия сценария в JSONL")
+    group.add_argument("--replay", help="проиграть действия из JSONL")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Подменная сессия aiogram для бенчмарков: запросы к Bot API не уходят в сеть.
+
+Все вызовы записываются, на отправку сообщений возвращается фиктивное сообщение,
+а getUpdates отдает обновления из очереди, поэтому через сессию можно гонять и polling.
+"""
+import asyncio
+import time
+
+from aiogram import methods, types
+from aiogram.client.session.base import BaseSession
+
+
+class MockedSession(BaseSession):
+    def __init__(self):
+        super().__init__()
+        self.updates: asyncio.Queue = asyncio.Queue()
+        self.calls = []
+        self._waiters = {}
+
+    def wait_for_chat(self, chat_id: int) -> asyncio.Future:
+        """Future, который завершится временем первого исходящего вызова в этот чат."""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id] = future
+        return future
+
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, methods.GetUpdates):
+            return await self._get_updates(method)
+        self.calls.append(method)
+        chat_id = getattr(method, "chat_id", None)
+        future = self._waiters.pop(chat_id, None)
+        if future is not None and not future.done():
+            future.set_result(time.perf_counter())
+        if isinstance(method, methods.GetMe):
+            return types.User(id=1, is_bot=True, first_name="Bench", username="bench_bot")
+        if isinstance(method, (methods.SendMessage, methods.SendPhoto, methods.SendDocument,
+                               methods.EditMessageText)):
+            return types.Message(message_id=1, date=0, chat=types.Chat(id=chat_id or 1, type="private"), text="ok")
+        if isinstance(method, methods.CopyMessage):
+            return types.MessageId(message_id=1)
+        return True
+
+    async def _get_updates(self, method):
+        try:
+            first = await asyncio.wait_for(self.updates.get(), timeout=0.5)
+        except asyncio.TimeoutError:
+            return []
+        batch = [first]
+        while not self.updates.empty() and len(batch) < (method.limit or 100):
+            batch.append(self.updates.get_nowait())
+        return batch
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+
+def message_update(update_id: int, user_id: int, text: str) -> types.Update:
+    user = types.User(id=user_id, is_bot=False, first_name=f"User{user_id}", username=f"user_{user_id}")
+    return types.Update(update_id=update_id, message=types.Message(
+        message_id=update_id, date=0, chat=types.Chat(id=user_id, type="private"), from_user=user, text=text
+    ))
+
+
+def callback_update(update_id: int, user_id: int, data: str) -> types.Update:
+    user = types.User(id=user_id, is_bot=False, first_name=f"User{user_id}", username=f"user_{user_id}")
+    return types.Update(update_id=update_id, callback_query=types.CallbackQuery(
+        id=str(update_id), chat_instance="bench", from_user=user, data=data,
+        message=types.Message(message_id=update_id, date=0, chat=types.Chat(id=user_id, type="private"), text="🎮")
+    ))
@@ -1,20 +1,60 @@
 import asyncio
+import atexit
+import cProfile
+import csv
+import hashlib
+import heapq
+import io
 import json
+import multiprocessing
 import os
 import logging
+import logging.handlers
+import pstats
+import queue
+import re
+import signal
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from contextvars import ContextVar
+from functools import partial
+from itertools import islice
 from typing import Dict, Any, List
 from datetime import datetime
+from html import escape
 
-from aiogram import Bot, Dispatcher, types, F
+from aiohttp import web
+from aiogram import BaseMiddleware, Bot, Dispatcher, types, F
 from aiogram.types import (
     InlineKeyboardButton, InlineKeyboardMarkup, 
     InputFile, ReplyKeyboardMarkup, KeyboardButton,
     ReplyKeyboardRemove
 )
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
+from aiogram.filters.callback_data import CallbackData
 from aiogram.enums import ParseMode
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow необязателен: без него обложки отправляются как загружены
+    Image = ImageOps = None
 
 # ========== НАСТРОЙКИ ==========
 # БЕРЕМ ТОКЕН ИЗ ПЕРЕМЕННЫХ ОКРУЖЕНИЯ
@@ -24,8 +64,128 @@ ADMINS = ["Mister_Temich"]
 # ПУТИ ДЛЯ SCALINGO
 DATA_DIR = os.getenv('DATA_DIR', 'data')
 DB_FILE = os.path.join(DATA_DIR, "games.json")
+# Следующий id игры: не уменьшается после удаления, чтобы старые кнопки не открыли другую игру
+GAME_IDS_FILE = os.path.join(DATA_DIR, "game_ids.json")
 USERS_FILE = os.path.join(DATA_DIR, "users.json")
 BLOCKED_USERS_FILE = os.path.join(DATA_DIR, "blocked_users.json")
+SQLITE_FILE = os.path.join(DATA_DIR, "gambot.db")
+# Загруженные админом обложки и файлы игр, по хэшу содержимого
+MEDIA_DIR = os.path.join(DATA_DIR, "media")
+
+# Хранилище: json (файлы выше) или sqlite (python bot.py migrate переносит данные)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json')
+
+# Отложенная запись: сброс на диск раз в FLUSH_INTERVAL секунд или после FLUSH_THRESHOLD изменений
+FLUSH_INTERVAL = float(os.getenv('FLUSH_INTERVAL', '2'))
+FLUSH_THRESHOLD = int(os.getenv('FLUSH_THRESHOLD', '1000'))
+
+# Дисковый ввод-вывод выполняется в отдельном пуле потоков, а не в цикле событий
+IO_WORKERS = int(os.getenv('IO_WORKERS', '4'))
+# Предупреждение в лог, если цикл событий заблокирован дольше порога (секунды)
+LOOP_LAG_THRESHOLD = float(os.getenv('LOOP_LAG_THRESHOLD', '0.1'))
+LOOP_LAG_CHECK_INTERVAL = float(os.getenv('LOOP_LAG_CHECK_INTERVAL', '0.5'))
+# Как часто проверять, не изменился ли каталог извне
+CATALOG_RELOAD_INTERVAL = float(os.getenv('CATALOG_RELOAD_INTERVAL', '5'))
+# Сколько игр показывать на одной странице списка
+GAMES_PAGE_SIZE = int(os.getenv('GAMES_PAGE_SIZE', '10'))
+# Сколько пользователей показывать на одной странице админ-списка
+USERS_PAGE_SIZE = int(os.getenv('USERS_PAGE_SIZE', '20'))
+# Поиск: сколько результатов отдавать, порог похожести для опечаток, кэш запросов
+SEARCH_RESULTS_LIMIT = int(os.getenv('SEARCH_RESULTS_LIMIT', '20'))
+SEARCH_FUZZY_THRESHOLD = float(os.getenv('SEARCH_FUZZY_THRESHOLD', '0.5'))
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', '1024'))
+# Сколько секунд Telegram может кэшировать ответы inline-режима
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', '300'))
+# Размер порции при скачивании загрузок (байты): память не зависит от размера файла
+MEDIA_CHUNK_SIZE = int(os.getenv('MEDIA_CHUNK_SIZE', str(256 * 1024)))
+# Обложки: процессы для пережатия, наибольшая сторона и качество основной версии, формат (JPEG или WEBP),
+# сторона миниатюры (Telegram принимает миниатюры документов в JPEG до 320 пикселей)
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', str(min(4, os.cpu_count() or 1))))
+COVER_MAX_SIDE = int(os.getenv('COVER_MAX_SIDE', '1280'))
+COVER_QUALITY = int(os.getenv('COVER_QUALITY', '82'))
+COVER_FORMAT = os.getenv('COVER_FORMAT', 'JPEG').upper()
+COVER_THUMB_SIDE = int(os.getenv('COVER_THUMB_SIDE', '320'))
+
+# Свой сервер Bot API (локальный telegram-bot-api или нагрузочный стенд), по умолчанию api.telegram.org
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '')
+# Сервер запущен с --local на этой же машине: загрузки копируются с диска по пути из getFile, а не скачиваются
+TELEGRAM_API_LOCAL = os.getenv('TELEGRAM_API_LOCAL', '0') == '1'
+
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Webhook: внешний адрес приложения, путь, секрет для заголовка Telegram и адрес локального сервера
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT = int(os.getenv('PORT', '8080'))
+
+# Хранилище состояний админ-диалогов: memory (один процесс), sqlite (несколько процессов на одном хосте) или redis
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'memory')
+FSM_SQLITE_FILE = os.path.join(DATA_DIR, "fsm.db")
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+# Брошенные диалоги удаляются через FSM_TTL секунд после последнего шага
+FSM_TTL = int(os.getenv('FSM_TTL', '3600'))
+
+# Лимиты исходящих сообщений Telegram (в секунду): всего, в личный чат, в группу (20 в минуту)
+RATE_LIMIT_GLOBAL = float(os.getenv('RATE_LIMIT_GLOBAL', '30'))
+RATE_LIMIT_PER_CHAT = float(os.getenv('RATE_LIMIT_PER_CHAT', '1'))
+RATE_LIMIT_PER_GROUP = float(os.getenv('RATE_LIMIT_PER_GROUP', str(20 / 60)))
+# Сколько сообщений подряд можно отправить в один чат без паузы
+RATE_LIMIT_CHAT_BURST = int(os.getenv('RATE_LIMIT_CHAT_BURST', '3'))
+# Сколько раз повторять запрос после ответа 429 (retry_after)
+RATE_LIMIT_MAX_RETRIES = int(os.getenv('RATE_LIMIT_MAX_RETRIES', '3'))
+
+# Рассылка: прогресс для продолжения после перезапуска, число параллельных отправок,
+# скорость (ниже общего лимита, чтобы обычным ответам оставался запас), размер порции и частота статуса
+BROADCAST_FILE = os.path.join(DATA_DIR, "broadcast.json")
+BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', '8'))
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))
+BROADCAST_BATCH = int(os.getenv('BROADCAST_BATCH', '200'))
+BROADCAST_STATUS_INTERVAL = float(os.getenv('BROADCAST_STATUS_INTERVAL', '5'))
+
+# Журнал действий пользователей: файл (старые части получают суффиксы .1, .2, ...), размер очереди в памяти,
+# наибольшая порция и пауза между записями, размер части и сколько частей хранить
+EVENTS_FILE = os.path.join(DATA_DIR, "events.jsonl")
+EVENTS_QUEUE_SIZE = int(os.getenv('EVENTS_QUEUE_SIZE', '10000'))
+EVENTS_BATCH = int(os.getenv('EVENTS_BATCH', '500'))
+EVENTS_FLUSH_INTERVAL = float(os.getenv('EVENTS_FLUSH_INTERVAL', '1'))
+EVENTS_MAX_BYTES = int(os.getenv('EVENTS_MAX_BYTES', str(10 * 1024 * 1024)))
+EVENTS_BACKUPS = int(os.getenv('EVENTS_BACKUPS', '5'))
+# Сводки по журналу (просмотры игр, активные за день): файл, частота пересчета, сколько дней хранить
+ROLLUPS_FILE = os.path.join(DATA_DIR, "rollups.json")
+ROLLUP_INTERVAL = float(os.getenv('ROLLUP_INTERVAL', '60'))
+ROLLUP_DAYS = int(os.getenv('ROLLUP_DAYS', '90'))
+# Проверка файлов каталога: как часто сканировать в фоне, сколько потоков отдать проверке (отдельно от пула
+# ввода-вывода), сверять ли хэш содержимого файлов из media/ при фоновой проверке (ручная /checkfiles rescan
+# сверяет всегда), через сколько секунд временный файл (.tmp_, .upload_) считается брошенным
+MEDIA_SCAN_INTERVAL = float(os.getenv('MEDIA_SCAN_INTERVAL', '3600'))
+MEDIA_SCAN_WORKERS = int(os.getenv('MEDIA_SCAN_WORKERS', '2'))
+MEDIA_SCAN_VERIFY = os.getenv('MEDIA_SCAN_VERIFY', '0') == '1'
+TEMP_FILE_MAX_AGE = float(os.getenv('TEMP_FILE_MAX_AGE', '3600'))
+# Порядок списка игр для пользователей: added (как добавлены) или popular (сначала популярные)
+GAMES_ORDER = os.getenv('GAMES_ORDER', 'added')
+
+# Логи: уровень, формат (json - одна запись JSON на строку, text - обычный текст), размер очереди записей
+# (при переполнении записи отбрасываются, обработчики не ждут вывода), не больше LOG_SAMPLE_BURST одинаковых
+# предупреждений и ошибок (одно место в коде) за LOG_SAMPLE_WINDOW секунд, остальные только считаются
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_SAMPLE_WINDOW = float(os.getenv('LOG_SAMPLE_WINDOW', '60'))
+LOG_SAMPLE_BURST = int(os.getenv('LOG_SAMPLE_BURST', '10'))
+
+# Профилирование по команде /profile: куда писать файлы pstats, сколько последних хранить,
+# окно по умолчанию и предел (секунды), сколько функций показывать в ответе
+PROFILES_DIR = os.path.join(DATA_DIR, "profiles")
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '10'))
+PROFILE_DEFAULT_SECONDS = float(os.getenv('PROFILE_DEFAULT_SECONDS', '30'))
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '600'))
+PROFILE_TOP = min(int(os.getenv('PROFILE_TOP', '25')), 40)
+
+# Метрики в формате Prometheus на локальном порту (0 - не поднимать сервер)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))
 
 # Тексты
 START_TEXT = """🎮 Добро пожаловать в GameBot!
@@ -35,8 +195,112 @@ START_TEXT = """🎮 Добро пожаловать в GameBot!
 Выберите действие в меню ниже:"""
 # ===============================
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+# ========== ЛОГИРОВАНИЕ ==========
+# Обновление, которое сейчас обрабатывается: update_id, user_id и handler попадают в каждую запись
+log_context: ContextVar[Dict[str, Any] | None] = ContextVar("log_context", default=None)
+LOG_CONTEXT_FIELDS = ("update_id", "user_id", "handler")
+
+class LogSampler(logging.Filter):
+    """Пропускает не больше burst одинаковых предупреждений и ошибок за окно; число пропущенных
+    попадает в первую запись следующего окна"""
+
+    def __init__(self, window: float = LOG_SAMPLE_WINDOW, burst: int = LOG_SAMPLE_BURST):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        # (файл, строка) → [начало окна, записей в окне, пропущено]
+        self._sites: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING or self.burst <= 0:
+            return True
+        # Сообщения собираются из аргументов, поэтому одинаковые ошибки узнаются по месту вызова
+        key = (record.pathname, record.lineno)
+        now = record.created
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or now - site[0] >= self.window:
+                skipped = site[2] if site else 0
+                self._sites[key] = [now, 1, 0]
+                if skipped:
+                    record.suppressed = skipped
+                return True
+            if site[1] < self.burst:
+                site[1] += 1
+                return True
+            site[2] += 1
+            self.suppressed += 1
+            return False
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """Кладет запись в очередь и сразу возвращается: форматирование и вывод идут в потоке QueueListener"""
+
+    def __init__(self, log_queue: queue.Queue, sampler: LogSampler):
+        super().__init__(log_queue)
+        # Лишние повторы отсекаются до постановки в очередь
+        self.sampler = sampler
+        self.addFilter(sampler)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        context = log_context.get()
+        if context:
+            for field in LOG_CONTEXT_FIELDS:
+                setattr(record, field, context.get(field))
+        # Аргументы подставляются сразу (могут измениться), трассировка форматируется уже в потоке вывода
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in LOG_CONTEXT_FIELDS + ("suppressed",):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextLogFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        extra = " ".join(f"{field}={getattr(record, field)}" for field in LOG_CONTEXT_FIELDS + ("suppressed",)
+                         if getattr(record, field, None) is not None)
+        return f"{text} [{extra}]" if extra else text
+
+def setup_logging() -> LogQueueHandler:
+    """Корневой логгер пишет через очередь; stderr обслуживает отдельный поток"""
+    output = logging.StreamHandler()
+    output.setFormatter(JsonLogFormatter() if LOG_FORMAT == "json" else TextLogFormatter())
+    handler = LogQueueHandler(queue.Queue(LOG_QUEUE_SIZE), LogSampler())
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+    listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    listener.start()
+    # Дописать очередь при выходе из процесса
+    atexit.register(listener.stop)
+    return handler
+
+log_handler = setup_logging()
 logger = logging.getLogger(__name__)
 
 # Создание необходимых директорий и файлов
@@ -44,13 +308,14 @@ def init_files():
     """Инициализация файлов и директорий"""
     try:
         os.makedirs(DATA_DIR, exist_ok=True)
+        os.makedirs(MEDIA_DIR, exist_ok=True)
         for file in [DB_FILE, USERS_FILE, BLOCKED_USERS_FILE]:
             if not os.path.exists(file):
                 with open(file, "w", encoding="utf-8") as f:
                     json.dump({}, f, ensure_ascii=False, indent=2)
         logger.info("Files initialized successfully")
     except Exception as e:
-        logger.error(f"Error initializing files: {e}")
+        logger.error("Error initializing files: %s", e)
 
 # States для FSM
 class AdminStates(StatesGroup):
@@ -61,67 +326,2080 @@ class AdminStates(StatesGroup):
     waiting_for_original_url = State()
     waiting_for_username_to_block = State()
     waiting_for_username_to_unblock = State()
+    waiting_for_broadcast_message = State()
+    waiting_for_users_query = State()
+    waiting_for_import_file = State()
 
 def is_admin(username: str | None) -> bool:
     return username in ADMINS if username else False
 
+# ========== МЕТРИКИ ==========
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """Гистограмма задержек с фиксированными корзинами и счетчиком ошибок"""
+
+    __slots__ = ("counts", "total", "count", "errors")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.errors = 0
+
+    def observe(self, seconds: float, error: bool = False):
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        if error:
+            self.errors += 1
+
+    def quantile(self, q: float) -> float:
+        """Верхняя граница корзины, в которую попадает квантиль q"""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+class Metrics:
+    """Задержки обработчиков, ввода-вывода и запросов к Bot API; вывод в текстовом формате Prometheus"""
+
+    # Семейство → (префикс метрик, имя метки, описание)
+    FAMILIES = {
+        "handler": ("gambot_handler", "handler", "Update handlers"),
+        "io": ("gambot_io", "operation", "Blocking storage and media operations in the I/O pool"),
+        "api": ("gambot_api", "method", "Outbound Bot API requests"),
+    }
+
+    def __init__(self):
+        self.families: Dict[str, Dict[str, Histogram]] = {family: {} for family in self.FAMILIES}
+        self.gauges: Dict[str, tuple] = {}
+        self.counters: Dict[str, tuple] = {}
+
+    def observe(self, family: str, label: str, seconds: float, error: bool = False):
+        histograms = self.families[family]
+        histogram = histograms.get(label)
+        if histogram is None:
+            histogram = histograms[label] = Histogram()
+        histogram.observe(seconds, error)
+
+    def gauge(self, name: str, description: str, func):
+        """Значение, которое считывается в момент выдачи метрик"""
+        self.gauges[name] = (description, func)
+
+    def counter(self, name: str, description: str, func):
+        """Растущий счетчик, который считывается в момент выдачи метрик (имя без суффикса _total)"""
+        self.counters[name + "_total"] = (description, func)
+
+    def render(self) -> str:
+        lines = []
+        for family, (prefix, label_name, description) in self.FAMILIES.items():
+            histograms = [
+                (label.replace("\\", "\\\\").replace('"', '\\"'), histogram)
+                for label, histogram in sorted(self.families[family].items())
+            ]
+            lines.append(f"# HELP {prefix}_latency_seconds {description}: latency")
+            lines.append(f"# TYPE {prefix}_latency_seconds histogram")
+            for label, histogram in histograms:
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{prefix}_latency_seconds_bucket{{{label_name}="{label}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_latency_seconds_sum{{{label_name}="{label}"}} {histogram.total}')
+                lines.append(f'{prefix}_latency_seconds_count{{{label_name}="{label}"}} {histogram.count}')
+            lines.append(f"# HELP {prefix}_errors_total {description}: errors")
+            lines.append(f"# TYPE {prefix}_errors_total counter")
+            for label, histogram in histograms:
+                lines.append(f'{prefix}_errors_total{{{label_name}="{label}"}} {histogram.errors}')
+        for name, (description, func) in self.gauges.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {func()}")
+        for name, (description, func) in self.counters.items():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {func()}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+metrics.gauge("gambot_log_queued", "Log records waiting to be written", lambda: log_handler.queue.qsize())
+metrics.counter("gambot_log_dropped", "Log records dropped because the queue was full", lambda: log_handler.dropped)
+metrics.counter("gambot_log_suppressed", "Repeated warnings and errors skipped by sampling",
+                lambda: log_handler.sampler.suppressed)
+
+# ========== ВВОД-ВЫВОД ==========
+IO_EXECUTOR = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+
+async def run_io(func, *args, **kwargs):
+    """Выполнить блокирующую операцию в пуле ввода-вывода"""
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    error = False
+    try:
+        return await loop.run_in_executor(IO_EXECUTOR, partial(func, *args, **kwargs))
+    except Exception:
+        error = True
+        raise
+    finally:
+        # Время с учетом ожидания свободного потока - столько же ждет обработчик
+        metrics.observe("io", getattr(func, "__qualname__", type(func).__name__), time.perf_counter() - start, error)
+
+def remove_file(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def file_size(path: str) -> int | None:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+async def monitor_event_loop_lag(interval: float = LOOP_LAG_CHECK_INTERVAL, threshold: float = LOOP_LAG_THRESHOLD):
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = loop.time() - started - interval
+        if lag > threshold:
+            logger.warning("Event loop blocked for %.0f ms", lag * 1000)
+
 def load_json(file: str) -> Dict[str, Any]:
     try:
         with open(file, "r", encoding="utf-8") as f:
             return json.load(f)
     except Exception as e:
-        logger.error(f"Error loading {file}: {e}")
+        logger.error("Error loading %s: %s", file, e)
         return {}
 
-def save_json(data: Dict[str, Any], file: str):
+def save_json(data: Dict[str, Any], file: str) -> bool:
+    # Пишем во временный файл и атомарно подменяем, чтобы сбой не оставил битый JSON
+    tmp_path = None
     try:
-        with open(file, "w", encoding="utf-8") as f:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file) or ".", prefix=".tmp_", suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file)
+        return True
     except Exception as e:
-        logger.error(f"Error saving {file}: {e}")
-
-def save_user(user: types.User):
-    users = load_json(USERS_FILE)
-    user_id = str(user.id)
-    
-    if user_id not in users:
-        users[user_id] = {
-            "username": user.username,
-            "first_name": user.first_name,
-            "last_name": user.last_name,
-            "joined": datetime.now().isoformat()
-        }
-        save_json(users, USERS_FILE)
+        logger.error("Error saving %s: %s", file, e)
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+class JsonStore:
+    """JSON-файл в памяти с отложенной (write-behind) записью на диск"""
+
+    def __init__(self, file: str, flush_threshold: int = FLUSH_THRESHOLD):
+        self.file = file
+        self.flush_threshold = flush_threshold
+        self.writes = 0
+        # Данные меняются из пула ввода-вывода: lock защищает словарь, flush_lock - порядок записей
+        self.lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._data: Dict[str, Any] | None = None
+        self._dirty = 0
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        if self._data is None:
+            with self.lock:
+                if self._data is None:
+                    self._data = load_json(self.file)
+        return self._data
+
+    def mark_dirty(self):
+        with self.lock:
+            self._dirty += 1
+            should_flush = self._dirty >= self.flush_threshold
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self.lock:
+                if not self._dirty:
+                    return
+                # Изменения, сделанные во время записи, попадут в следующий сброс
+                dirty, self._dirty = self._dirty, 0
+                snapshot = dict(self.data)
+            if save_json(snapshot, self.file):
+                self.writes += 1
+            else:
+                with self.lock:
+                    self._dirty += dirty
+
+def iter_json_items(file, chunk_size: int = 1 << 16):
+    """Потоковое чтение пар ключ/значение верхнего уровня JSON-объекта; file - путь или открытый текстовый поток"""
+    decoder = json.JSONDecoder()
+    with open(file, "r", encoding="utf-8") if isinstance(file, str) else nullcontext(file) as f:
+        buf, pos, eof = "", 0, False
+
+        def read_more() -> bool:
+            nonlocal buf, pos, eof
+            if eof:
+                return False
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+                return False
+            buf, pos = buf[pos:] + chunk, 0
+            return True
+
+        def skip(chars: str) -> str | None:
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in chars:
+                    pos += 1
+                if pos < len(buf):
+                    return buf[pos]
+                if not read_more():
+                    return None
+
+        def decode() -> Any:
+            nonlocal pos
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    # Число на границе буфера может быть обрезано - дочитываем
+                    if end < len(buf) or eof:
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                if not read_more():
+                    value, pos = decoder.raw_decode(buf, pos)
+                    return value
+
+        if skip(" \t\r\n") != "{":
+            raise ValueError(f"{file}: expected JSON object")
+        pos += 1
+        while True:
+            char = skip(" \t\r\n,")
+            if char is None:
+                raise ValueError(f"{file}: unexpected end of file")
+            if char == "}":
+                return
+            key = decode()
+            if skip(" \t\r\n") != ":":
+                raise ValueError(f"{file}: expected ':' after {key!r}")
+            pos += 1
+            skip(" \t\r\n")
+            yield key, decode()
+
+# ========== ХРАНИЛИЩЕ ==========
+# Методы хранилищ синхронные и вызываются через run_io из пула ввода-вывода
+class JsonStorage:
+    """Хранение в JSON-файлах (по умолчанию)"""
+
+    def __init__(self):
+        self.users = JsonStore(USERS_FILE)
+        self.blocked_users = JsonStore(BLOCKED_USERS_FILE)
+        # id пользователей в порядке добавления: страница рассылки - срез, а не проход по словарю с начала
+        self._user_order: List[str] | None = None
+        self._games_lock = threading.Lock()
+        self._games: Dict[str, Any] = {}
+
+    # Пользователи
+    def add_user(self, user_id: int, user_data: Dict[str, Any]) -> bool:
+        """Добавить пользователя; True, если он новый"""
+        with self.users.lock:
+            users = self.users.data
+            if str(user_id) in users:
+                # Повторный /start снимает отметку о блокировке бота
+                if users[str(user_id)].pop("inactive", None) is None:
+                    return False
+                added = False
+            else:
+                users[str(user_id)] = user_data
+                if self._user_order is not None:
+                    self._user_order.append(str(user_id))
+                added = True
+        self.users.mark_dirty()
+        return added
+
+    def mark_inactive(self, user_id: int):
+        with self.users.lock:
+            user_data = self.users.data.get(str(user_id))
+            if user_data is None or user_data.get("inactive"):
+                return
+            user_data["inactive"] = True
+        self.users.mark_dirty()
+
+    def user_ids_page(self, cursor: int, limit: int) -> tuple:
+        """Активные id после позиции cursor и следующий cursor (равен cursor, если пользователи кончились)"""
+        with self.users.lock:
+            users = self.users.data
+            if self._user_order is None:
+                self._user_order = list(users)
+            page = self._user_order[cursor:cursor + limit]
+            active = [int(user_id) for user_id in page if not users[user_id].get("inactive")]
+        return active, cursor + len(page)
+
+    def get_user_id_by_username(self, username: str) -> int | None:
+        with self.users.lock:
+            for user_id, user_data in self.users.data.items():
+                if user_data.get("username") == username:
+                    return int(user_id)
+        return None
+
+    def get_users(self, user_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        with self.users.lock:
+            users = self.users.data
+            return {user_id: dict(users[str(user_id)]) for user_id in user_ids if str(user_id) in users}
+
+    def iter_user_index(self):
+        """(id, username, joined) в порядке регистрации"""
+        with self.users.lock:
+            rows = [
+                (int(user_id), user_data.get("username"), user_data.get("joined") or "")
+                for user_id, user_data in self.users.data.items()
+            ]
+        return iter(rows)
+
+    # Блокировки
+    def is_blocked(self, user_id: int) -> bool:
+        return str(user_id) in self.blocked_users.data
+
+    def block(self, user_id: int, blocked_at: str):
+        with self.blocked_users.lock:
+            self.blocked_users.data[str(user_id)] = blocked_at
+        self.blocked_users.mark_dirty()
+
+    def unblock(self, user_id: int):
+        with self.blocked_users.lock:
+            removed = self.blocked_users.data.pop(str(user_id), None)
+        if removed is not None:
+            self.blocked_users.mark_dirty()
+
+    def iter_blocked_ids(self):
+        with self.blocked_users.lock:
+            return iter([int(user_id) for user_id in self.blocked_users.data])
+
+    # Игры
+    def games_version(self) -> tuple | None:
+        try:
+            st = os.stat(DB_FILE)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def load_games(self) -> Dict[str, Any]:
+        with self._games_lock:
+            self._games = load_json(DB_FILE)
+            # Копия: каталог читает свой словарь в цикле событий, пока этот пишется в пуле
+            return dict(self._games)
+
+    def save_game(self, game_name: str, game: Dict[str, Any]):
+        with self._games_lock:
+            self._games[game_name] = game
+            save_json(self._games, DB_FILE)
+
+    def save_games(self, games: Dict[str, Any]):
+        with self._games_lock:
+            self._games.update(games)
+            save_json(self._games, DB_FILE)
+
+    def delete_game(self, game_name: str):
+        with self._games_lock:
+            self._games.pop(game_name, None)
+            save_json(self._games, DB_FILE)
+
+    def load_next_game_id(self) -> int:
+        return load_json(GAME_IDS_FILE).get("next_id", 0) if os.path.exists(GAME_IDS_FILE) else 0
+
+    def save_next_game_id(self, next_id: int):
+        save_json({"next_id": next_id}, GAME_IDS_FILE)
+
+    def flush(self):
+        self.users.flush()
+        self.blocked_users.flush()
+
+    def close(self):
+        self.flush()
+
+class SqliteStorage:
+    """Хранение в SQLite (WAL, индекс по username)"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            joined TEXT,
+            inactive INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);
+        CREATE TABLE IF NOT EXISTS blocked_users (
+            id INTEGER PRIMARY KEY,
+            blocked_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS games (
+            name TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # Одно соединение на процесс, запросы из пула потоков сериализуются
+        self.lock = threading.RLock()
+        self._conn: sqlite3.Connection | None = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            with self.lock:
+                if self._conn is None:
+                    conn = sqlite3.connect(self.path, check_same_thread=False)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute("PRAGMA synchronous=NORMAL")
+                    conn.executescript(self.SCHEMA)
+                    columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+                    if "inactive" not in columns:
+                        conn.execute("ALTER TABLE users ADD COLUMN inactive INTEGER NOT NULL DEFAULT 0")
+                    self._conn = conn
+        return self._conn
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def _commit(self, sql: str, params: tuple = ()) -> int:
+        with self.lock, self.conn:
+            return self.conn.execute(sql, params).rowcount
+
+    # Пользователи
+    def add_user(self, user_id: int, user_data: Dict[str, Any]) -> bool:
+        """Добавить пользователя; True, если он новый"""
+        with self.lock, self.conn:
+            added = self.conn.execute(
+                "INSERT OR IGNORE INTO users (id, username, first_name, last_name, joined) VALUES (?, ?, ?, ?, ?)",
+                (user_id, user_data.get("username"), user_data.get("first_name"),
+                 user_data.get("last_name"), user_data.get("joined"))
+            ).rowcount > 0
+            if not added:
+                # Повторный /start снимает отметку о блокировке бота
+                self.conn.execute("UPDATE users SET inactive = 0 WHERE id = ? AND inactive = 1", (user_id,))
+        return added
+
+    def mark_inactive(self, user_id: int):
+        self._commit("UPDATE users SET inactive = 1 WHERE id = ?", (user_id,))
+
+    def user_ids_page(self, cursor: int, limit: int) -> tuple:
+        """Активные id больше cursor и следующий cursor (равен cursor, если пользователи кончились)"""
+        rows = self._execute("SELECT id, inactive FROM users WHERE id > ? ORDER BY id LIMIT ?", (cursor, limit))
+        return [user_id for user_id, inactive in rows if not inactive], rows[-1][0] if rows else cursor
+
+    def get_user_id_by_username(self, username: str) -> int | None:
+        rows = self._execute("SELECT id FROM users WHERE username = ? LIMIT 1", (username,))
+        return rows[0][0] if rows else None
+
+    def get_users(self, user_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        users = {}
+        # SQLite ограничивает число параметров запроса
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start:start + 500]
+            rows = self._execute(
+                f"SELECT id, username, first_name, last_name, joined FROM users WHERE id IN ({','.join('?' * len(chunk))})",
+                tuple(chunk)
+            )
+            for row in rows:
+                users[row[0]] = {"username": row[1], "first_name": row[2], "last_name": row[3], "joined": row[4]}
+        return users
+
+    def iter_user_index(self):
+        """(id, username, joined) в порядке регистрации"""
+        return iter(self._execute("SELECT id, username, COALESCE(joined, '') FROM users ORDER BY rowid"))
+
+    # Блокировки
+    def is_blocked(self, user_id: int) -> bool:
+        return bool(self._execute("SELECT 1 FROM blocked_users WHERE id = ?", (user_id,)))
+
+    def block(self, user_id: int, blocked_at: str):
+        self._commit("INSERT OR REPLACE INTO blocked_users (id, blocked_at) VALUES (?, ?)", (user_id, blocked_at))
+
+    def unblock(self, user_id: int):
+        self._commit("DELETE FROM blocked_users WHERE id = ?", (user_id,))
+
+    def iter_blocked_ids(self):
+        return (user_id for (user_id,) in self._execute("SELECT id FROM blocked_users"))
+
+    # Игры
+    def games_version(self) -> int:
+        # Меняется при коммитах из других соединений (внешние правки базы)
+        return self._execute("PRAGMA data_version")[0][0]
+
+    def load_games(self) -> Dict[str, Any]:
+        return {name: json.loads(data) for name, data in self._execute("SELECT name, data FROM games ORDER BY rowid")}
+
+    def save_game(self, game_name: str, game: Dict[str, Any]):
+        self._commit(
+            "INSERT INTO games (name, data) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET data = excluded.data",
+            (game_name, json.dumps(game, ensure_ascii=False))
+        )
+
+    def save_games(self, games: Dict[str, Any]):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO games (name, data) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET data = excluded.data",
+                [(name, json.dumps(game, ensure_ascii=False)) for name, game in games.items()]
+            )
+
+    def delete_game(self, game_name: str):
+        self._commit("DELETE FROM games WHERE name = ?", (game_name,))
+
+    def load_next_game_id(self) -> int:
+        rows = self._execute("SELECT value FROM meta WHERE key = 'next_game_id'")
+        return rows[0][0] if rows else 0
+
+    def save_next_game_id(self, next_id: int):
+        self._commit("INSERT OR REPLACE INTO meta (key, value) VALUES ('next_game_id', ?)", (next_id,))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        with self.lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+def create_storage():
+    if STORAGE_BACKEND == "sqlite":
+        return SqliteStorage(SQLITE_FILE)
+    if STORAGE_BACKEND != "json":
+        logger.error("Unknown STORAGE_BACKEND %r, falling back to json", STORAGE_BACKEND)
+    return JsonStorage()
+
+storage = create_storage()
+
+async def run_store_flusher(interval: float = FLUSH_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        await run_io(storage.flush)
+
+def migrate_json_to_sqlite(batch_size: int = 10000):
+    """Однократный перенос users.json, blocked_users.json и games.json в SQLite"""
+    target = SqliteStorage(SQLITE_FILE)
+    conn = target.conn
+    sources = [
+        (USERS_FILE,
+         "INSERT OR IGNORE INTO users (id, username, first_name, last_name, joined) VALUES (?, ?, ?, ?, ?)",
+         lambda key, value: (int(key), value.get("username"), value.get("first_name"),
+                             value.get("last_name"), value.get("joined"))),
+        (BLOCKED_USERS_FILE,
+         "INSERT OR REPLACE INTO blocked_users (id, blocked_at) VALUES (?, ?)",
+         lambda key, value: (int(key), value)),
+        (DB_FILE,
+         "INSERT OR REPLACE INTO games (name, data) VALUES (?, ?)",
+         lambda key, value: (key, json.dumps(value, ensure_ascii=False))),
+    ]
+    for file, sql, to_row in sources:
+        if not os.path.exists(file):
+            logger.info("Skipping %s: not found", file)
+            continue
+        count = 0
+        batch = []
+        with conn:
+            for key, value in iter_json_items(file):
+                batch.append(to_row(key, value))
+                if len(batch) >= batch_size:
+                    conn.executemany(sql, batch)
+                    count += len(batch)
+                    batch.clear()
+            conn.executemany(sql, batch)
+            count += len(batch)
+        logger.info("Migrated %s records from %s", count, file)
+    next_id = JsonStorage().load_next_game_id()
+    if next_id:
+        target.save_next_game_id(next_id)
+    target.close()
+
+# ========== СОСТОЯНИЯ FSM ==========
+class SqliteFSMStorage(BaseStorage):
+    """Состояния и данные FSM в SQLite: одна строка на чат, истекают через ttl секунд"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS fsm (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT,
+            expires REAL NOT NULL
+        ) WITHOUT ROWID;
+    """
+    PURGE_INTERVAL = 60
+
+    def __init__(self, path: str, ttl: int = FSM_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self._conn: sqlite3.Connection | None = None
+        self._purged_at = 0.0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            with self.lock:
+                if self._conn is None:
+                    # timeout: другие процессы могут держать блокировку записи
+                    conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute("PRAGMA synchronous=NORMAL")
+                    conn.executescript(self.SCHEMA)
+                    self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        parts = [key.bot_id, key.chat_id, key.user_id]
+        if key.thread_id is not None or key.destiny != "default":
+            parts += [key.thread_id or "", key.destiny]
+        return ":".join(map(str, parts))
+
+    def _read(self, key: str) -> tuple:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT state, data FROM fsm WHERE key = ? AND expires > ?", (key, time.time())
+            ).fetchone()
+        return row or (None, None)
+
+    def _write(self, key: str, column: str, value: str | None):
+        now = time.time()
+        with self.lock, self.conn:
+            # Истекшая запись удаляется до обновления: иначе второе поле и срок ожили бы вместе с ним
+            self.conn.execute("DELETE FROM fsm WHERE key = ? AND expires <= ?", (key, now))
+            self.conn.execute(
+                f"INSERT INTO fsm (key, {column}, expires) VALUES (?, ?, ?) "
+                f"ON CONFLICT(key) DO UPDATE SET {column} = excluded.{column}, expires = excluded.expires",
+                (key, value, now + self.ttl)
+            )
+            # Пустые записи не храним
+            self.conn.execute("DELETE FROM fsm WHERE key = ? AND state IS NULL AND data IS NULL", (key,))
+            if now - self._purged_at > self.PURGE_INTERVAL:
+                self.conn.execute("DELETE FROM fsm WHERE expires <= ?", (now,))
+                self._purged_at = now
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await run_io(self._write, self._key(key), "state", value)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        state, _ = await run_io(self._read, self._key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        value = json.dumps(data, ensure_ascii=False, separators=(",", ":")) if data else None
+        await run_io(self._write, self._key(key), "data", value)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await run_io(self._read, self._key(key))
+        return json.loads(data) if data else {}
+
+    async def close(self) -> None:
+        with self.lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+def create_fsm_storage() -> BaseStorage:
+    if FSM_STORAGE == "sqlite":
+        return SqliteFSMStorage(FSM_SQLITE_FILE)
+    if FSM_STORAGE == "redis":
+        # Необязательная зависимость: pip install redis
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError:
+            logger.error("FSM_STORAGE=redis requires the redis package (pip install redis), falling back to memory")
+            return MemoryStorage()
+        return RedisStorage.from_url(REDIS_URL, state_ttl=FSM_TTL, data_ttl=FSM_TTL)
+    if FSM_STORAGE != "memory":
+        logger.error("Unknown FSM_STORAGE %r, falling back to memory", FSM_STORAGE)
+    return MemoryStorage()
+
+class UserIndex:
+    """Индексы пользователей в памяти: заблокированные id, username → id, порядок регистрации
+    и счетчики для админ-панели. Обновляются по одному пользователю, без пересчета"""
+
+    def __init__(self):
+        self._blocked: set[int] | None = None
+        self._usernames: Dict[str, int] | None = None
+        self._order: List[int] | None = None
+        self._joined_by_day: Counter = Counter()
+        # Отсортированные пары (username в нижнем регистре, позиция в порядке регистрации) для поиска по началу
+        self._prefixes: List[tuple] = []
+
+    @property
+    def blocked(self) -> set[int]:
+        if self._blocked is None:
+            self._blocked = set(storage.iter_blocked_ids())
+        return self._blocked
+
+    @property
+    def usernames(self) -> Dict[str, int]:
+        if self._usernames is None:
+            self._load_users()
+        return self._usernames
+
+    @property
+    def order(self) -> List[int]:
+        """id пользователей в порядке регистрации"""
+        if self._order is None:
+            self._load_users()
+        return self._order
+
+    def _load_users(self):
+        usernames: Dict[str, int] = {}
+        prefixes: List[tuple] = []
+        order: List[int] = []
+        joined_by_day: Counter = Counter()
+        for user_id, username, joined in storage.iter_user_index():
+            if username and username not in usernames:
+                # Как и при линейном поиске, побеждает первый зарегистрированный
+                usernames[username] = user_id
+                prefixes.append((username.lower(), len(order)))
+            order.append(user_id)
+            joined_by_day[joined[:10]] += 1
+        prefixes.sort()
+        self._usernames, self._prefixes = usernames, prefixes
+        self._order, self._joined_by_day = order, joined_by_day
+
+    def load(self):
+        self.reset()
+        _ = self.blocked, self.order
+
+    def reset(self):
+        self._blocked = None
+        self._usernames = None
+        self._order = None
+
+    def user_added(self, user_id: int, username: str | None, joined: str):
+        if self._order is None:
+            # Индекс еще не загружен и прочитает пользователя из хранилища
+            return
+        position = len(self._order)
+        self._order.append(user_id)
+        self._joined_by_day[joined[:10]] += 1
+        if username and username not in self._usernames:
+            self._usernames[username] = user_id
+            insort(self._prefixes, (username.lower(), position))
+
+    # Счетчики для админ-панели
+    @property
+    def total(self) -> int:
+        return len(self.order)
+
+    @property
+    def new_today(self) -> int:
+        _ = self.order
+        return self._joined_by_day[datetime.now().date().isoformat()]
+
+    def with_prefix(self, prefix: str) -> List[int]:
+        """id пользователей, чей username начинается с prefix, в порядке регистрации"""
+        order = self.order
+        prefix = prefix.lower()
+        positions = []
+        i = bisect_left(self._prefixes, (prefix,))
+        while i < len(self._prefixes) and self._prefixes[i][0].startswith(prefix):
+            positions.append(self._prefixes[i][1])
+            i += 1
+        return [order[position] for position in sorted(positions)]
+
+user_index = UserIndex()
+
+async def save_user(user: types.User):
+    joined = datetime.now().isoformat()
+    added = await run_io(storage.add_user, user.id, {
+        "username": user.username,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "joined": joined
+    })
+    if added:
+        user_index.user_added(user.id, user.username, joined)
 
 def is_user_blocked(user_id: int) -> bool:
-    blocked_users = load_json(BLOCKED_USERS_FILE)
-    return str(user_id) in blocked_users
+    return user_id in user_index.blocked
 
-def block_user(user_id: int):
-    blocked_users = load_json(BLOCKED_USERS_FILE)
-    blocked_users[str(user_id)] = datetime.now().isoformat()
-    save_json(blocked_users, BLOCKED_USERS_FILE)
+async def block_user(user_id: int):
+    await run_io(storage.block, user_id, datetime.now().isoformat())
+    user_index.blocked.add(user_id)
 
-def unblock_user(user_id: int):
-    blocked_users = load_json(BLOCKED_USERS_FILE)
-    user_id_str = str(user_id)
-    if user_id_str in blocked_users:
-        del blocked_users[user_id_str]
-        save_json(blocked_users, BLOCKED_USERS_FILE)
+async def unblock_user(user_id: int):
+    await run_io(storage.unblock, user_id)
+    user_index.blocked.discard(user_id)
 
 def get_user_id_by_username(username: str) -> int | None:
-    users = load_json(USERS_FILE)
-    for user_id, user_data in users.items():
-        if user_data.get("username") == username:
-            return int(user_id)
-    return None
+    return user_index.usernames.get(username)
+
+class BlockedUserMiddleware(BaseMiddleware):
+    """Отсекает заблокированных пользователей до фильтров и обработчиков"""
+
+    async def __call__(self, handler, event: types.TelegramObject, data: Dict[str, Any]) -> Any:
+        user = getattr(event, "from_user", None)
+        if user is None or not is_user_blocked(user.id):
+            return await handler(event, data)
+
+        if isinstance(event, types.CallbackQuery):
+            await event.answer("❌ Вы заблокированы.", show_alert=True)
+        elif isinstance(event, types.Message):
+            await event.answer("❌ Вы заблокированы и не можете использовать бота.", reply_markup=ReplyKeyboardRemove())
+        return None
+
+class LogContextMiddleware(BaseMiddleware):
+    """Привязывает записи лога к обновлению и пользователю"""
+
+    async def __call__(self, handler, event: types.Update, data: Dict[str, Any]) -> Any:
+        user = data.get("event_from_user")
+        token = log_context.set({"update_id": event.update_id, "user_id": user.id if user else None})
+        try:
+            return await handler(event, data)
+        finally:
+            log_context.reset(token)
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Число вызовов, ошибки и задержка каждого обработчика"""
+
+    async def __call__(self, handler, event: types.TelegramObject, data: Dict[str, Any]) -> Any:
+        start = time.perf_counter()
+        error = False
+        name = self.handler_name(data)
+        context = log_context.get()
+        if context is not None:
+            context["handler"] = name
+        try:
+            return await handler(event, data)
+        except Exception:
+            error = True
+            raise
+        finally:
+            metrics.observe("handler", name, time.perf_counter() - start, error)
+
+    @staticmethod
+    def handler_name(data: Dict[str, Any]) -> str:
+        # Действия с играми приходят в один обработчик-маршрутизатор, учитываем конечный обработчик
+        action = getattr(data.get("callback_data"), "action", None) or data.get("action")
+        if action in GAME_ACTIONS:
+            return GAME_ACTIONS[action].__name__
+        return data["handler"].callback.__name__
+
+# ========== ОГРАНИЧЕНИЕ ИСХОДЯЩИХ ЗАПРОСОВ ==========
+class TokenBucket:
+    """Ведро токенов; токен списывается в момент фактической отправки"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "lock")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        # Отправки в одно ведро идут по очереди, поэтому порядок сообщений в чате сохраняется
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, now: float, seconds: float):
+        self._refill(now)
+        self.tokens = min(self.tokens, 1) - seconds * self.rate
+
+    def is_idle(self, now: float) -> bool:
+        return not self.lock.locked() and self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+    async def wait(self):
+        while (delay := self.delay(time.monotonic())) > 0:
+            await asyncio.sleep(delay)
+
+class OutboundRateLimiter(BaseRequestMiddleware):
+    """Очередь исходящих запросов через ведро чата и общее ведро, повтор после retry_after"""
+
+    PRUNE_EVERY = 1024
+
+    def __init__(self, global_rate: float = RATE_LIMIT_GLOBAL, chat_rate: float = RATE_LIMIT_PER_CHAT,
+                 group_rate: float = RATE_LIMIT_PER_GROUP, chat_burst: int = RATE_LIMIT_CHAT_BURST,
+                 max_retries: int = RATE_LIMIT_MAX_RETRIES):
+        # Общий лимит без запаса на всплеск: пиковая скорость ровно global_rate
+        self.global_bucket = TokenBucket(global_rate, 1)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chats: Dict[Any, TokenBucket] = {}
+        self.queued = 0
+        self.sent = 0
+        self.retries = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательные id и @username - группы и каналы
+            is_group = not isinstance(chat_id, int) or chat_id < 0
+            bucket = TokenBucket(self.group_rate if is_group else self.chat_rate,
+                                 1 if is_group else self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _prune(self, now: float):
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items() if bucket.is_idle(now)]:
+            del self._chats[chat_id]
+
+    async def _acquire(self, chat_id) -> float:
+        start = time.monotonic()
+        chat = self._chat_bucket(chat_id)
+        self.queued += 1
+        try:
+            async with chat.lock:
+                await chat.wait()
+                async with self.global_bucket.lock:
+                    await self.global_bucket.wait()
+                    now = time.monotonic()
+                    self.global_bucket.take(now)
+                chat.take(now)
+        finally:
+            self.queued -= 1
+        return now - start
+
+    async def __call__(self, make_request, bot, method):
+        # Лимиты касаются только отправки в чаты; getUpdates, answerCallbackQuery и т.п. идут напрямую
+        chat_id = getattr(method, "chat_id", None)
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None:
+                waited = await self._acquire(chat_id)
+                self.sent += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+                if self.sent % self.PRUNE_EVERY == 0:
+                    self._prune(time.monotonic())
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                logger.warning("Flood control on %s (chat %s), retry in %ss", type(method).__name__, chat_id, e.retry_after)
+                if chat_id is None:
+                    await asyncio.sleep(e.retry_after)
+                else:
+                    self._chat_bucket(chat_id).pause(time.monotonic(), e.retry_after)
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очереди и время ожидания"""
+        return {
+            "queued": self.queued,
+            "sent": self.sent,
+            "retries": self.retries,
+            "avg_wait": self.wait_total / self.sent if self.sent else 0.0,
+            "max_wait": self.wait_max,
+            "chats": len(self._chats),
+        }
+
+outbound_limiter = OutboundRateLimiter()
+metrics.gauge("gambot_outbound_queue", "Outbound requests waiting for a rate limit slot", lambda: outbound_limiter.queued)
+metrics.gauge("gambot_outbound_wait_seconds_max", "Longest rate limit wait", lambda: outbound_limiter.wait_max)
+metrics.counter("gambot_outbound_retries", "Requests retried after retry_after", lambda: outbound_limiter.retries)
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Время запросов к Bot API по методам (без ожидания в ограничителе)"""
+
+    async def __call__(self, make_request, bot, method):
+        start = time.perf_counter()
+        error = False
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            error = True
+            raise
+        finally:
+            metrics.observe("api", type(method).__name__, time.perf_counter() - start, error)
+
+# ========== КАТАЛОГ ИГР ==========
+class GameCatalog:
+    """Каталог игр в памяти; изменения хранилища подхватываются фоновой проверкой версии"""
+
+    def __init__(self):
+        self._games: Dict[str, Any] = {}
+        self._stamp: Any = None
+        self._loaded = False
+        # Короткие постоянные id игр для callback_data
+        self._names_by_id: Dict[int, str] = {}
+        self._next_id = 1
+        # Сохраненная в хранилище граница id: новые id всегда выше нее
+        self._saved_next_id = 0
+        # Растет при изменении набора игр (добавление, удаление, перезагрузка)
+        self.names_version = 0
+        # Подписчики на изменения: catalog_reloaded(games), game_saved(name, game), game_deleted(name, game)
+        self._listeners: List[Any] = []
+
+    def add_listener(self, listener: Any):
+        self._listeners.append(listener)
+
+    def all(self) -> Dict[str, Any]:
+        if not self._loaded:
+            # Обычно каталог уже загружен refresh() при старте; синхронно - только для утилит
+            new_ids = self._apply(storage.games_version(), storage.load_games(), storage.load_next_game_id())
+            if new_ids:
+                storage.save_games(new_ids)
+                self._stamp = storage.games_version()
+            if self._next_id > self._saved_next_id:
+                storage.save_next_game_id(self._next_id)
+                self._saved_next_id = self._next_id
+        return self._games
+
+    def get(self, game_name: str) -> Dict[str, Any] | None:
+        return self.all().get(game_name)
+
+    def name_by_id(self, game_id: int) -> str | None:
+        self.all()
+        return self._names_by_id.get(game_id)
+
+    def id_of(self, game_name: str) -> int:
+        return self.all()[game_name]["id"]
+
+    async def refresh(self):
+        stamp = await run_io(storage.games_version)
+        if self._loaded and stamp == self._stamp:
+            return
+        games = await run_io(storage.load_games)
+        new_ids = self._apply(stamp, games, await run_io(storage.load_next_game_id))
+        if new_ids:
+            await run_io(storage.save_games, new_ids)
+            self._stamp = await run_io(storage.games_version)
+        await self._save_next_id()
+
+    async def _save_next_id(self):
+        if self._next_id > self._saved_next_id:
+            next_id = self._next_id
+            await run_io(storage.save_next_game_id, next_id)
+            self._saved_next_id = max(self._saved_next_id, next_id)
+
+    def _apply(self, stamp: Any, games: Dict[str, Any], next_id: int = 0) -> Dict[str, Any]:
+        """Применить загруженный каталог; возвращает игры, которым выданы новые id"""
+        self._games = games
+        self._stamp = stamp
+        self._loaded = True
+        self.names_version += 1
+        self._names_by_id = {game["id"]: name for name, game in games.items() if isinstance(game.get("id"), int)}
+        self._next_id = max(next_id, max(self._names_by_id, default=0) + 1)
+        self._saved_next_id = next_id
+        new_ids = {}
+        for name, game in games.items():
+            if self._names_by_id.get(game.get("id")) != name:
+                game["id"] = self._allocate_id(name)
+                new_ids[name] = game
+        for listener in self._listeners:
+            listener.catalog_reloaded(games)
+        logger.info("Catalog reloaded: %s games", len(games))
+        return new_ids
+
+    def _allocate_id(self, game_name: str) -> int:
+        game_id = self._next_id
+        self._next_id += 1
+        self._names_by_id[game_id] = game_name
+        return game_id
+
+    async def set(self, game_name: str, game: Dict[str, Any]):
+        games = self.all()
+        current = games.get(game_name)
+        game = dict(game)
+        # id сохраняется при перезаписи игры, чтобы старые кнопки продолжали работать
+        game["id"] = current["id"] if current else self._allocate_id(game_name)
+        try:
+            await run_io(storage.save_game, game_name, game)
+        except Exception:
+            if current is None:
+                self._names_by_id.pop(game["id"], None)
+            raise
+        if current is None:
+            self.names_version += 1
+        games[game_name] = game
+        for listener in self._listeners:
+            listener.game_saved(game_name, game)
+        self._stamp = await run_io(storage.games_version)
+        await self._save_next_id()
+
+    async def update(self, game_name: str, fields: Dict[str, Any]):
+        game = dict(self.all().get(game_name) or {})
+        game.update(fields)
+        await self.set(game_name, game)
+
+    async def set_many(self, games: Dict[str, Dict[str, Any]]):
+        """Записать много игр одной порцией хранилища (массовый импорт)"""
+        current_games = self.all()
+        prepared = {}
+        allocated = []
+        for game_name, game in games.items():
+            game = dict(game)
+            current = current_games.get(game_name)
+            if current:
+                game["id"] = current["id"]
+            else:
+                game["id"] = self._allocate_id(game_name)
+                allocated.append(game["id"])
+            prepared[game_name] = game
+        try:
+            await run_io(storage.save_games, prepared)
+        except Exception:
+            for game_id in allocated:
+                self._names_by_id.pop(game_id, None)
+            raise
+        if allocated:
+            self.names_version += 1
+        current_games.update(prepared)
+        for game_name, game in prepared.items():
+            for listener in self._listeners:
+                listener.game_saved(game_name, game)
+        self._stamp = await run_io(storage.games_version)
+        await self._save_next_id()
+
+    async def delete(self, game_name: str) -> Dict[str, Any] | None:
+        games = self.all()
+        if game_name not in games:
+            return None
+        await run_io(storage.delete_game, game_name)
+        game = games.pop(game_name, None)
+        self._names_by_id.pop(game.get("id"), None)
+        self.names_version += 1
+        for listener in self._listeners:
+            listener.game_deleted(game_name, game)
+        self._stamp = await run_io(storage.games_version)
+        return game
+
+    def invalidate(self):
+        self._loaded = False
+
+games_catalog = GameCatalog()
+
+async def run_catalog_watcher(interval: float = CATALOG_RELOAD_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await games_catalog.refresh()
+        except Exception as e:
+            logger.error("Error reloading catalog: %s", e)
+
+# ========== ПОИСК ==========
+# Кириллица переводится в латиницу, чтобы «гта» и «gta» находили одно и то же
+TRANSLIT = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh",
+    "з": "z", "и": "i", "й": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "h", "ц": "ts",
+    "ч": "ch", "ш": "sh", "щ": "sch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu",
+    "я": "ya",
+})
+
+NON_WORD_RE = re.compile(r"[\W_]+")
+
+def normalize_search_text(text: str) -> str:
+    return NON_WORD_RE.sub(" ", text.lower().translate(TRANSLIT)).strip()
+
+def trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class GameSearchIndex:
+    """Префиксный и триграммный индекс по названиям и описаниям игр"""
+
+    def __init__(self, cache_size: int = SEARCH_CACHE_SIZE):
+        self.cache_size = cache_size
+        # Слово → id игр: отдельно для названий и описаний (совпадение в названии весит больше)
+        self._name_words: Dict[str, set[int]] = {}
+        self._description_words: Dict[str, set[int]] = {}
+        self._sorted_name_words: List[str] | None = None
+        self._sorted_description_words: List[str] | None = None
+        self._trigrams: Dict[str, set[int]] = {}
+        self._documents: Dict[int, tuple] = {}
+        self._results: OrderedDict = OrderedDict()
+        self._stale = True
+        # Растет при каждом изменении каталога: так видно, что индекс устарел, пока строился
+        self._generation = 0
+
+    # Подписка на изменения каталога
+    def catalog_reloaded(self, games: Dict[str, Any]):
+        self._generation += 1
+        self._stale = True
+        self._results.clear()
+
+    def game_saved(self, game_name: str, game: Dict[str, Any]):
+        self._generation += 1
+        if not self._stale:
+            self._remove(game["id"])
+            self._add(game["id"], game_name, game.get("description") or "")
+        self._results.clear()
+
+    def game_deleted(self, game_name: str, game: Dict[str, Any]):
+        self._generation += 1
+        if not self._stale:
+            self._remove(game["id"])
+        self._results.clear()
+
+    def _add(self, game_id: int, game_name: str, description: str):
+        name = normalize_search_text(game_name)
+        name_words = set(name.split())
+        description_words = set(normalize_search_text(description).split()) - name_words
+        name_grams = trigrams(name)
+        self._documents[game_id] = (name_words, description_words, name_grams)
+        for word in name_words:
+            if word not in self._name_words:
+                self._sorted_name_words = None
+            self._name_words.setdefault(word, set()).add(game_id)
+        for word in description_words:
+            if word not in self._description_words:
+                self._sorted_description_words = None
+            self._description_words.setdefault(word, set()).add(game_id)
+        for gram in name_grams:
+            self._trigrams.setdefault(gram, set()).add(game_id)
+
+    def _remove(self, game_id: int):
+        document = self._documents.pop(game_id, None)
+        if document is None:
+            return
+        name_words, description_words, name_grams = document
+        for index, keys in ((self._name_words, name_words), (self._description_words, description_words),
+                            (self._trigrams, name_grams)):
+            for key in keys:
+                ids = index.get(key)
+                if ids is not None:
+                    ids.discard(game_id)
+                    if not ids:
+                        del index[key]
+        # Отсортированные словари пересоберутся при следующем поиске
+        self._sorted_name_words = None
+        self._sorted_description_words = None
+
+    def _build(self, games: Dict[str, Any]) -> "GameSearchIndex":
+        fresh = GameSearchIndex(self.cache_size)
+        for game_name, game in games.items():
+            fresh._add(game["id"], game_name, game.get("description") or "")
+        fresh._sorted_name_words = sorted(fresh._name_words)
+        fresh._sorted_description_words = sorted(fresh._description_words)
+        return fresh
+
+    def _swap(self, fresh: "GameSearchIndex"):
+        self._name_words, self._description_words = fresh._name_words, fresh._description_words
+        self._sorted_name_words, self._sorted_description_words = fresh._sorted_name_words, fresh._sorted_description_words
+        self._trigrams, self._documents = fresh._trigrams, fresh._documents
+        self._results.clear()
+
+    def rebuild(self, games: Dict[str, Any]):
+        self._swap(self._build(games))
+        self._stale = False
+
+    async def refresh(self):
+        """Полная пересборка после перезагрузки каталога - в пуле, не блокируя цикл событий"""
+        if not self._stale:
+            return
+        self._stale = False
+        generation = self._generation
+        fresh = await run_io(self._build, dict(games_catalog.all()))
+        self._swap(fresh)
+        if generation != self._generation:
+            self._stale = True
+
+    @staticmethod
+    def _prefix_matches(words: Dict[str, set[int]], sorted_words: List[str], prefix: str) -> set[int]:
+        matches: set[int] = set()
+        start = bisect_left(sorted_words, prefix)
+        for word in islice(sorted_words, start, None):
+            if not word.startswith(prefix):
+                break
+            matches |= words[word]
+        return matches
+
+    def search(self, query: str, limit: int = SEARCH_RESULTS_LIMIT) -> List[int]:
+        """id найденных игр, лучшие совпадения первыми"""
+        if self._stale:
+            self.rebuild(games_catalog.all())
+        query = normalize_search_text(query)
+        if not query:
+            return []
+        cached = self._results.get((query, limit))
+        if cached is not None:
+            self._results.move_to_end((query, limit))
+            return cached
+
+        if self._sorted_name_words is None:
+            self._sorted_name_words = sorted(self._name_words)
+        if self._sorted_description_words is None:
+            self._sorted_description_words = sorted(self._description_words)
+
+        # Префиксы: каждое слово запроса должно совпасть с началом слова названия или описания
+        scores: Dict[int, float] | None = None
+        for token in query.split():
+            # Короткие префиксы по описаниям дают слишком много совпадений
+            if len(token) >= 3:
+                token_scores = dict.fromkeys(
+                    self._prefix_matches(self._description_words, self._sorted_description_words, token), 1.0)
+            else:
+                token_scores = {}
+            token_scores.update(dict.fromkeys(
+                self._prefix_matches(self._name_words, self._sorted_name_words, token), 3.0))
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {game_id: score + token_scores[game_id] for game_id, score in scores.items() if game_id in token_scores}
+            if not scores:
+                break
+        scores = scores or {}
+
+        # Опечатки: какая доля триграмм запроса встречается в названии
+        if len(scores) < limit:
+            query_grams = trigrams(query)
+            common: Dict[int, int] = {}
+            for gram in query_grams:
+                for game_id in self._trigrams.get(gram, ()):
+                    common[game_id] = common.get(game_id, 0) + 1
+            for game_id, shared in common.items():
+                similarity = shared / len(query_grams)
+                if game_id not in scores and similarity >= SEARCH_FUZZY_THRESHOLD:
+                    scores[game_id] = similarity
+
+        results = heapq.nlargest(limit, scores, key=scores.get)
+        self._results[(query, limit)] = results
+        if len(self._results) > self.cache_size:
+            self._results.popitem(last=False)
+        return results
+
+search_index = GameSearchIndex()
+games_catalog.add_listener(search_index)
+
+# ========== ХРАНИЛИЩЕ МЕДИА ==========
+# Поля игры, которые ссылаются на файлы в DATA_DIR
+MEDIA_FIELDS = ("photo", "photo_optimized", "photo_thumb", "file")
+SAFE_EXTENSION_RE = re.compile(r"^\.[A-Za-z0-9]{1,10}$")
+
+def safe_extension(file_name: str | None, default: str = "") -> str:
+    extension = os.path.splitext(file_name or "")[1].lower()
+    return extension if SAFE_EXTENSION_RE.match(extension) else default
+
+class MediaStore:
+    """Файлы по хэшу содержимого (media/ab/<sha256>.ext): повторы хранятся один раз,
+    файл удаляется, когда на него не ссылается ни одна игра"""
+
+    def __init__(self, root: str = MEDIA_DIR, chunk_size: int = MEDIA_CHUNK_SIZE):
+        self.root = root
+        self.chunk_size = chunk_size
+        # Пути относительно DATA_DIR, как они записаны в играх
+        self.prefix = os.path.relpath(root, DATA_DIR) + os.sep
+        self._refs: Counter = Counter()
+        self._paths_by_game: Dict[str, tuple] = {}
+        self._released: set[str] = set()
+        # Записанные, но еще не попавшие в каталог файлы: сборка мусора их не трогает
+        self._fresh: set[str] = set()
+        # Запись файла и его удаление сборщиком не пересекаются
+        self._lock = threading.Lock()
+
+    def manages(self, path: str) -> bool:
+        return path.startswith(self.prefix)
+
+    def _game_paths(self, game: Dict[str, Any]) -> tuple:
+        return tuple(path for path in (game.get(field) for field in MEDIA_FIELDS) if path and self.manages(path))
+
+    # Подписка на изменения каталога: счетчики ссылок
+    def catalog_reloaded(self, games: Dict[str, Any]):
+        self._paths_by_game = {name: self._game_paths(game) for name, game in games.items()}
+        self._refs = Counter(path for paths in self._paths_by_game.values() for path in paths)
+        self._fresh.difference_update(self._refs)
+
+    def game_saved(self, game_name: str, game: Dict[str, Any]):
+        self._unref(self._paths_by_game.get(game_name, ()))
+        paths = self._game_paths(game)
+        self._paths_by_game[game_name] = paths
+        self._refs.update(paths)
+        self._fresh.difference_update(paths)
+
+    def game_deleted(self, game_name: str, game: Dict[str, Any]):
+        self._unref(self._paths_by_game.pop(game_name, ()))
+
+    def _unref(self, paths: tuple):
+        for path in paths:
+            self._refs[path] -= 1
+            if self._refs[path] <= 0:
+                del self._refs[path]
+                self._released.add(path)
+
+    async def collect(self) -> int:
+        """Удалить файлы, на которые больше никто не ссылается"""
+        garbage = [path for path in self._released if path not in self._refs]
+        self._released.clear()
+        removed = 0
+        for path in garbage:
+            if await run_io(self._remove_garbage, path):
+                removed += 1
+        if removed:
+            logger.info("Media GC: removed %s unreferenced files", removed)
+        return removed
+
+    def _remove_garbage(self, path: str) -> bool:
+        # Пока шла сборка, тот же файл могли загрузить заново и сослаться на него
+        with self._lock:
+            if path in self._refs or path in self._fresh:
+                return False
+            return remove_file(os.path.join(DATA_DIR, path))
+
+    async def drop_legacy(self, path: str | None):
+        """Удалить файл, загруженный до хранилища медиа: он принадлежал только одной игре"""
+        if path and not self.manages(path):
+            await run_io(remove_file, os.path.join(DATA_DIR, path))
+
+    async def download(self, bot: Bot, file_id: str, extension: str) -> str:
+        """Скачать файл Telegram потоком, считая хэш по ходу; возвращает путь относительно DATA_DIR"""
+        await run_io(os.makedirs, self.root, exist_ok=True)
+        fd, tmp_path = await run_io(tempfile.mkstemp, dir=self.root, prefix=".upload_")
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, "wb") as f:
+                await self.fetch(bot, file_id, f, digest)
+            return await run_io(self._commit, tmp_path, digest.hexdigest(), extension)
+        except BaseException:
+            await run_io(remove_file, tmp_path)
+            raise
+
+    async def fetch(self, bot: Bot, file_id: str, f, digest=None):
+        """Скачать файл Telegram потоком в открытый файл f"""
+        file = await bot.get_file(file_id)
+        if bot.session.api.is_local:
+            # Локальный сервер Bot API отдает путь к файлу на диске
+            await run_io(self._copy_local, file.file_path, f, digest)
+        else:
+            url = bot.session.api.file_url(bot.token, file.file_path)
+            async for chunk in bot.session.stream_content(url, chunk_size=self.chunk_size):
+                await run_io(self._write_chunk, f, digest, chunk)
+
+    @staticmethod
+    def _write_chunk(f, digest, chunk: bytes):
+        if digest is not None:
+            digest.update(chunk)
+        f.write(chunk)
+
+    def _copy(self, src, f, digest):
+        while chunk := src.read(self.chunk_size):
+            self._write_chunk(f, digest, chunk)
+
+    def _copy_local(self, source: str, f, digest):
+        with open(source, "rb") as src:
+            self._copy(src, f, digest)
+
+    def store_file(self, src, extension: str) -> str:
+        """Сохранить содержимое открытого файла порциями (блокирующий вызов, для run_io)"""
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".upload_")
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, "wb") as f:
+                self._copy(src, f, digest)
+            return self._commit(tmp_path, digest.hexdigest(), extension)
+        except BaseException:
+            remove_file(tmp_path)
+            raise
+
+    def store_bytes(self, data: bytes, extension: str) -> str:
+        """Сохранить готовое содержимое (блокирующий вызов, для run_io)"""
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".upload_")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            return self._commit(tmp_path, hashlib.sha256(data).hexdigest(), extension)
+        except BaseException:
+            remove_file(tmp_path)
+            raise
+
+    def discard(self, path: str):
+        """Отметить файл, который так и не попал в каталог, для следующей сборки мусора"""
+        if self.manages(path):
+            self._fresh.discard(path)
+            self._released.add(path)
+
+    def _commit(self, tmp_path: str, digest: str, extension: str) -> str:
+        relative = os.path.join(self.prefix, digest[:2], digest + extension)
+        target = os.path.join(DATA_DIR, relative)
+        with self._lock:
+            if os.path.exists(target):
+                # Такой файл уже есть - второй экземпляр не нужен
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(tmp_path, target)
+            self._fresh.add(relative)
+            self._released.discard(relative)
+        return relative
+
+media_store = MediaStore()
+games_catalog.add_listener(media_store)
+
+# ========== ОБЛОЖКИ ==========
+COVER_EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp"}
+
+def optimize_cover(path: str, max_side: int, quality: int, image_format: str,
+                   thumb_side: int) -> tuple[bytes | None, bytes]:
+    """Пережать обложку и сделать миниатюру (выполняется в отдельном процессе).
+    Вместо основной версии возвращает None, если исходник и так не больше нужного"""
+    with Image.open(path) as source:
+        source_format = source.format
+        image = ImageOps.exif_transpose(source)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+
+    fits = max(image.size) <= max_side
+    resized = image if fits else image.copy()
+    resized.thumbnail((max_side, max_side), Image.LANCZOS)
+    buffer = io.BytesIO()
+    resized.save(buffer, image_format, quality=quality, optimize=True)
+    keep_source = fits and source_format == image_format and buffer.tell() >= os.path.getsize(path)
+    variant = None if keep_source else buffer.getvalue()
+
+    thumb = image.copy()
+    thumb.thumbnail((thumb_side, thumb_side), Image.LANCZOS)
+    buffer = io.BytesIO()
+    thumb.save(buffer, "JPEG", quality=quality, optimize=True)
+    return variant, buffer.getvalue()
+
+class CoverOptimizer:
+    """Пережатие обложек в пуле процессов: обработка картинок не держит цикл событий и GIL"""
+
+    def __init__(self, workers: int = IMAGE_WORKERS):
+        self.workers = max(1, workers)
+        self._executor: ProcessPoolExecutor | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def available(self) -> bool:
+        return Image is not None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: дочерним процессам не достаются потоки и цикл событий родителя
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def schedule(self, game_name: str):
+        """Пережать обложку в фоне, не задерживая ответ админу"""
+        if not self.available:
+            return
+        task = asyncio.create_task(self.optimize(game_name))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def optimize(self, game_name: str) -> bool:
+        """Записать в игру пережатую версию и миниатюру текущей обложки"""
+        game = games_catalog.get(game_name)
+        photo = (game or {}).get("photo")
+        if not photo or not self.available:
+            return False
+        image_format = COVER_FORMAT if COVER_FORMAT in COVER_EXTENSIONS else "JPEG"
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            variant, thumb = await loop.run_in_executor(self._pool(), partial(
+                optimize_cover, os.path.join(DATA_DIR, photo),
+                COVER_MAX_SIDE, COVER_QUALITY, image_format, COVER_THUMB_SIDE))
+        except Exception as e:
+            logger.error("Cover optimization failed for %s: %s", game_name, e)
+            return False
+        finally:
+            metrics.observe("io", "optimize_cover", time.perf_counter() - start)
+
+        variant_path = photo if variant is None else await run_io(
+            media_store.store_bytes, variant, COVER_EXTENSIONS[image_format])
+        thumb_path = await run_io(media_store.store_bytes, thumb, ".jpg")
+
+        current = games_catalog.get(game_name)
+        if current is None or current.get("photo") != photo:
+            # Обложку заменили или игру удалили, пока шло пережатие
+            for path in (variant_path, thumb_path):
+                media_store.discard(path)
+        else:
+            changes = {"photo_optimized": variant_path, "photo_thumb": thumb_path}
+            if current.get("photo_optimized") != variant_path:
+                # Сохраненный file_id принадлежит прежней картинке: следующий просмотр загрузит пережатую
+                changes["photo_file_id"] = None
+            await games_catalog.update(game_name, changes)
+        await media_store.collect()
+        return current is not None and current.get("photo") == photo
+
+    def schedule_backfill(self):
+        """Догнать пережатие новых обложек в фоне (после импорта каталога)"""
+        if not self.available:
+            return
+        task = asyncio.create_task(self.backfill())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def backfill(self, force: bool = False) -> tuple[int, int]:
+        """Пережать обложки всех игр параллельно; возвращает (обработано, всего)"""
+        names = [name for name, game in games_catalog.all().items()
+                 if game.get("photo") and (force or not game.get("photo_optimized"))]
+        # Очередь пула держим заполненной, но не ставим в нее весь каталог сразу
+        semaphore = asyncio.Semaphore(self.workers * 2)
+
+        async def run(name: str) -> bool:
+            async with semaphore:
+                return await self.optimize(name)
+
+        results = await asyncio.gather(*(run(name) for name in names))
+        return sum(results), len(names)
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        if self._executor is not None:
+            await run_io(self._executor.shutdown, wait=True)
+            self._executor = None
+
+cover_optimizer = CoverOptimizer()
+
+# ========== ЖУРНАЛ СОБЫТИЙ ==========
+class ActivityStats:
+    """Сводки по событиям: просмотры карточек игр и число активных пользователей по дням.
+    События копятся в черновике, опубликованные значения меняются только при rollup()"""
+
+    def __init__(self, path: str = ROLLUPS_FILE, keep_days: int = ROLLUP_DAYS):
+        self.path = path
+        self.keep_days = keep_days
+        self.views: Counter = Counter()
+        self.daily_active: Dict[str, int] = {}
+        # Меняется, когда меняются опубликованные просмотры (для пересборки клавиатур)
+        self.version = 0
+        self._pending_views: Counter = Counter()
+        self._day: str | None = None
+        self._active_today: set[int] = set()
+
+    def add(self, events: List[Dict[str, Any]]):
+        for event in events:
+            if event["e"] == "view":
+                self._pending_views[event["g"]] += 1
+            if event.get("u") is None:
+                continue
+            day = datetime.fromtimestamp(event["t"]).date().isoformat()
+            if day != self._day:
+                if self._day is not None:
+                    self.daily_active[self._day] = len(self._active_today)
+                self._day, self._active_today = day, set()
+            self._active_today.add(event["u"])
+
+    @property
+    def active_today(self) -> int:
+        return len(self._active_today) if self._day == datetime.now().date().isoformat() else 0
+
+    def popular(self, limit: int) -> List[tuple]:
+        return self.views.most_common(limit)
+
+    def rollup(self) -> Dict[str, Any]:
+        """Опубликовать накопленное; возвращает снимок для сохранения"""
+        if self._pending_views:
+            self.views.update(self._pending_views)
+            self._pending_views.clear()
+            self.version += 1
+        if self._day is not None:
+            self.daily_active[self._day] = len(self._active_today)
+        for day in sorted(self.daily_active)[:-self.keep_days]:
+            del self.daily_active[day]
+        return {"views": dict(self.views), "daily_active": dict(self.daily_active),
+                "day": self._day, "active_today": list(self._active_today)}
+
+    def restore(self, snapshot: Dict[str, Any]):
+        self.views = Counter(snapshot.get("views", {}))
+        self.daily_active = dict(snapshot.get("daily_active", {}))
+        self._day = snapshot.get("day")
+        self._active_today = set(snapshot.get("active_today", []))
+        self.version += 1
+
+    async def load(self):
+        if await run_io(os.path.exists, self.path):
+            self.restore(await run_io(load_json, self.path))
+
+    async def save(self):
+        await run_io(save_json, self.rollup(), self.path)
+
+activity_stats = ActivityStats()
+
+class EventLog:
+    """Журнал действий: emit() кладет событие в ограниченную очередь и сразу возвращается,
+    фоновая задача дописывает события порциями в JSONL. Поля: t - время, e - тип,
+    u - пользователь, g - игра, a - действие админа, p - страница"""
+
+    def __init__(self, path: str = EVENTS_FILE, maxsize: int = EVENTS_QUEUE_SIZE, batch_size: int = EVENTS_BATCH,
+                 interval: float = EVENTS_FLUSH_INTERVAL, max_bytes: int = EVENTS_MAX_BYTES,
+                 backups: int = EVENTS_BACKUPS):
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        # Порция, взятая из очереди, но еще не записанная (допишется при остановке)
+        self._batch: List[Dict[str, Any]] = []
+        self._file_lock = threading.Lock()
+        self.written = 0
+        # Событие теряется, если писатель не успевает: обработчики не ждут журнала
+        self.dropped = 0
+
+    def emit(self, kind: str, user_id: int | None, **fields):
+        event = {"t": int(time.time()), "e": kind, "u": user_id}
+        event.update(fields)
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def run(self):
+        while True:
+            self._batch = [await self.queue.get()]
+            # Небольшая пауза, чтобы в одну запись попало все, что накопилось
+            await asyncio.sleep(self.interval)
+            batch, self._batch = self._batch, []
+            await self._write(batch)
+
+    async def _write(self, batch: List[Dict[str, Any]]):
+        while len(batch) < self.batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        activity_stats.add(batch)
+        try:
+            await run_io(self._append, batch)
+            self.written += len(batch)
+        except OSError as e:
+            logger.error("Error writing event log: %s", e)
+
+    async def flush(self):
+        """Дописать все, что осталось в очереди (при остановке бота)"""
+        batch, self._batch = self._batch, []
+        while batch or not self.queue.empty():
+            if not batch:
+                batch = [self.queue.get_nowait()]
+            await self._write(batch)
+            batch = []
+
+    def _append(self, batch: List[Dict[str, Any]]):
+        data = "".join(json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n" for event in batch)
+        data = data.encode("utf-8")
+        with self._file_lock:
+            size = file_size(self.path) or 0
+            if size and size + len(data) > self.max_bytes:
+                self._rotate()
+            with open(self.path, "ab") as f:
+                f.write(data)
+
+    def _rotate(self):
+        for number in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{number}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{number + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+event_log = EventLog()
+metrics.gauge("gambot_events_queued", "Activity events waiting to be written", lambda: event_log.queue.qsize())
+metrics.counter("gambot_events_dropped", "Activity events dropped because the queue was full", lambda: event_log.dropped)
+
+async def run_activity_rollups(interval: float = ROLLUP_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await activity_stats.save()
+        except Exception as e:
+            logger.error("Error saving activity rollups: %s", e)
+
+# ========== ПРОВЕРКА ФАЙЛОВ ==========
+# Предел текста одной страницы отчета (у Telegram 4096 символов на сообщение)
+REPORT_PAGE_CHARS = 3500
+# Поле игры → (название, «не найден», «поврежден») с нужным родом
+FIELD_TITLES = {
+    "photo": ("ФОТО", "НЕ НАЙДЕНО", "ПОВРЕЖДЕНО"),
+    "photo_optimized": ("СЖАТАЯ ОБЛОЖКА", "НЕ НАЙДЕНА", "ПОВРЕЖДЕНА"),
+    "photo_thumb": ("МИНИАТЮРА", "НЕ НАЙДЕНА", "ПОВРЕЖДЕНА"),
+    "file": ("ФАЙЛ", "НЕ НАЙДЕН", "ПОВРЕЖДЕН"),
+}
+
+def file_sha256(path: str, chunk_size: int = MEDIA_CHUNK_SIZE) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def is_service_file(name: str) -> bool:
+    """Файлы самого бота в DATA_DIR (базы, журналы и их части), а не загрузки"""
+    for path in (DB_FILE, USERS_FILE, BLOCKED_USERS_FILE, SQLITE_FILE, FSM_SQLITE_FILE,
+                 BROADCAST_FILE, EVENTS_FILE, ROLLUPS_FILE, GAME_IDS_FILE):
+        base = os.path.basename(path)
+        if name == base or name.startswith(base + ".") or name.startswith(base + "-"):
+            return True
+    return False
+
+class MediaScanner:
+    """Проверка файлов каталога в фоне: stat и хэши считаются в собственном небольшом пуле, чтобы
+    долгая проверка не занимала потоки обработчиков; файлы с прежними mtime и размером повторно не читаются"""
+
+    def __init__(self, workers: int = MEDIA_SCAN_WORKERS, verify: bool = MEDIA_SCAN_VERIFY):
+        self.workers = max(1, workers)
+        self.verify = verify
+        self.report: Dict[str, Any] | None = None
+        # путь → ((mtime_ns, размер), результат проверки, сверялся ли хэш)
+        self._cache: Dict[str, tuple] = {}
+        self._task: asyncio.Task | None = None
+        self._task_verifies = False
+        self._executor: ThreadPoolExecutor | None = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def scan(self, verify: bool | None = None) -> Dict[str, Any]:
+        """Пересканировать; verify - сверить хэши файлов из media/. Одновременные запросы ждут один проход"""
+        verify = self.verify if verify is None else verify
+        if self.running and verify and not self._task_verifies:
+            # Идет проверка без хэшей - дожидаемся ее и сверяем заново
+            await asyncio.shield(self._task)
+        if not self.running:
+            self._task = asyncio.create_task(self._run(verify))
+            self._task_verifies = verify
+        return await asyncio.shield(self._task)
+
+    async def _run_in_pool(self, func, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scan")
+        start = time.perf_counter()
+        error = False
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, partial(func, *args))
+        except Exception:
+            error = True
+            raise
+        finally:
+            metrics.observe("io", func.__qualname__, time.perf_counter() - start, error)
+
+    def _check(self, path: str, verify: bool) -> tuple:
+        """(ok | missing | damaged, размер)"""
+        full_path = os.path.join(DATA_DIR, path)
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            return "missing", None
+        key = (st.st_mtime_ns, st.st_size)
+        cached = self._cache.get(path)
+        if cached is not None and cached[0] == key and (cached[2] or not verify):
+            return cached[1], st.st_size
+        status = "ok"
+        verify = verify and media_store.manages(path)
+        if verify:
+            # Имя файла в хранилище медиа - хэш его содержимого
+            expected = os.path.splitext(os.path.basename(path))[0]
+            try:
+                status = "ok" if file_sha256(full_path) == expected else "damaged"
+            except OSError:
+                return "missing", None
+        self._cache[path] = (key, status, verify)
+        return status, st.st_size
+
+    def _check_paths(self, paths: List[str], verify: bool) -> Dict[str, tuple]:
+        results = {}
+        for path in paths:
+            if self._stopping:
+                break
+            results[path] = self._check(path, verify)
+        return results
+
+    def _list_files(self) -> Dict[str, int]:
+        """Файлы загрузок в DATA_DIR: путь относительно DATA_DIR → размер"""
+        files = {}
+        now = time.time()
+        for root, _, names in os.walk(DATA_DIR):
+            for name in names:
+                full_path = os.path.join(root, name)
+                relative = os.path.relpath(full_path, DATA_DIR)
+                if root == DATA_DIR and is_service_file(name):
+                    continue
+                if root == PROFILES_DIR:
+                    continue
+                try:
+                    st = os.stat(full_path)
+                except OSError:
+                    continue
+                # Временные файлы незавершенных записей - не мусор, пока не устарели
+                if name.startswith(".") and now - st.st_mtime < TEMP_FILE_MAX_AGE:
+                    continue
+                files[relative] = st.st_size
+        return files
+
+    async def _run(self, verify: bool) -> Dict[str, Any]:
+        start = time.perf_counter()
+        games = games_catalog.all()
+        paths = sorted({game[field] for game in games.values() for field in MEDIA_FIELDS if game.get(field)})
+        chunks = [paths[i::self.workers] for i in range(self.workers) if paths[i::self.workers]]
+        files, *parts = await asyncio.gather(self._run_in_pool(self._list_files),
+                                             *(self._run_in_pool(self._check_paths, chunk, verify) for chunk in chunks))
+        results: Dict[str, tuple] = {}
+        for part in parts:
+            results.update(part)
+        # Забываем файлы, на которые каталог больше не ссылается
+        for path in set(self._cache) - set(paths):
+            self._cache.pop(path, None)
+        
+        problems, fine = [], []
+        counts = Counter()
+        for game_name, game in games.items():
+            if not game.get("file") and not game.get("photo"):
+                fine.append(f"📝 {game_name}: нет файлов и фото")
+            for field in MEDIA_FIELDS:
+                path = game.get(field)
+                if not path:
+                    continue
+                status, size = results.get(path, ("missing", None))
+                counts[status] += 1
+                title, missing, damaged = FIELD_TITLES[field]
+                if status == "missing":
+                    problems.append(f"❌ {game_name}: {title} {missing} - {path}")
+                elif status == "damaged":
+                    problems.append(f"⚠️ {game_name}: {title} {damaged} - {path} ({size} байт)")
+                else:
+                    icon = "✅" if field == "file" else "🖼"
+                    fine.append(f"{icon} {game_name}: {title} - {path} ({size} байт)")
+        referenced = set(paths)
+        orphans = sorted(path for path in files if path not in referenced)
+        orphan_lines = [f"🗑 Без ссылок: {path} ({files[path]} байт)" for path in orphans]
+        
+        pages, page = [], ""
+        for line in problems + orphan_lines + fine:
+            if page and len(page) + len(line) + 1 > REPORT_PAGE_CHARS:
+                pages.append(page)
+                page = ""
+            page += line[:REPORT_PAGE_CHARS] + "\n"
+        if page or not pages:
+            pages.append(page or "📭 Нет игр в базе.")
+        
+        self.report = {
+            "pages": pages,
+            "ok": counts["ok"],
+            "missing": counts["missing"],
+            "damaged": counts["damaged"],
+            "orphans": len(orphans),
+            "orphan_bytes": sum(files[path] for path in orphans),
+            "finished": time.time(),
+            "duration": time.perf_counter() - start,
+        }
+        logger.info("Media scan: %s files, %s missing, %s damaged, %s orphans, %.2fs",
+                    len(paths), counts['missing'], counts['damaged'], len(orphans), self.report['duration'])
+        return self.report
+
+    def render(self, page: int = 0) -> tuple[str, InlineKeyboardMarkup]:
+        report = self.report
+        pages = report["pages"]
+        page = min(max(page, 0), len(pages) - 1)
+        text = (f"📁 Проверка файлов ({format_duration(time.time() - report['finished'])} назад, "
+                f"заняла {report['duration']:.1f} сек)\n"
+                f"✅ В порядке: {report['ok']} · ❌ Нет: {report['missing']} · ⚠️ Повреждены: {report['damaged']} · "
+                f"🗑 Без ссылок: {report['orphans']} ({report['orphan_bytes']} байт)\n\n{pages[page]}")
+        keyboard = []
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton(text="◀️", callback_data=FilesCallback(page=page - 1).pack()))
+        if page < len(pages) - 1:
+            navigation.append(InlineKeyboardButton(text="▶️", callback_data=FilesCallback(page=page + 1).pack()))
+        if navigation:
+            keyboard.append(navigation)
+            text += f"\n📄 Страница {page + 1}/{len(pages)}"
+        keyboard.append([InlineKeyboardButton(text="🔄 Пересканировать", callback_data="checkfiles_rescan")])
+        return text, InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+    async def stop(self):
+        self._stopping = True
+        if self._task is not None:
+            self._task.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+media_scanner = MediaScanner()
+
+async def run_media_scanner(interval: float = MEDIA_SCAN_INTERVAL):
+    while True:
+        try:
+            await media_scanner.scan()
+        except Exception as e:
+            logger.error("Error scanning media: %s", e)
+        await asyncio.sleep(interval)
+
+# ========== CALLBACK'И ==========
+# Вместо названия игры в callback_data передается ее id: название может не влезть в 64 байта
+class GameCallback(CallbackData, prefix="g"):
+    action: str
+    game_id: int
+
+class PageCallback(CallbackData, prefix="p"):
+    kind: str
+    page: int
+
+class FilesCallback(CallbackData, prefix="f"):
+    page: int
+
+class UsersCallback(CallbackData, prefix="u"):
+    sort: str
+    status: str
+    cursor: int
+    forward: bool
+    query: str | None = None
+
+def game_callback(action: str, game_name: str) -> str:
+    return GameCallback(action=action, game_id=games_catalog.id_of(game_name)).pack()
+
+# Префиксы кнопок старого формата (game_<название> и т.п.) → действие
+LEGACY_GAME_ACTIONS = {
+    "game": "view",
+    "pirate": "pirate",
+    "original": "original",
+    "add_photo": "add_photo",
+    "add_pirate": "add_pirate",
+    "add_original": "add_original",
+    "delete": "delete",
+}
+
+def legacy_game_callback(callback: types.CallbackQuery) -> Dict[str, Any] | bool:
+    """Фильтр для кнопок старого формата, которые еще остались в чатах"""
+    head, _, rest = (callback.data or "").partition("_")
+    if head == "add":
+        kind, _, rest = rest.partition("_")
+        head = f"add_{kind}"
+    action = LEGACY_GAME_ACTIONS.get(head)
+    if not action or not rest:
+        return False
+    return {"action": action, "game_name": rest}
 
 # ========== КЛАВИАТУРЫ ==========
-def get_main_keyboard(user: types.User) -> ReplyKeyboardMarkup:
+# Постоянные клавиатуры собираются один раз: разметка не меняется и только читается при отправке
+def build_main_keyboard(admin: bool) -> ReplyKeyboardMarkup:
     buttons = [
         [KeyboardButton(text="🎮 Список игр"), KeyboardButton(text="💖 Донат")],
     ]
-    if is_admin(user.username):
+    if admin:
         buttons.append([KeyboardButton(text="⚙️ Админ-меню")])
     
     return ReplyKeyboardMarkup(
@@ -130,23 +2408,157 @@ def get_main_keyboard(user: types.User) -> ReplyKeyboardMarkup:
         input_field_placeholder="Выберите действие..."
     )
 
+MAIN_KEYBOARD = build_main_keyboard(admin=False)
+ADMIN_MAIN_KEYBOARD = build_main_keyboard(admin=True)
+BACK_TO_MAIN_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[[InlineKeyboardButton(text="🔙 Назад в меню", callback_data="back_to_main")]]
+)
+BACK_TO_ADMIN_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[[InlineKeyboardButton(text="🔙 Назад в админ-меню", callback_data="back_to_admin")]]
+)
+ADMIN_MENU_TEXT = "⚙️ <b>Админ-меню</b>\n\nВыберите действие:"
+ADMIN_MENU_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🎮 Добавить новую игру", callback_data="admin_add_game")],
+    [InlineKeyboardButton(text="🖼 Добавить фото к игре", callback_data="admin_add_photo_existing")],
+    [InlineKeyboardButton(text="📤 Добавить пиратку к игре", callback_data="admin_add_pirate_existing")],
+    [InlineKeyboardButton(text="🔗 Добавить оригинал к игре", callback_data="admin_add_original_existing")],
+    [InlineKeyboardButton(text="🗑 Удалить игру", callback_data="admin_delete_game")],
+    [InlineKeyboardButton(text="👥 Список пользователей", callback_data="admin_list_users")],
+    [InlineKeyboardButton(text="🚫 Заблокировать пользователя", callback_data="admin_block_user")],
+    [InlineKeyboardButton(text="✅ Разблокировать пользователя", callback_data="admin_unblock_user")],
+    [InlineKeyboardButton(text="📢 Рассылка", callback_data="admin_broadcast")],
+    [InlineKeyboardButton(text="📥 Импорт каталога", callback_data="admin_import"),
+     InlineKeyboardButton(text="💾 Экспорт каталога", callback_data="admin_export")],
+    [InlineKeyboardButton(text="🔙 Назад в меню", callback_data="back_to_main")]
+])
+
+def get_main_keyboard(user: types.User) -> ReplyKeyboardMarkup:
+    return ADMIN_MAIN_KEYBOARD if is_admin(user.username) else MAIN_KEYBOARD
+
 def get_back_to_main_inline_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[[InlineKeyboardButton(text="🔙 Назад в меню", callback_data="back_to_main")]]
-    )
+    return BACK_TO_MAIN_KEYBOARD
 
 def get_back_to_admin_inline_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        inline_keyboard=[[InlineKeyboardButton(text="🔙 Назад в админ-меню", callback_data="back_to_admin")]]
-    )
+    return BACK_TO_ADMIN_KEYBOARD
+
+# Списки выбора игры: (текст, действие по нажатию на игру, кнопка возврата, текст для пустого каталога)
+GAME_PICKERS = {
+    "games": ("🎯 Выберите игру:", "view",
+              ("🔙 Назад в меню", "back_to_main"), "📭 Список игр пуст. Администратор должен добавить игры."),
+    "add_photo": ("🖼 Выберите игру для добавления фото:", "add_photo",
+                  ("🔙 Назад", "back_to_admin"), "📭 Нет игр для обновления."),
+    "add_pirate": ("📤 Выберите игру для добавления пиратской версии:", "add_pirate",
+                   ("🔙 Назад", "back_to_admin"), "📭 Нет игр для обновления."),
+    "add_original": ("🔗 Выберите игру для добавления оригинальной версии:", "add_original",
+                     ("🔙 Назад", "back_to_admin"), "📭 Нет игр для обновления."),
+    "delete": ("🗑 <b>Выберите игру для удаления:</b>", "delete",
+               ("🔙 Назад в админ-меню", "back_to_admin"), "📭 Нет игр для удаления."),
+}
+
+class GamePickerKeyboards:
+    """Готовые клавиатуры страниц каталога; пересобираются только при изменении набора игр"""
+
+    def __init__(self, page_size: int = GAMES_PAGE_SIZE):
+        self.page_size = page_size
+        self._version = None
+        self._pages: Dict[str, List[InlineKeyboardMarkup]] = {}
+
+    def page(self, kind: str, page: int) -> tuple[InlineKeyboardMarkup | None, int, int]:
+        """Клавиатура страницы, номер страницы (с поправкой на границы) и число страниц"""
+        games_catalog.all()
+        # При сортировке по популярности страницы пересобираются после каждого пересчета сводок
+        version = (games_catalog.names_version, activity_stats.version if GAMES_ORDER == "popular" else 0)
+        if self._version != version:
+            self._pages.clear()
+            self._version = version
+        pages = self._pages.get(kind)
+        if pages is None:
+            pages = self._pages[kind] = self._build(kind)
+        if not pages:
+            return None, 0, 0
+        page = min(max(page, 0), len(pages) - 1)
+        return pages[page], page, len(pages)
+
+    def _build(self, kind: str) -> List[InlineKeyboardMarkup]:
+        _, action, (back_text, back_data), _ = GAME_PICKERS[kind]
+        games = list(games_catalog.all().items())
+        if kind == "games" and GAMES_ORDER == "popular":
+            views = activity_stats.views
+            games.sort(key=lambda item: views.get(item[0], 0), reverse=True)
+        total = (len(games) + self.page_size - 1) // self.page_size
+        pages = []
+        for number in range(total):
+            chunk = games[number * self.page_size:(number + 1) * self.page_size]
+            keyboard = [
+                [InlineKeyboardButton(text=name, callback_data=GameCallback(action=action, game_id=game["id"]).pack())]
+                for name, game in chunk
+            ]
+            navigation = []
+            if number > 0:
+                navigation.append(InlineKeyboardButton(text="◀️", callback_data=PageCallback(kind=kind, page=number - 1).pack()))
+            if number < total - 1:
+                navigation.append(InlineKeyboardButton(text="▶️", callback_data=PageCallback(kind=kind, page=number + 1).pack()))
+            if navigation:
+                keyboard.append(navigation)
+            keyboard.append([InlineKeyboardButton(text=back_text, callback_data=back_data)])
+            pages.append(InlineKeyboardMarkup(inline_keyboard=keyboard))
+        return pages
+
+game_picker_keyboards = GamePickerKeyboards()
+
+class GameCards:
+    """Готовые карточки игр (подпись и клавиатура): собираются при первом просмотре
+    и сбрасываются, когда игра меняется в каталоге"""
+
+    def __init__(self):
+        self._cards: Dict[str, tuple[str, InlineKeyboardMarkup]] = {}
+
+    def get(self, game_name: str, game: Dict[str, Any]) -> tuple[str, InlineKeyboardMarkup]:
+        card = self._cards.get(game_name)
+        if card is None:
+            card = self._cards[game_name] = self._build(game_name, game)
+        return card
+
+    @staticmethod
+    def _build(game_name: str, game: Dict[str, Any]) -> tuple[str, InlineKeyboardMarkup]:
+        keyboard = []
+        if game.get("file"):
+            keyboard.append([InlineKeyboardButton(text="🏴‍☠️ Пиратская версия", callback_data=game_callback("pirate", game_name))])
+        if game.get("original_url"):
+            keyboard.append([InlineKeyboardButton(text="🛒 Оригинал (лицензия)", callback_data=game_callback("original", game_name))])
+        keyboard.append([InlineKeyboardButton(text="🔙 Назад к списку", callback_data="back_to_games_list")])
+        
+        description = game.get("description", "Описание отсутствует")
+        caption = f"🎮 <b>{game_name}</b>\n\n{description}\n\n➡️ Выберите тип игры:"
+        return caption, InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+    # Подписка на изменения каталога
+    def catalog_reloaded(self, games: Dict[str, Any]):
+        self._cards.clear()
+
+    def game_saved(self, game_name: str, game: Dict[str, Any]):
+        self._cards.pop(game_name, None)
+
+    def game_deleted(self, game_name: str, game: Dict[str, Any]):
+        self._cards.pop(game_name, None)
+
+game_cards = GameCards()
+games_catalog.add_listener(game_cards)
+
+def render_game_picker(kind: str, page: int = 0) -> tuple[str, InlineKeyboardMarkup]:
+    title, _, _, empty_text = GAME_PICKERS[kind]
+    markup, page, total = game_picker_keyboards.page(kind, page)
+    if markup is None:
+        back_markup = get_back_to_main_inline_keyboard() if kind == "games" else get_back_to_admin_inline_keyboard()
+        return empty_text, back_markup
+    if total > 1:
+        title = f"{title}\n\n📄 Страница {page + 1}/{total}"
+    return title, markup
 
 # ========== ОСНОВНЫЕ КОМАНДЫ ==========
 async def start_command(message: types.Message):
-    save_user(message.from_user)
-    
-    if is_user_blocked(message.from_user.id):
-        await message.answer("❌ Вы заблокированы и не можете использовать бота.", reply_markup=ReplyKeyboardRemove())
-        return
+    await save_user(message.from_user)
+    event_log.emit("start", message.from_user.id)
     
     await message.answer(
         START_TEXT,
@@ -154,84 +2566,104 @@ async def start_command(message: types.Message):
     )
 
 async def handle_main_menu_buttons(message: types.Message):
-    if is_user_blocked(message.from_user.id):
-        await message.answer("❌ Вы заблокированы.", reply_markup=ReplyKeyboardRemove())
-        return
-    
     if message.text == "🎮 Список игр":
+        event_log.emit("list", message.from_user.id, p=0)
         await show_games_list(message)
     elif message.text == "💖 Донат":
+        event_log.emit("donate", message.from_user.id)
         await show_donate(message)
     elif message.text == "⚙️ Админ-меню":
         await show_admin_menu(message)
 
 # ========== ФУНКЦИОНАЛ ИГР ==========
-async def show_games_list(message: types.Message):
-    games = load_json(DB_FILE)
-    
-    if not games:
-        await message.answer(
-            "📭 Список игр пуст. Администратор должен добавить игры.",
-            reply_markup=get_back_to_main_inline_keyboard()
-        )
+async def show_games_list(message: types.Message, page: int = 0):
+    text, markup = render_game_picker("games", page)
+    await message.answer(text, reply_markup=markup)
+
+async def handle_game_picker_page(callback: types.CallbackQuery, callback_data: PageCallback):
+    kind = callback_data.kind
+    if kind not in GAME_PICKERS:
+        await callback.answer()
+        return
+    if kind != "games" and not is_admin(callback.from_user.username):
+        await callback.answer("❌ Нет доступа", show_alert=True)
         return
     
-    keyboard = []
-    for game_name in games.keys():
-        keyboard.append([InlineKeyboardButton(text=game_name, callback_data=f"game_{game_name}")])
-    
-    keyboard.append([InlineKeyboardButton(text="🔙 Назад в меню", callback_data="back_to_main")])
-    markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
-    
-    await message.answer("🎯 Выберите игру:", reply_markup=markup)
+    if kind == "games":
+        event_log.emit("list", callback.from_user.id, p=callback_data.page)
+    text, markup = render_game_picker(kind, callback_data.page)
+    await callback.message.edit_text(text, reply_markup=markup, parse_mode=ParseMode.HTML)
 
-async def handle_game_selection(callback: types.CallbackQuery):
-    game_name = callback.data.split("_", 1)[1]
-    games = load_json(DB_FILE)
-    game = games.get(game_name)
+async def handle_game_selection(callback: types.CallbackQuery, game_name: str, state: FSMContext):
+    game = games_catalog.get(game_name)
     
     if not game:
         await callback.message.edit_text("❌ Игра не найдена.")
         return
-    
-    keyboard = []
-    if game.get("file"):
-        keyboard.append([InlineKeyboardButton(text="🏴‍☠️ Пиратская версия", callback_data=f"pirate_{game_name}")])
-    if game.get("original_url"):
-        keyboard.append([InlineKeyboardButton(text="🛒 Оригинал (лицензия)", callback_data=f"original_{game_name}")])
-    
-    keyboard.append([InlineKeyboardButton(text="🔙 Назад к списку", callback_data="back_to_games_list")])
-    markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
-    
-    description = game.get("description", "Описание отсутствует")
+    event_log.emit("view", callback.from_user.id, g=game_name)
+    caption, markup = game_cards.get(game_name, game)
     
     # Если есть фото - отправляем фото с описанием
-    if game.get("photo"):
-        photo_path = os.path.join(DATA_DIR, game["photo"])
-        if os.path.exists(photo_path):
-            try:
-                with open(photo_path, 'rb') as photo_file:
-                    await callback.message.answer_photo(
-                        types.BufferedInputFile(photo_file.read(), filename="game_photo.jpg"),
-                        caption=f"🎮 <b>{game_name}</b>\n\n{description}\n\n➡️ Выберите тип игры:",
-                        reply_markup=markup,
-                        parse_mode=ParseMode.HTML
-                    )
-                    return
-            except Exception as e:
-                logger.error(f"Error sending photo: {e}")
+    if game.get("photo") and await send_game_photo(callback.message, game_name, game, caption, markup):
+        return
     
     # Если фото нет - отправляем просто текст
     await callback.message.edit_text(
-        f"🎮 <b>{game_name}</b>\n\n{description}\n\n➡️ Выберите тип игры:",
+        caption,
         reply_markup=markup,
         parse_mode=ParseMode.HTML
     )
 
-async def handle_pirate_version(callback: types.CallbackQuery):
-    game_name = callback.data.split("_", 1)[1]
-    games = load_json(DB_FILE)
-    game = games.get(game_name)
+FILE_ID_ERRORS = ("wrong file identifier", "wrong remote file", "file reference", "file_reference", "invalid file_id")
+
+def is_file_id_error(error: TelegramBadRequest) -> bool:
+    """Ошибка из-за устаревшего или чужого file_id"""
+    text = error.message.lower()
+    return any(marker in text for marker in FILE_ID_ERRORS)
+
+async def send_game_photo(message: types.Message, game_name: str, game: Dict[str, Any],
+                          caption: str, markup: InlineKeyboardMarkup) -> bool:
+    """Отправка обложки: по сохраненному file_id, иначе загрузкой файла с диска"""
+    photo_file_id = game.get("photo_file_id")
+    if photo_file_id:
+        try:
+            await message.answer_photo(photo_file_id, caption=caption, reply_markup=markup, parse_mode=ParseMode.HTML)
+            return True
+        except TelegramBadRequest as e:
+            if not is_file_id_error(e):
+                # Ошибка не в файле (подпись, разметка) - повторная загрузка не поможет
+                logger.error("Error sending photo: %s", e)
+                return False
+            # Telegram не принял старый file_id - загружаем файл заново
+            logger.warning("Cached photo for %s rejected: %s", game_name, e)
+            await games_catalog.update(game_name, {"photo_file_id": None})
+            game = games_catalog.get(game_name) or game
+    
+    # С диска отправляется пережатая версия, пока ее нет - исходник
+    photo_path = os.path.join(DATA_DIR, game.get("photo_optimized") or game["photo"])
+    if not await run_io(os.path.exists, photo_path):
+        photo_path = os.path.join(DATA_DIR, game["photo"])
+        if not await run_io(os.path.exists, photo_path):
+            return False
+    try:
+        # FSInputFile читает файл через aiofiles, не блокируя цикл событий
+        sent = await message.answer_photo(
+            types.FSInputFile(photo_path, filename=f"game_photo{os.path.splitext(photo_path)[1] or '.jpg'}"),
+            caption=caption,
+            reply_markup=markup,
+            parse_mode=ParseMode.HTML
+        )
+    except Exception as e:
+        logger.error("Error sending photo: %s", e)
+        return False
+    
+    # Запоминаем file_id, если фото не заменили, пока шла загрузка
+    if sent.photo and games_catalog.get(game_name) is game:
+        await games_catalog.update(game_name, {"photo_file_id": sent.photo[-1].file_id})
+    return True
+
+async def handle_pirate_version(callback: types.CallbackQuery, game_name: str, state: FSMContext):
+    game = games_catalog.get(game_name)
     
     if not game or not game.get("file"):
         await callback.message.edit_text("❌ Файл недоступен.")
@@ -240,53 +2672,40 @@ async def handle_pirate_version(callback: types.CallbackQuery):
     file_name = game["file"]
     file_path = os.path.join(DATA_DIR, file_name)
     
-    if not os.path.exists(file_path):
+    if not await run_io(os.path.exists, file_path):
         await callback.message.edit_text("❌ Файл не найден на сервере.")
         return
+    event_log.emit("pirate", callback.from_user.id, g=game_name)
 
-    # Прогресс-бар
-    message = await callback.message.edit_text(f"⏬ Подготовка загрузки «{game_name}»\n[{' ' * 20}] 0%")
-    
-    steps = 10
-    for i in range(1, steps + 1):
-        percentage = i * 10
-        filled = i * 2
-        bar = "█" * filled + "▒" * (20 - filled)
-        
-        try:
-            await callback.message.edit_text(f"⏬ Загрузка «{game_name}»:\n[{bar}] {percentage}%")
-        except Exception:
-            pass
-        
-        await asyncio.sleep(0.3)
-
-    await callback.message.edit_text("✅ Готово! Отправляю файл...")
+    # Один статус вместо анимации прогресса из 12 правок: ограничитель отправок пропускает в чат
+    # одно сообщение в секунду, и анимация растягивала выдачу файла на десяток секунд
+    await callback.message.edit_text(f"⏬ Отправляю файл «{game_name}»...")
     
     try:
         original_filename = game.get("original_filename", file_name)
-        with open(file_path, 'rb') as file:
-            await callback.message.answer_document(
-                types.BufferedInputFile(file.read(), filename=original_filename),
-                caption=f"🎮 <b>{game_name}</b> - Пиратская версия\n\nУстановите файл на ваше устройство.",
-                parse_mode=ParseMode.HTML
-            )
+        thumb = game.get("photo_thumb")
+        await callback.message.answer_document(
+            types.FSInputFile(file_path, filename=original_filename),
+            thumbnail=types.FSInputFile(os.path.join(DATA_DIR, thumb), filename="thumb.jpg") if thumb else None,
+            caption=f"🎮 <b>{game_name}</b> - Пиратская версия\n\nУстановите файл на ваше устройство.",
+            parse_mode=ParseMode.HTML
+        )
     except Exception as e:
-        logger.error(f"Error sending file: {e}")
+        logger.error("Error sending file: %s", e)
         await callback.message.answer(f"❌ Ошибка при отправке файла: {e}")
 
-async def handle_original_version(callback: types.CallbackQuery):
-    game_name = callback.data.split("_", 1)[1]
-    games = load_json(DB_FILE)
-    game = games.get(game_name)
+async def handle_original_version(callback: types.CallbackQuery, game_name: str, state: FSMContext):
+    game = games_catalog.get(game_name)
     
     if not game or not game.get("original_url"):
         await callback.message.edit_text("❌ Ссылка недоступна.")
         return
+    event_log.emit("original", callback.from_user.id, g=game_name)
     
     url = game["original_url"]
     keyboard = [
         [InlineKeyboardButton(text=f"🛒 Установить «{game_name}» (лицензия)", url=url)],
-        [InlineKeyboardButton(text="🔙 Назад к игре", callback_data=f"game_{game_name}")]
+        [InlineKeyboardButton(text="🔙 Назад к игре", callback_data=game_callback("view", game_name))]
     ]
     markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
     
@@ -310,26 +2729,66 @@ async def show_donate(message: types.Message):
         parse_mode=ParseMode.HTML
     )
 
+# ========== ПОИСК ИГР ==========
+async def search_command(message: types.Message, command: CommandObject):
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer("🔎 Введите запрос после команды, например: /search gta")
+        return
+    
+    await search_index.refresh()
+    game_ids = search_index.search(query, limit=GAMES_PAGE_SIZE)
+    if not game_ids:
+        await message.answer(f"😕 По запросу «{escape(query)}» ничего не найдено.", reply_markup=get_back_to_main_inline_keyboard())
+        return
+    
+    keyboard = []
+    for game_id in game_ids:
+        keyboard.append([InlineKeyboardButton(
+            text=games_catalog.name_by_id(game_id),
+            callback_data=GameCallback(action="view", game_id=game_id).pack()
+        )])
+    keyboard.append([InlineKeyboardButton(text="🔙 Назад в меню", callback_data="back_to_main")])
+    
+    await message.answer(f"🔎 Результаты поиска «{escape(query)}»:", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
+
+async def handle_inline_query(inline_query: types.InlineQuery, bot: Bot):
+    query = inline_query.query.strip()
+    if query:
+        await search_index.refresh()
+        game_ids = search_index.search(query)
+    else:
+        game_ids = [game["id"] for game in islice(games_catalog.all().values(), SEARCH_RESULTS_LIMIT)]
+    
+    me = await bot.me()
+    results = []
+    for game_id in game_ids:
+        game_name = games_catalog.name_by_id(game_id)
+        game = games_catalog.get(game_name)
+        description = game.get("description") or "Описание отсутствует"
+        keyboard = [[InlineKeyboardButton(text="🎮 Открыть в боте", url=f"https://t.me/{me.username}")]]
+        if game.get("original_url"):
+            keyboard.insert(0, [InlineKeyboardButton(text="🛒 Оригинал (лицензия)", url=game["original_url"])])
+        results.append(types.InlineQueryResultArticle(
+            id=str(game_id),
+            title=game_name,
+            description=description[:100],
+            input_message_content=types.InputTextMessageContent(
+                message_text=f"🎮 <b>{escape(game_name)}</b>\n\n{escape(description)}",
+                parse_mode=ParseMode.HTML
+            ),
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard)
+        ))
+    
+    await inline_query.answer(results, cache_time=INLINE_CACHE_TIME)
+
 # ========== АДМИН-ПАНЕЛЬ ==========
 async def show_admin_menu(message: types.Message):
     if not is_admin(message.from_user.username):
         await message.answer("❌ У вас нет прав администратора.")
         return
     
-    keyboard = [
-        [InlineKeyboardButton(text="🎮 Добавить новую игру", callback_data="admin_add_game")],
-        [InlineKeyboardButton(text="🖼 Добавить фото к игре", callback_data="admin_add_photo_existing")],
-        [InlineKeyboardButton(text="📤 Добавить пиратку к игре", callback_data="admin_add_pirate_existing")],
-        [InlineKeyboardButton(text="🔗 Добавить оригинал к игре", callback_data="admin_add_original_existing")],
-        [InlineKeyboardButton(text="🗑 Удалить игру", callback_data="admin_delete_game")],
-        [InlineKeyboardButton(text="👥 Список пользователей", callback_data="admin_list_users")],
-        [InlineKeyboardButton(text="🚫 Заблокировать пользователя", callback_data="admin_block_user")],
-        [InlineKeyboardButton(text="✅ Разблокировать пользователя", callback_data="admin_unblock_user")],
-        [InlineKeyboardButton(text="🔙 Назад в меню", callback_data="back_to_main")]
-    ]
-    markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
-    
-    await message.answer("⚙️ <b>Админ-меню</b>\n\nВыберите действие:", reply_markup=markup, parse_mode=ParseMode.HTML)
+    await message.answer(ADMIN_MENU_TEXT, reply_markup=ADMIN_MENU_KEYBOARD, parse_mode=ParseMode.HTML)
 
 async def handle_admin_add_game(callback: types.CallbackQuery, state: FSMContext):
     if not is_admin(callback.from_user.username):
@@ -349,54 +2808,26 @@ async def handle_admin_add_photo_existing(callback: types.CallbackQuery):
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
     
-    games = load_json(DB_FILE)
-    if not games:
-        await callback.message.edit_text("📭 Нет игр для обновления.", reply_markup=get_back_to_admin_inline_keyboard())
-        return
-    
-    keyboard = []
-    for game_name in games.keys():
-        keyboard.append([InlineKeyboardButton(text=game_name, callback_data=f"add_photo_{game_name}")])
-    
-    keyboard.append([InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_admin")])
-    await callback.message.edit_text("🖼 Выберите игру для добавления фото:", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
+    text, markup = render_game_picker("add_photo")
+    await callback.message.edit_text(text, reply_markup=markup)
 
 async def handle_admin_add_pirate_existing(callback: types.CallbackQuery):
     if not is_admin(callback.from_user.username):
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
     
-    games = load_json(DB_FILE)
-    if not games:
-        await callback.message.edit_text("📭 Нет игр для обновления.", reply_markup=get_back_to_admin_inline_keyboard())
-        return
-    
-    keyboard = []
-    for game_name in games.keys():
-        keyboard.append([InlineKeyboardButton(text=game_name, callback_data=f"add_pirate_{game_name}")])
-    
-    keyboard.append([InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_admin")])
-    await callback.message.edit_text("📤 Выберите игру для добавления пиратской версии:", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
+    text, markup = render_game_picker("add_pirate")
+    await callback.message.edit_text(text, reply_markup=markup)
 
 async def handle_admin_add_original_existing(callback: types.CallbackQuery):
     if not is_admin(callback.from_user.username):
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
     
-    games = load_json(DB_FILE)
-    if not games:
-        await callback.message.edit_text("📭 Нет игр для обновления.", reply_markup=get_back_to_admin_inline_keyboard())
-        return
-    
-    keyboard = []
-    for game_name in games.keys():
-        keyboard.append([InlineKeyboardButton(text=game_name, callback_data=f"add_original_{game_name}")])
-    
-    keyboard.append([InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_admin")])
-    await callback.message.edit_text("🔗 Выберите игру для добавления оригинальной версии:", reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard))
+    text, markup = render_game_picker("add_original")
+    await callback.message.edit_text(text, reply_markup=markup)
 
-async def handle_add_photo_to_game(callback: types.CallbackQuery, state: FSMContext):
-    game_name = callback.data.split("_", 2)[2]
+async def handle_add_photo_to_game(callback: types.CallbackQuery, game_name: str, state: FSMContext):
     await state.update_data(game_name=game_name)
     await callback.message.edit_text(
         f"🖼 Добавление фото для «{game_name}». Отправьте фото:",
@@ -406,8 +2837,7 @@ async def handle_add_photo_to_game(callback: types.CallbackQuery, state: FSMCont
     )
     await state.set_state(AdminStates.waiting_for_game_photo)
 
-async def handle_add_pirate_to_game(callback: types.CallbackQuery, state: FSMContext):
-    game_name = callback.data.split("_", 2)[2]
+async def handle_add_pirate_to_game(callback: types.CallbackQuery, game_name: str, state: FSMContext):
     await state.update_data(game_name=game_name)
     await callback.message.edit_text(
         f"📤 Добавление пиратской версии для «{game_name}». Отправьте файл:",
@@ -417,8 +2847,7 @@ async def handle_add_pirate_to_game(callback: types.CallbackQuery, state: FSMCon
     )
     await state.set_state(AdminStates.waiting_for_game_file)
 
-async def handle_add_original_to_game(callback: types.CallbackQuery, state: FSMContext):
-    game_name = callback.data.split("_", 2)[2]
+async def handle_add_original_to_game(callback: types.CallbackQuery, game_name: str, state: FSMContext):
     await state.update_data(game_name=game_name)
     await callback.message.edit_text(
         f"🔗 Добавление оригинальной версии для «{game_name}». Отправьте ссылку:",
@@ -445,13 +2874,12 @@ async def handle_game_description_input(message: types.Message, state: FSMContex
     game_description = data.get('game_description')
 
     # Сохраняем новую игру без файла и ссылки
-    games = load_json(DB_FILE)
-    games[game_name] = {
+    await games_catalog.set(game_name, {
         "description": game_description,
         "added_by": message.from_user.username,
         "added_date": datetime.now().isoformat()
-    }
-    save_json(games, DB_FILE)
+    })
+    event_log.emit("admin", message.from_user.id, a="add_game", g=game_name)
 
     await message.answer(
         f"✅ Игра «{game_name}» успешно добавлена! Теперь вы можете добавить фото, пиратскую или оригинальную версию.",
@@ -469,31 +2897,21 @@ async def handle_game_photo_input(message: types.Message, state: FSMContext):
     
     # Сохраняем фото (берем самое большое доступное качество)
     photo = message.photo[-1]
-    file_id = photo.file_id
-    file = await message.bot.get_file(file_id)
-    file_path = file.file_path
-    
-    # Создаем безопасное имя файла
-    safe_file_name = f"{game_name}_photo.jpg"
-    
-    # Полный путь для сохранения
-    full_file_path = os.path.join(DATA_DIR, safe_file_name)
+    old_photo = (games_catalog.get(game_name) or {}).get("photo")
     
     try:
-        # Скачиваем фото
-        await message.bot.download_file(file_path, full_file_path)
-        
-        # Проверяем, что фото скачалось
-        if not os.path.exists(full_file_path):
-            await message.answer("❌ Ошибка при сохранении фото.")
-            return
+        # Скачиваем фото в хранилище медиа (одинаковые файлы хранятся один раз)
+        photo_path = await media_store.download(message.bot, photo.file_id, ".jpg")
         
-        # Обновляем игру в базе
-        games = load_json(DB_FILE)
-        if game_name not in games:
-            games[game_name] = {}
-        games[game_name]["photo"] = safe_file_name
-        save_json(games, DB_FILE)
+        # Обновляем игру в базе; file_id и версии прежней обложки сбрасываются, первый просмотр
+        # после пережатия загрузит оптимизированную версию и запомнит ее file_id
+        await games_catalog.update(game_name, {"photo": photo_path, "photo_file_id": None,
+                                               "photo_optimized": None, "photo_thumb": None})
+        # Прежнее фото удаляется, если на него больше никто не ссылается
+        await media_store.collect()
+        await media_store.drop_legacy(old_photo)
+        cover_optimizer.schedule(game_name)
+        event_log.emit("admin", message.from_user.id, a="photo", g=game_name)
         
         await message.answer(
             f"✅ Фото для игры «{game_name}» успешно добавлено!",
@@ -501,7 +2919,7 @@ async def handle_game_photo_input(message: types.Message, state: FSMContext):
         )
         
     except Exception as e:
-        logger.error(f"Error saving photo: {e}")
+        logger.error("Error saving photo: %s", e)
         await message.answer(f"❌ Ошибка при сохранении фото: {e}")
     
     await state.clear()
@@ -515,33 +2933,21 @@ async def handle_game_file_input(message: types.Message, state: FSMContext):
     game_name = data.get('game_name')
     
     # Сохраняем файл
-    file_id = message.document.file_id
-    file = await message.bot.get_file(file_id)
-    file_path = file.file_path
-    
-    # Создаем безопасное имя файла
     original_file_name = message.document.file_name
-    safe_file_name = f"{game_name}_{original_file_name}".replace(" ", "_").replace("/", "_")
-    
-    # Полный путь для сохранения
-    full_file_path = os.path.join(DATA_DIR, safe_file_name)
+    old_file = (games_catalog.get(game_name) or {}).get("file")
     
     try:
-        # Скачиваем файл
-        await message.bot.download_file(file_path, full_file_path)
-        
-        # Проверяем, что файл скачался
-        if not os.path.exists(full_file_path):
-            await message.answer("❌ Ошибка при сохранении файла.")
-            return
+        # Скачиваем файл в хранилище медиа; имя для пользователя хранится отдельно
+        file_path = await media_store.download(message.bot, message.document.file_id, safe_extension(original_file_name))
         
         # Обновляем игру в базе
-        games = load_json(DB_FILE)
-        if game_name not in games:
-            games[game_name] = {}
-        games[game_name]["file"] = safe_file_name
-        games[game_name]["original_filename"] = original_file_name
-        save_json(games, DB_FILE)
+        await games_catalog.update(game_name, {
+            "file": file_path,
+            "original_filename": original_file_name
+        })
+        event_log.emit("admin", message.from_user.id, a="file", g=game_name)
+        await media_store.collect()
+        await media_store.drop_legacy(old_file)
         
         await message.answer(
             f"✅ Пиратская версия для игры «{game_name}» успешно добавлена!\n"
@@ -550,7 +2956,7 @@ async def handle_game_file_input(message: types.Message, state: FSMContext):
         )
         
     except Exception as e:
-        logger.error(f"Error saving file: {e}")
+        logger.error("Error saving file: %s", e)
         await message.answer(f"❌ Ошибка при сохранении файла: {e}")
     
     await state.clear()
@@ -561,11 +2967,8 @@ async def handle_original_url_input(message: types.Message, state: FSMContext):
     original_url = message.text
     
     # Обновляем игру в базе
-    games = load_json(DB_FILE)
-    if game_name not in games:
-        games[game_name] = {}
-    games[game_name]["original_url"] = original_url
-    save_json(games, DB_FILE)
+    await games_catalog.update(game_name, {"original_url": original_url})
+    event_log.emit("admin", message.from_user.id, a="original_url", g=game_name)
     
     await message.answer(
         f"✅ Оригинальная версия для игры «{game_name}» успешно добавлена!",
@@ -578,43 +2981,23 @@ async def handle_admin_delete_game(callback: types.CallbackQuery):
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
     
-    games = load_json(DB_FILE)
-    if not games:
-        await callback.message.edit_text("📭 Нет игр для удаления.", reply_markup=get_back_to_admin_inline_keyboard())
-        return
-    
-    keyboard = []
-    for game_name in games.keys():
-        keyboard.append([InlineKeyboardButton(text=game_name, callback_data=f"delete_{game_name}")])
-    
-    keyboard.append([InlineKeyboardButton(text="🔙 Назад в админ-меню", callback_data="back_to_admin")])
-    markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
-    
-    await callback.message.edit_text("🗑 <b>Выберите игру для удаления:</b>", reply_markup=markup, parse_mode=ParseMode.HTML)
+    text, markup = render_game_picker("delete")
+    await callback.message.edit_text(text, reply_markup=markup, parse_mode=ParseMode.HTML)
 
-async def handle_game_deletion(callback: types.CallbackQuery):
+async def handle_game_deletion(callback: types.CallbackQuery, game_name: str, state: FSMContext):
     if not is_admin(callback.from_user.username):
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
     
-    game_name = callback.data.split("_", 1)[1]
-    games = load_json(DB_FILE)
+    game = await games_catalog.delete(game_name)
     
-    if game_name in games:
-        # Удаляем файл, если он есть
-        if games[game_name].get("file"):
-            file_path = os.path.join(DATA_DIR, games[game_name]["file"])
-            if os.path.exists(file_path):
-                os.remove(file_path)
+    if game is not None:
+        event_log.emit("admin", callback.from_user.id, a="delete_game", g=game_name)
+        # Файлы из хранилища медиа удаляются, когда на них не осталось ссылок
+        await media_store.collect()
         
-        # Удаляем фото, если оно есть
-        if games[game_name].get("photo"):
-            photo_path = os.path.join(DATA_DIR, games[game_name]["photo"])
-            if os.path.exists(photo_path):
-                os.remove(photo_path)
-        
-        del games[game_name]
-        save_json(games, DB_FILE)
+        for field in MEDIA_FIELDS:
+            await media_store.drop_legacy(game.get(field))
         
         await callback.message.edit_text(
             f"✅ Игра «{game_name}» успешно удалена!",
@@ -623,34 +3006,153 @@ async def handle_game_deletion(callback: types.CallbackQuery):
     else:
         await callback.message.edit_text("❌ Игра не найдена.", reply_markup=get_back_to_admin_inline_keyboard())
 
-async def handle_admin_list_users(callback: types.CallbackQuery):
+# Фильтры списка пользователей: код → подпись кнопки
+USER_STATUSES = {"all": "Все", "active": "Активные", "blocked": "Заблокированные"}
+USERNAME_RE = re.compile(r"^[A-Za-z0-9_]{1,32}$")
+
+def walk_users(seq: List[int], cursor: int, forward: bool, limit: int, skip=None) -> tuple:
+    """Набрать до limit id от границы cursor вперед или назад, пропуская skip.
+    Возвращает id в порядке seq и границы страницы [lo, hi)"""
+    cursor = min(max(cursor, 0), len(seq))
+    ids = []
+    i = cursor if forward else cursor - 1
+    while 0 <= i < len(seq) and len(ids) < limit:
+        if skip is None or seq[i] not in skip:
+            ids.append(seq[i])
+        i += 1 if forward else -1
+    if forward:
+        return ids, cursor, i
+    ids.reverse()
+    return ids, i + 1, cursor
+
+async def render_users_page(sort: str = "new", status: str = "all", cursor: int = -1,
+                            forward: bool = False, query: str = "") -> tuple[str, InlineKeyboardMarkup]:
+    """Страница админ-списка: время не зависит от числа пользователей, кроме выборки по username"""
+    blocked = user_index.blocked
+    skip = None
+    if query:
+        seq = user_index.with_prefix(query)
+        if status == "active":
+            skip = blocked
+        elif status == "blocked":
+            seq = [user_id for user_id in seq if user_id in blocked]
+    elif status == "blocked":
+        # Заблокированных немного: упорядочиваем по дате регистрации на лету
+        joined = await run_io(storage.get_users, list(blocked))
+        seq = sorted(blocked, key=lambda user_id: (joined.get(user_id) or {}).get("joined") or "")
+    else:
+        seq = user_index.order
+        skip = blocked if status == "active" else None
+    
+    if cursor < 0:
+        cursor = len(seq)
+    ids, lo, hi = walk_users(seq, cursor, forward, USERS_PAGE_SIZE, skip)
+    users = await run_io(storage.get_users, ids)
+    if sort == "new":
+        ids.reverse()
+    
+    title = "сначала новые" if sort == "new" else "сначала старые"
+    if status != "all":
+        title += f" · {USER_STATUSES[status].lower()}"
+    if query:
+        title += f" · @{query}*"
+    text = (f"👥 <b>Пользователи</b> ({title})\n"
+            f"📊 Всего: {user_index.total} · 🚫 Заблокировано: {len(blocked)} · 🆕 Сегодня: {user_index.new_today}\n\n")
+    if not ids:
+        text += "📭 Пользователи не найдены."
+    for user_id in ids:
+        user_data = users.get(user_id, {})
+        name = escape(f"{user_data.get('first_name') or ''} {user_data.get('last_name') or ''}".strip() or str(user_id))
+        username = f" (@{escape(user_data['username'])})" if user_data.get("username") else ""
+        status_icon = "🚫" if user_id in blocked else "✅"
+        text += f"{status_icon} {name}{username} · {(user_data.get('joined') or '')[:10]}\n"
+    
+    def page(cursor: int, forward: bool, **changes) -> str:
+        fields = {"sort": sort, "status": status, "cursor": cursor, "forward": forward, "query": query or None}
+        fields.update(changes)
+        return UsersCallback(**fields).pack()
+    
+    # Кнопки назад/вперед по отображаемому порядку
+    older = (lo > 0, page(lo, False))
+    newer = (hi < len(seq), page(hi, True))
+    previous, following = (newer, older) if sort == "new" else (older, newer)
+    navigation = []
+    if previous[0]:
+        navigation.append(InlineKeyboardButton(text="◀️", callback_data=previous[1]))
+    if following[0]:
+        navigation.append(InlineKeyboardButton(text="▶️", callback_data=following[1]))
+    
+    first_page = {"new": (-1, False), "old": (0, True)}
+    keyboard = [navigation] if navigation else []
+    other_sort = "old" if sort == "new" else "new"
+    keyboard.append([InlineKeyboardButton(
+        text="🔃 Сначала старые" if other_sort == "old" else "🔃 Сначала новые",
+        callback_data=page(*first_page[other_sort], sort=other_sort)
+    )])
+    keyboard.append([
+        InlineKeyboardButton(text=("✔️ " if code == status else "") + label,
+                             callback_data=page(*first_page[sort], status=code))
+        for code, label in USER_STATUSES.items()
+    ])
+    if query:
+        keyboard.append([InlineKeyboardButton(text="✖️ Сбросить поиск", callback_data=page(*first_page[sort], query=None))])
+    else:
+        keyboard.append([InlineKeyboardButton(text="🔍 Поиск по username", callback_data=f"admin_users_search:{sort}:{status}")])
+    keyboard.append([InlineKeyboardButton(text="🔙 Назад в админ-меню", callback_data="back_to_admin")])
+    return text, InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+async def handle_admin_list_users(callback: types.CallbackQuery, state: FSMContext):
+    await state.clear()
     if not is_admin(callback.from_user.username):
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
     
-    users = load_json(USERS_FILE)
-    blocked_users = load_json(BLOCKED_USERS_FILE)
-    
-    if not users:
-        await callback.message.edit_text("📭 Нет зарегистрированных пользователей.", reply_markup=get_back_to_admin_inline_keyboard())
+    text, markup = await render_users_page()
+    await callback.message.edit_text(text, reply_markup=markup, parse_mode=ParseMode.HTML)
+
+async def handle_users_page(callback: types.CallbackQuery, callback_data: UsersCallback):
+    if not is_admin(callback.from_user.username):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    if callback_data.sort not in ("new", "old") or callback_data.status not in USER_STATUSES:
+        await callback.answer()
         return
     
-    user_list = "👥 <b>Список пользователей:</b>\n\n"
-    for i, (user_id, user_data) in enumerate(list(users.items())[:20], 1):
-        username = user_data.get('username', 'нет username')
-        first_name = user_data.get('first_name', '')
-        last_name = user_data.get('last_name', '')
-        status = "🚫" if user_id in blocked_users else "✅"
-        
-        user_list += f"{i}. {status} {first_name} {last_name} (@{username})\n"
-    
-    user_list += f"\n📊 Всего пользователей: {len(users)}"
-    user_list += f"\n🚫 Заблокировано: {len(blocked_users)}"
+    text, markup = await render_users_page(callback_data.sort, callback_data.status, callback_data.cursor,
+                                           callback_data.forward, callback_data.query or "")
+    try:
+        await callback.message.edit_text(text, reply_markup=markup, parse_mode=ParseMode.HTML)
+    except TelegramBadRequest:
+        # Повторное нажатие на текущий фильтр - страница не изменилась
+        await callback.answer()
+
+async def handle_users_search(callback: types.CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.username):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
     
-    if len(users) > 20:
-        user_list += f"\n\n... и еще {len(users) - 20} пользователей"
+    _, sort, status = callback.data.split(":")
+    await state.update_data(users_sort=sort, users_status=status)
+    await callback.message.edit_text(
+        "🔍 Введите начало username (без @):",
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[[InlineKeyboardButton(text="🔙 Отмена", callback_data="admin_list_users")]]
+        )
+    )
+    await state.set_state(AdminStates.waiting_for_users_query)
+
+async def handle_users_query_input(message: types.Message, state: FSMContext):
+    query = (message.text or "").strip().lstrip("@")
+    if not USERNAME_RE.match(query):
+        await message.answer("❌ Username состоит из латинских букв, цифр и _. Попробуйте еще раз:")
+        return
     
-    await callback.message.edit_text(user_list, reply_markup=get_back_to_admin_inline_keyboard(), parse_mode=ParseMode.HTML)
+    data = await state.get_data()
+    await state.clear()
+    sort = data.get("users_sort", "new")
+    text, markup = await render_users_page(sort, data.get("users_status", "all"),
+                                           -1 if sort == "new" else 0, sort != "new", query)
+    await message.answer(text, reply_markup=markup, parse_mode=ParseMode.HTML)
 
 async def handle_admin_block_user(callback: types.CallbackQuery, state: FSMContext):
     if not is_admin(callback.from_user.username):
@@ -683,7 +3185,8 @@ async def handle_username_to_block_input(message: types.Message, state: FSMConte
     user_id = get_user_id_by_username(username)
     
     if user_id:
-        block_user(user_id)
+        await block_user(user_id)
+        event_log.emit("admin", message.from_user.id, a="block", target=user_id)
         await message.answer(
             f"✅ Пользователь @{username} заблокирован!",
             reply_markup=get_back_to_admin_inline_keyboard()
@@ -701,7 +3204,8 @@ async def handle_username_to_unblock_input(message: types.Message, state: FSMCon
     user_id = get_user_id_by_username(username)
     
     if user_id:
-        unblock_user(user_id)
+        await unblock_user(user_id)
+        event_log.emit("admin", message.from_user.id, a="unblock", target=user_id)
         await message.answer(
             f"✅ Пользователь @{username} разблокирован!",
             reply_markup=get_back_to_admin_inline_keyboard()
@@ -714,6 +3218,535 @@ async def handle_username_to_unblock_input(message: types.Message, state: FSMCon
     
     await state.clear()
 
+# ========== ИМПОРТ И ЭКСПОРТ КАТАЛОГА ==========
+# Манифест: JSON в формате games.json ({название: {поля}}), CSV с колонкой name или zip с манифестом и обложками
+MANIFEST_FIELDS = ("description", "original_url", "photo")
+MANIFEST_NAMES = ("manifest.json", "manifest.csv", "games.json", "games.csv")
+MANIFEST_EXTENSIONS = (".json", ".csv", ".zip")
+COVER_FILE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+URL_RE = re.compile(r"^https?://\S+$")
+# Сколько ошибок и примеров показывать в отчете импорта
+IMPORT_REPORT_LIMIT = 15
+GAME_NAME_MAX_LENGTH = 128
+
+def iter_manifest_rows(f, kind: str):
+    """(номер строки, название, поля) по одной строке манифеста"""
+    if kind == ".json":
+        for number, (name, fields) in enumerate(iter_json_items(f), 1):
+            yield number, name, fields
+        return
+    reader = csv.DictReader(f)
+    if "name" not in (reader.fieldnames or ()):
+        raise ValueError("в CSV нет колонки name")
+    for number, row in enumerate(reader, 2):
+        fields = {field: row[field].strip() for field in MANIFEST_FIELDS if (row.get(field) or "").strip()}
+        yield number, (row.get("name") or "").strip(), fields
+
+def scan_manifest(path: str, kind: str, games: Dict[str, Any], apply: bool = False) -> tuple:
+    """Проверить манифест потоком и сравнить с каталогом; при apply сохранить обложки и собрать игры.
+    Возвращает (отчет, игры для записи, прежние обложки)"""
+    report = {"new": 0, "changed": 0, "unchanged": 0, "errors": 0,
+              "error_lines": [], "new_names": [], "changed_names": []}
+    updates: Dict[str, Any] = {}
+    replaced_photos: List[str] = []
+    seen: set[str] = set()
+    archive = zipfile.ZipFile(path) if kind == ".zip" else None
+    try:
+        if archive is not None:
+            member = next((name for name in MANIFEST_NAMES if name in archive.NameToInfo), None)
+            if member is None:
+                raise ValueError(f"в архиве нет файла {' или '.join(MANIFEST_NAMES)}")
+            source = io.TextIOWrapper(archive.open(member), encoding="utf-8-sig", newline="")
+            kind = os.path.splitext(member)[1]
+        else:
+            source = open(path, encoding="utf-8-sig", newline="")
+        
+        with source:
+            for number, name, fields in iter_manifest_rows(source, kind):
+                current = games.get(name)
+                error = validate_manifest_row(name, fields, current, archive, seen)
+                seen.add(name)
+                if error:
+                    report["errors"] += 1
+                    if len(report["error_lines"]) < IMPORT_REPORT_LIMIT:
+                        report["error_lines"].append(f"строка {number}: {error}")
+                    continue
+                
+                changes = {field: fields[field] for field in ("description", "original_url")
+                           if field in fields and (current or {}).get(field) != fields[field]}
+                cover = fields.get("photo")
+                if cover:
+                    with archive.open(cover) as f:
+                        digest = file_sha256_stream(f)
+                    old_photo = (current or {}).get("photo")
+                    if not old_photo or os.path.splitext(os.path.basename(old_photo))[0] != digest:
+                        changes["photo"] = cover
+                
+                if current is not None and not changes:
+                    report["unchanged"] += 1
+                    continue
+                status = "changed" if current is not None else "new"
+                report[status] += 1
+                if len(report[f"{status}_names"]) < IMPORT_REPORT_LIMIT:
+                    report[f"{status}_names"].append(name)
+                if not apply:
+                    continue
+                
+                game = dict(current or {"added_by": "import", "added_date": datetime.now().isoformat()})
+                game.update(changes)
+                if "photo" in changes:
+                    with archive.open(cover) as f:
+                        game["photo"] = media_store.store_file(f, safe_extension(cover, ".jpg"))
+                    # Новая обложка: прежний file_id и пережатые версии больше не подходят
+                    game.update(photo_file_id=None, photo_optimized=None, photo_thumb=None)
+                    if current and current.get("photo"):
+                        replaced_photos.append(current["photo"])
+                updates[name] = game
+    finally:
+        if archive is not None:
+            archive.close()
+    return report, updates, replaced_photos
+
+def validate_manifest_row(name: str, fields: Any, current: Dict[str, Any] | None,
+                          archive: zipfile.ZipFile | None, seen: set[str]) -> str | None:
+    if not isinstance(name, str) or not name.strip():
+        return "пустое название"
+    if len(name) > GAME_NAME_MAX_LENGTH:
+        return f"название длиннее {GAME_NAME_MAX_LENGTH} символов"
+    if name in seen:
+        return f"«{name}» встречается повторно"
+    if not isinstance(fields, dict):
+        return f"«{name}»: ожидается объект с полями"
+    for field in MANIFEST_FIELDS:
+        if field in fields and not isinstance(fields[field], str):
+            return f"«{name}»: поле {field} должно быть строкой"
+    if current is None and not fields.get("description"):
+        return f"«{name}»: для новой игры нужно описание"
+    if fields.get("original_url") and not URL_RE.match(fields["original_url"]):
+        return f"«{name}»: неверная ссылка {fields['original_url']}"
+    cover = fields.get("photo")
+    if cover:
+        if archive is None:
+            return f"«{name}»: обложка {cover} указана, но архив не загружен"
+        if cover not in archive.NameToInfo:
+            return f"«{name}»: в архиве нет файла {cover}"
+        if os.path.splitext(cover)[1].lower() not in COVER_FILE_EXTENSIONS:
+            return f"«{name}»: обложка должна быть {', '.join(COVER_FILE_EXTENSIONS)}"
+    return None
+
+def file_sha256_stream(f, chunk_size: int = MEDIA_CHUNK_SIZE) -> str:
+    digest = hashlib.sha256()
+    while chunk := f.read(chunk_size):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def format_import_report(report: Dict[str, Any], applied: bool) -> str:
+    title = "✅ <b>Импорт выполнен</b>" if applied else "📦 <b>Проверка импорта</b> (ничего не изменено)"
+    changed = "Изменено" if applied else "Изменится"
+    text = (f"{title}\n\n🆕 Новых игр: {report['new']}\n✏️ {changed}: {report['changed']}\n"
+            f"➖ Без изменений: {report['unchanged']}\n❌ Ошибок: {report['errors']}\n")
+    for key, caption in (("new_names", "Новые"), ("changed_names", "Изменены" if applied else "Изменятся")):
+        names = report[key]
+        if names:
+            text += f"\n<b>{caption}:</b> " + ", ".join(escape(name) for name in names)
+            more = report[key.split("_")[0]] - len(names)
+            if more > 0:
+                text += f" и еще {more}"
+            text += "\n"
+    if report["error_lines"]:
+        text += "\n<b>Ошибки:</b>\n" + "\n".join(escape(line) for line in report["error_lines"]) + "\n"
+    return text
+
+def write_catalog_export(games: List[tuple], csv_format: bool, with_covers: bool) -> str:
+    """Выгрузить каталог во временный файл по одной игре; возвращает путь"""
+    suffix = ".zip" if with_covers else ".csv" if csv_format else ".json"
+    fd, path = tempfile.mkstemp(prefix="gambot_export_", suffix=suffix)
+    os.close(fd)
+    covers: Dict[str, str] = {}
+    
+    def entries():
+        for name, game in games:
+            entry = {field: game[field] for field in ("description", "original_url", "added_by", "added_date")
+                     if game.get(field)}
+            photo = game.get("photo")
+            if with_covers and photo and os.path.exists(os.path.join(DATA_DIR, photo)):
+                entry["photo"] = covers.setdefault(photo, f"covers/{os.path.basename(photo)}")
+            yield name, entry
+    
+    def write_manifest(f):
+        if csv_format:
+            writer = csv.writer(f)
+            writer.writerow(("name",) + MANIFEST_FIELDS)
+            for name, entry in entries():
+                writer.writerow((name,) + tuple(entry.get(field, "") for field in MANIFEST_FIELDS))
+            return
+        f.write("{")
+        for i, (name, entry) in enumerate(entries()):
+            f.write(("," if i else "") + "\n  " + json.dumps(name, ensure_ascii=False) + ": "
+                    + json.dumps(entry, ensure_ascii=False))
+        f.write("\n}\n")
+    
+    try:
+        if with_covers:
+            with zipfile.ZipFile(path, "w") as archive:
+                manifest = "manifest.csv" if csv_format else "manifest.json"
+                with io.TextIOWrapper(archive.open(manifest, "w"), encoding="utf-8", newline="") as f:
+                    write_manifest(f)
+                # Картинки уже сжаты - кладем как есть, читая с диска порциями
+                for photo, member in covers.items():
+                    archive.write(os.path.join(DATA_DIR, photo), member)
+        else:
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                write_manifest(f)
+    except BaseException:
+        remove_file(path)
+        raise
+    return path
+
+def get_import_confirm_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Применить", callback_data="import_apply")],
+        [InlineKeyboardButton(text="❌ Отмена", callback_data="import_cancel")]
+    ])
+
+async def handle_admin_import(callback: types.CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.username):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    await callback.message.edit_text(
+        "📥 Отправьте файл каталога:\n\n"
+        "• JSON как games.json: {\"Название\": {\"description\": ..., \"original_url\": ..., \"photo\": ...}}\n"
+        "• CSV с колонками name, description, original_url, photo\n"
+        "• zip с manifest.json или manifest.csv и файлами обложек (photo - путь внутри архива)\n\n"
+        "Сначала будет показано, что изменится.",
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[[InlineKeyboardButton(text="🔙 Отмена", callback_data="import_cancel")]]
+        )
+    )
+    await state.set_state(AdminStates.waiting_for_import_file)
+
+async def handle_import_file_input(message: types.Message, state: FSMContext):
+    document = message.document
+    kind = os.path.splitext((document.file_name or "") if document else "")[1].lower()
+    if kind not in MANIFEST_EXTENSIONS:
+        await message.answer("❌ Отправьте файл .json, .csv или .zip.")
+        return
+    
+    data = await state.get_data()
+    await run_io(remove_file, data.get("import_path") or "")
+    fd, path = await run_io(tempfile.mkstemp, prefix="gambot_import_", suffix=kind)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            await media_store.fetch(message.bot, document.file_id, f)
+        report, _, _ = await run_io(scan_manifest, path, kind, dict(games_catalog.all()))
+    except (ValueError, zipfile.BadZipFile, UnicodeDecodeError, csv.Error) as e:
+        await run_io(remove_file, path)
+        await state.clear()
+        await message.answer(f"❌ Не удалось прочитать файл: {e}", reply_markup=get_back_to_admin_inline_keyboard())
+        return
+    except Exception:
+        await run_io(remove_file, path)
+        await state.clear()
+        raise
+    
+    text = format_import_report(report, applied=False)
+    if report["errors"]:
+        await run_io(remove_file, path)
+        await state.clear()
+        await message.answer(text + "\nИсправьте ошибки и отправьте файл заново.",
+                             reply_markup=get_back_to_admin_inline_keyboard(), parse_mode=ParseMode.HTML)
+        return
+    
+    await state.set_state(None)
+    await state.update_data(import_path=path, import_kind=kind)
+    await message.answer(text, reply_markup=get_import_confirm_keyboard(), parse_mode=ParseMode.HTML)
+
+async def handle_import_apply(callback: types.CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.username):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    data = await state.get_data()
+    path, kind = data.get("import_path"), data.get("import_kind")
+    await state.clear()
+    if not path or not await run_io(os.path.exists, path):
+        await callback.message.edit_text("❌ Импорт устарел, отправьте файл заново.",
+                                         reply_markup=get_back_to_admin_inline_keyboard())
+        return
+    
+    await callback.message.edit_text("⏳ Импортирую...")
+    try:
+        # Каталог мог измениться после проверки - сверяем заново и тут же применяем
+        report, updates, replaced_photos = await run_io(scan_manifest, path, kind, dict(games_catalog.all()), True)
+        if report["errors"]:
+            await callback.message.edit_text(format_import_report(report, applied=False),
+                                             reply_markup=get_back_to_admin_inline_keyboard(), parse_mode=ParseMode.HTML)
+            return
+        try:
+            await games_catalog.set_many(updates)
+        except Exception:
+            # Обложки уже лежат в хранилище медиа, но в каталог не попали
+            for game in updates.values():
+                if game.get("photo"):
+                    media_store.discard(game["photo"])
+            await media_store.collect()
+            raise
+    finally:
+        await run_io(remove_file, path)
+    
+    await media_store.collect()
+    for photo in replaced_photos:
+        await media_store.drop_legacy(photo)
+    cover_optimizer.schedule_backfill()
+    event_log.emit("admin", callback.from_user.id, a="import", count=len(updates))
+    await callback.message.edit_text(format_import_report(report, applied=True),
+                                     reply_markup=get_back_to_admin_inline_keyboard(), parse_mode=ParseMode.HTML)
+
+async def handle_import_cancel(callback: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    await run_io(remove_file, data.get("import_path") or "")
+    await state.clear()
+    await callback.message.edit_text("❌ Импорт отменен.", reply_markup=get_back_to_admin_inline_keyboard())
+
+async def send_catalog_export(message: types.Message, csv_format: bool = False, with_covers: bool = False):
+    games = list(games_catalog.all().items())
+    if not games:
+        await message.answer("📭 Нет игр в базе.", reply_markup=get_back_to_admin_inline_keyboard())
+        return
+    
+    path = await run_io(write_catalog_export, games, csv_format, with_covers)
+    try:
+        filename = f"catalog_{datetime.now():%Y%m%d_%H%M}{os.path.splitext(path)[1]}"
+        await message.answer_document(types.FSInputFile(path, filename=filename),
+                                      caption=f"💾 Каталог: {len(games)} игр")
+    finally:
+        await run_io(remove_file, path)
+
+async def handle_admin_export(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.username):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    await callback.answer("⏳ Готовлю выгрузку...")
+    await send_catalog_export(callback.message)
+
+async def export_command(message: types.Message, command: CommandObject):
+    """Выгрузка каталога: /export [csv] [covers] - CSV вместо JSON, zip с обложками (только для админов)"""
+    if not is_admin(message.from_user.username):
+        return
+    
+    options = set((command.args or "").lower().split())
+    await send_catalog_export(message, csv_format="csv" in options, with_covers="covers" in options)
+
+# ========== РАССЫЛКА ==========
+def format_duration(seconds: float) -> str:
+    if seconds < 60:
+        return f"{seconds:.0f} сек"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} мин"
+    return f"{seconds / 3600:.1f} ч"
+
+def get_broadcast_cancel_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[[InlineKeyboardButton(text="⏹ Остановить", callback_data="broadcast_cancel")]]
+    )
+
+class Broadcaster:
+    """Рассылка копии сообщения всем активным пользователям с сохранением прогресса"""
+
+    def __init__(self, file: str = BROADCAST_FILE, workers: int = BROADCAST_WORKERS,
+                 rate: float = BROADCAST_RATE, batch_size: int = BROADCAST_BATCH):
+        self.file = file
+        self.workers = workers
+        self.rate = rate
+        self.batch_size = batch_size
+        self.progress: Dict[str, Any] | None = None
+        self._task: asyncio.Task | None = None
+        self._started = 0.0
+        self._done_at_start = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def done(self) -> int:
+        return self.progress["sent"] + self.progress["failed"] + self.progress["inactive"]
+
+    def start(self, bot: Bot, progress: Dict[str, Any]):
+        self.progress = progress
+        self._task = asyncio.create_task(self._run(bot))
+
+    async def resume(self, bot: Bot):
+        """Продолжить рассылку, прерванную перезапуском"""
+        if not await run_io(os.path.exists, self.file):
+            return
+        progress = await run_io(load_json, self.file)
+        if progress:
+            logger.info("Resuming broadcast: %s sent, cursor %s", progress['sent'], progress['cursor'])
+            self.start(bot, progress)
+
+    async def stop(self):
+        """Остановить без удаления прогресса (при выключении бота)"""
+        if self.running:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def cancel(self) -> bool:
+        """Остановить рассылку и забыть прогресс; прерванную ошибкой тоже можно отменить"""
+        if self.running:
+            await self.stop()
+        elif not await run_io(os.path.exists, self.file):
+            return False
+        await run_io(remove_file, self.file)
+        return True
+
+    def status_text(self, title: str) -> str:
+        progress = self.progress
+        elapsed = time.monotonic() - self._started
+        speed = (self.done - self._done_at_start) / elapsed if elapsed > 0 else 0.0
+        text = (
+            f"{title}\n\n"
+            f"✅ Отправлено: {progress['sent']}\n"
+            f"🚫 Заблокировали бота: {progress['inactive']}\n"
+            f"❌ Ошибки: {progress['failed']}\n"
+            f"Обработано: {self.done} из ~{progress['total']}\n"
+            f"Скорость: {speed:.1f} сообщ./с"
+        )
+        if self.running and speed > 0:
+            text += f"\nОсталось: ~{format_duration(max(progress['total'] - self.done, 0) / speed)}"
+        return text
+
+    async def show_status(self, bot: Bot, title: str, markup: InlineKeyboardMarkup | None = None):
+        try:
+            await bot.edit_message_text(
+                self.status_text(title), chat_id=self.progress["status_chat_id"],
+                message_id=self.progress["status_message_id"], reply_markup=markup
+            )
+        except TelegramAPIError as e:
+            logger.warning("Error updating broadcast status: %s", e)
+
+    async def _report(self, bot: Bot):
+        while True:
+            await asyncio.sleep(BROADCAST_STATUS_INTERVAL)
+            await self.show_status(bot, "📢 Идет рассылка", get_broadcast_cancel_keyboard())
+
+    async def _worker(self, bot: Bot, queue: asyncio.Queue, bucket: TokenBucket):
+        progress = self.progress
+        while True:
+            user_id = await queue.get()
+            try:
+                async with bucket.lock:
+                    await bucket.wait()
+                    bucket.take(time.monotonic())
+                await bot.copy_message(user_id, progress["from_chat_id"], progress["message_id"])
+                progress["sent"] += 1
+            except TelegramForbiddenError:
+                progress["inactive"] += 1
+                try:
+                    await run_io(storage.mark_inactive, user_id)
+                except Exception as e:
+                    logger.error("Error marking user %s inactive: %s", user_id, e)
+            except TelegramAPIError as e:
+                progress["failed"] += 1
+                logger.warning("Broadcast to %s failed: %s", user_id, e)
+            except Exception as e:
+                # Воркер не должен умирать: иначе queue.join() не дождется оставшихся адресатов
+                progress["failed"] += 1
+                logger.error("Broadcast to %s failed: %s", user_id, e)
+            finally:
+                queue.task_done()
+
+    async def _run(self, bot: Bot):
+        progress = self.progress
+        self._started = time.monotonic()
+        self._done_at_start = self.done
+        # Небольшой запас на всплеск: таймеры цикла событий не точнее миллисекунды
+        bucket = TokenBucket(self.rate, max(1.0, self.rate / 10))
+        queue = asyncio.Queue()
+        tasks = [asyncio.create_task(self._worker(bot, queue, bucket)) for _ in range(self.workers)]
+        tasks.append(asyncio.create_task(self._report(bot)))
+        try:
+            await run_io(save_json, dict(progress), self.file)
+            while True:
+                user_ids, cursor = await run_io(storage.user_ids_page, progress["cursor"], self.batch_size)
+                if cursor == progress["cursor"]:
+                    break
+                for user_id in user_ids:
+                    if not is_user_blocked(user_id):
+                        queue.put_nowait(user_id)
+                await queue.join()
+                # Порция отправлена целиком: после перезапуска продолжим со следующей
+                progress["cursor"] = cursor
+                await run_io(save_json, dict(progress), self.file)
+        except Exception as e:
+            # Прогресс остается на диске: после перезапуска рассылка продолжится с последней порции
+            logger.exception("Broadcast failed at cursor %s", progress["cursor"])
+            await self.show_status(bot, f"❌ Рассылка прервана ошибкой: {escape(str(e))}\n"
+                                        f"Продолжится после перезапуска бота, если не отменить",
+                                   get_broadcast_cancel_keyboard())
+            return
+        finally:
+            for task in tasks:
+                task.cancel()
+        await run_io(remove_file, self.file)
+        logger.info("Broadcast finished: %s sent, %s inactive, %s failed", progress['sent'], progress['inactive'], progress['failed'])
+        await self.show_status(bot, "✅ Рассылка завершена")
+
+broadcaster = Broadcaster()
+
+async def handle_admin_broadcast(callback: types.CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.username):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    if broadcaster.running:
+        await callback.answer("⏳ Рассылка уже идет", show_alert=True)
+        return
+    
+    await callback.message.edit_text(
+        "📢 Отправьте сообщение для рассылки всем пользователям (текст, фото или файл):",
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[[InlineKeyboardButton(text="🔙 Отмена", callback_data="back_to_admin")]]
+        )
+    )
+    await state.set_state(AdminStates.waiting_for_broadcast_message)
+
+async def handle_broadcast_message_input(message: types.Message, state: FSMContext):
+    await state.clear()
+    if broadcaster.running:
+        await message.answer("⏳ Рассылка уже идет", reply_markup=get_back_to_admin_inline_keyboard())
+        return
+    
+    total = user_index.total
+    status = await message.answer("📢 Рассылка запускается...", reply_markup=get_broadcast_cancel_keyboard())
+    event_log.emit("admin", message.from_user.id, a="broadcast")
+    broadcaster.start(message.bot, {
+        "from_chat_id": message.chat.id,
+        "message_id": message.message_id,
+        "status_chat_id": status.chat.id,
+        "status_message_id": status.message_id,
+        "cursor": 0,
+        "total": total,
+        "sent": 0,
+        "failed": 0,
+        "inactive": 0,
+        "started": datetime.now().isoformat()
+    })
+
+async def handle_broadcast_cancel(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.username):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    if await broadcaster.cancel():
+        await broadcaster.show_status(callback.bot, "⏹ Рассылка остановлена", get_back_to_admin_inline_keyboard())
+    else:
+        await callback.answer("Рассылка не запущена")
+
 # ========== ОБРАБОТКА ВСПОМОГАТЕЛЬНЫХ CALLBACK'ОВ ==========
 async def handle_back_to_main(callback: types.CallbackQuery):
     await callback.message.edit_text("Возвращаемся в главное меню...")
@@ -728,72 +3761,296 @@ async def handle_back_to_admin(callback: types.CallbackQuery, state: FSMContext)
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
     
-    keyboard = [
-        [InlineKeyboardButton(text="🎮 Добавить новую игру", callback_data="admin_add_game")],
-        [InlineKeyboardButton(text="🖼 Добавить фото к игре", callback_data="admin_add_photo_existing")],
-        [InlineKeyboardButton(text="📤 Добавить пиратку к игре", callback_data="admin_add_pirate_existing")],
-        [InlineKeyboardButton(text="🔗 Добавить оригинал к игре", callback_data="admin_add_original_existing")],
-        [InlineKeyboardButton(text="🗑 Удалить игру", callback_data="admin_delete_game")],
-        [InlineKeyboardButton(text="👥 Список пользователей", callback_data="admin_list_users")],
-        [InlineKeyboardButton(text="🚫 Заблокировать пользователя", callback_data="admin_block_user")],
-        [InlineKeyboardButton(text="✅ Разблокировать пользователя", callback_data="admin_unblock_user")],
-        [InlineKeyboardButton(text="🔙 Назад в меню", callback_data="back_to_main")]
-    ]
-    markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
-    
-    await callback.message.edit_text("⚙️ <b>Админ-меню</b>\n\nВыберите действие:", reply_markup=markup, parse_mode=ParseMode.HTML)
+    await callback.message.edit_text(ADMIN_MENU_TEXT, reply_markup=ADMIN_MENU_KEYBOARD, parse_mode=ParseMode.HTML)
 
 async def handle_back_to_games_list(callback: types.CallbackQuery):
+    event_log.emit("list", callback.from_user.id, p=0)
     await show_games_list(callback.message)
 
-async def check_files_command(message: types.Message):
-    """Команда для проверки файлов (только для админов)"""
+# ========== МАРШРУТИЗАЦИЯ ДЕЙСТВИЙ С ИГРАМИ ==========
+# Действие из callback_data → обработчик (callback, game_name, state); поиск по словарю вместо цепочки фильтров
+GAME_ACTIONS = {
+    "view": handle_game_selection,
+    "pirate": handle_pirate_version,
+    "original": handle_original_version,
+    "add_photo": handle_add_photo_to_game,
+    "add_pirate": handle_add_pirate_to_game,
+    "add_original": handle_add_original_to_game,
+    "delete": handle_game_deletion,
+}
+ADMIN_GAME_ACTIONS = {"add_photo", "add_pirate", "add_original", "delete"}
+
+async def dispatch_game_action(callback: types.CallbackQuery, state: FSMContext, action: str, game_name: str | None):
+    handler = GAME_ACTIONS.get(action)
+    if handler is None:
+        await callback.answer()
+        return
+    if action in ADMIN_GAME_ACTIONS and not is_admin(callback.from_user.username):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    if game_name is None or games_catalog.get(game_name) is None:
+        await callback.answer("❌ Игра не найдена.", show_alert=True)
+        return
+    await handler(callback, game_name, state)
+
+async def handle_game_callback(callback: types.CallbackQuery, callback_data: GameCallback, state: FSMContext):
+    await dispatch_game_action(callback, state, callback_data.action, games_catalog.name_by_id(callback_data.game_id))
+
+async def handle_legacy_game_callback(callback: types.CallbackQuery, state: FSMContext, action: str, game_name: str):
+    await dispatch_game_action(callback, state, action, game_name)
+
+async def check_files_command(message: types.Message, command: CommandObject):
+    """Отчет о файлах из фоновой проверки; /checkfiles rescan - проверить заново (только для админов)"""
     if not is_admin(message.from_user.username):
         return
     
-    games = load_json(DB_FILE)
-    if not games:
-        await message.answer("📭 Нет игр в базе.")
+    rescan = (command.args or "").strip().lower() == "rescan"
+    if media_scanner.report is None or rescan:
+        status = await message.answer("⏳ Проверяю файлы...")
+        await media_scanner.scan(verify=rescan or None)
+        text, markup = media_scanner.render()
+        await status.edit_text(text, reply_markup=markup)
         return
     
-    files_info = "📁 Проверка файлов:\n\n"
+    text, markup = media_scanner.render()
+    await message.answer(text, reply_markup=markup)
+
+async def handle_files_page(callback: types.CallbackQuery, callback_data: FilesCallback):
+    if not is_admin(callback.from_user.username):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    if media_scanner.report is None:
+        await callback.answer("Отчет еще не готов")
+        return
     
-    for game_name, game_data in games.items():
-        if game_data.get("file"):
-            file_path = os.path.join(DATA_DIR, game_data["file"])
-            if os.path.exists(file_path):
-                file_size = os.path.getsize(file_path)
-                files_info += f"✅ {game_name}: ФАЙЛ - {game_data['file']} ({file_size} байт)\n"
-            else:
-                files_info += f"❌ {game_name}: ФАЙЛ НЕ НАЙДЕН - {game_data['file']}\n"
-        if game_data.get("photo"):
-            photo_path = os.path.join(DATA_DIR, game_data["photo"])
-            if os.path.exists(photo_path):
-                photo_size = os.path.getsize(photo_path)
-                files_info += f"🖼 {game_name}: ФОТО - {game_data['photo']} ({photo_size} байт)\n"
-            else:
-                files_info += f"❌ {game_name}: ФОТО НЕ НАЙДЕНО - {game_data['photo']}\n"
-        if not game_data.get("file") and not game_data.get("photo"):
-            files_info += f"📝 {game_name}: нет файлов и фото\n"
+    text, markup = media_scanner.render(callback_data.page)
+    await callback.message.edit_text(text, reply_markup=markup)
+
+async def handle_files_rescan(callback: types.CallbackQuery):
+    if not is_admin(callback.from_user.username):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
     
-    await message.answer(files_info)
+    await callback.message.edit_text("⏳ Проверяю файлы...")
+    await media_scanner.scan(verify=True)
+    text, markup = media_scanner.render()
+    await callback.message.edit_text(text, reply_markup=markup)
 
-# ========== ЗАПУСК БОТА ==========
-async def main():
-    # Инициализация файлов
-    init_files()
+async def stats_command(message: types.Message):
+    """Сводка метрик: самые нагруженные обработчики, ввод-вывод и Bot API (только для админов)"""
+    if not is_admin(message.from_user.username):
+        return
     
-    # Проверка токена
-    if not BOT_TOKEN or BOT_TOKEN == '8446569923:AAGon_20FfR_w_8-WYtABwQI95QUe6rj34E':
-        logger.error("BOT_TOKEN not set properly!")
+    titles = {"handler": "⚙️ Обработчики", "io": "💾 Ввод-вывод", "api": "📡 Bot API"}
+    text = "📊 <b>Статистика</b> (вызовы / ошибки / среднее / p95)\n"
+    for family, title in titles.items():
+        histograms = sorted(metrics.families[family].items(), key=lambda item: item[1].total, reverse=True)
+        text += f"\n<b>{title}</b>\n"
+        if not histograms:
+            text += "нет данных\n"
+        for label, histogram in histograms[:10]:
+            text += (f"{escape(label)}: {histogram.count} / {histogram.errors} / "
+                     f"{histogram.total / histogram.count * 1000:.1f} мс / ≤{histogram.quantile(0.95) * 1000:.0f} мс\n")
+    limiter = outbound_limiter.stats()
+    text += (f"\n<b>📤 Очередь отправки</b>\nВ очереди: {limiter['queued']}, "
+             f"ожидание: {limiter['avg_wait'] * 1000:.0f} мс в среднем, {limiter['max_wait'] * 1000:.0f} мс максимум, "
+             f"повторов после 429: {limiter['retries']}")
+    popular = activity_stats.popular(5)
+    text += "\n\n<b>🔥 Популярные игры</b> (просмотры)\n"
+    text += "\n".join(f"{escape(name)}: {views}" for name, views in popular) if popular else "нет данных"
+    text += (f"\n👤 Активных сегодня: {activity_stats.active_today}\n"
+             f"📝 Событий записано: {event_log.written}, потеряно: {event_log.dropped}")
+    await message.answer(text, parse_mode=ParseMode.HTML)
+
+async def optimize_covers_command(message: types.Message, command: CommandObject):
+    """Пережать обложки, загруженные до оптимизации; /optimizecovers all - все заново (только для админов)"""
+    if not is_admin(message.from_user.username):
+        return
+    if not cover_optimizer.available:
+        await message.answer("❌ Для оптимизации обложек нужен Pillow (pip install Pillow).")
+        return
+    
+    force = (command.args or "").strip().lower() == "all"
+    await message.answer("🖼 Оптимизирую обложки...")
+    start = time.perf_counter()
+    done, total = await cover_optimizer.backfill(force=force)
+    await message.answer(f"✅ Оптимизировано обложек: {done} из {total} за {format_duration(time.perf_counter() - start)}")
+
+# ========== ПРОФИЛИРОВАНИЕ ==========
+class ProfileMiddleware(BaseMiddleware):
+    """Считает обновления, пока идет профилирование; подключается только на это время"""
+
+    def __init__(self, profiler: "UpdateProfiler"):
+        self.profiler = profiler
+
+    async def __call__(self, handler, event: types.Update, data: Dict[str, Any]) -> Any:
+        try:
+            return await handler(event, data)
+        finally:
+            self.profiler.update_done()
+
+class UpdateProfiler:
+    """cProfile потока цикла событий (диспетчер, обработчики, фоновые задачи) на заданное время
+    или число обновлений. Когда выключен, ничего не стоит: ни профилировщика, ни промежуточного слоя"""
+
+    def __init__(self):
+        self.dispatcher: Dispatcher | None = None
+        self._profile: cProfile.Profile | None = None
+        self._middleware = ProfileMiddleware(self)
+        self._done: asyncio.Event | None = None
+        self._updates_left: int | None = None
+        self.updates = 0
+        self.task: asyncio.Task | None = None
+
+    @property
+    def active(self) -> bool:
+        """Профилирование идет или уже запланировано"""
+        return self.task is not None and not self.task.done()
+
+    def attach(self, dispatcher: Dispatcher):
+        self.dispatcher = dispatcher
+
+    def start(self, job) -> bool:
+        """Занять профилировщик до первого await и запустить job (корутину с run); False, если уже занят"""
+        if self.active:
+            job.close()
+            return False
+        self._done = asyncio.Event()
+        self.task = asyncio.create_task(job)
+        return True
+
+    async def run(self, seconds: float, updates: int | None = None) -> tuple:
+        """Профилировать seconds секунд или до updates обновлений; возвращает (статистику, секунды).
+        Вызывается из задачи, запущенной start()"""
+        self._updates_left = updates
+        self.updates = 0
+        self.dispatcher.update.outer_middleware(self._middleware)
+        self._profile = cProfile.Profile()
+        start = time.perf_counter()
+        self._profile.enable()
+        try:
+            try:
+                await asyncio.wait_for(self._done.wait(), seconds)
+            except asyncio.TimeoutError:
+                pass
+        finally:
+            self._profile.disable()
+            profile, self._profile = self._profile, None
+            self.dispatcher.update.outer_middleware.unregister(self._middleware)
+        return profile, time.perf_counter() - start
+
+    def update_done(self):
+        self.updates += 1
+        if self._updates_left is not None and self.updates >= self._updates_left:
+            self._done.set()
+
+    def stop(self):
+        if self._done is not None:
+            self._done.set()
+
+    @staticmethod
+    def save(profile: cProfile.Profile, top: int) -> tuple:
+        """Записать pstats в PROFILES_DIR, удалить старые; возвращает (путь, строки топа по cumulative)"""
+        os.makedirs(PROFILES_DIR, exist_ok=True)
+        path = os.path.join(PROFILES_DIR, f"profile_{datetime.now():%Y%m%d_%H%M%S_%f}.pstats")
+        profile.dump_stats(path)
+        old = sorted(name for name in os.listdir(PROFILES_DIR) if name.endswith(".pstats"))[:-PROFILE_KEEP or None]
+        for name in old:
+            remove_file(os.path.join(PROFILES_DIR, name))
+        
+        stats = pstats.Stats(profile)
+        # Сам цикл событий охватывает все и только занимает верх списка
+        rows = heapq.nlargest(top, (item for item in stats.stats.items() if not UpdateProfiler.is_loop_frame(item[0])),
+                              key=lambda item: item[1][3])
+        lines = []
+        for (file, line, function), (_, calls, total, cumulative, _) in rows:
+            location = function if file == "~" else f"{os.path.basename(file)}:{line} {function}"
+            lines.append(f"{cumulative:8.3f} {total:8.3f} {calls:>8} {location[:60]}")
+        return path, lines
+
+    @staticmethod
+    def is_loop_frame(key: tuple) -> bool:
+        file, _, function = key
+        return file.startswith(ASYNCIO_DIR) or function == "<method 'run' of '_contextvars.Context' objects>"
+
+ASYNCIO_DIR = os.path.dirname(asyncio.__file__) + os.sep
+update_profiler = UpdateProfiler()
+
+async def profile_command(message: types.Message, command: CommandObject):
+    """Профилирование: /profile [секунды] | /profile <N>u - до N обновлений | /profile stop (только для админов)"""
+    if not is_admin(message.from_user.username):
+        return
+    
+    args = (command.args or "").strip().lower()
+    if args == "stop":
+        if update_profiler.active:
+            update_profiler.stop()
+        else:
+            await message.answer("ℹ️ Профилирование не запущено.")
+        return
+    if update_profiler.active:
+        await message.answer("⏳ Профилирование уже идет. Остановить: /profile stop")
+        return
+    
+    updates = None
+    try:
+        if args.endswith("u"):
+            updates = int(args[:-1])
+            seconds = PROFILE_MAX_SECONDS
+        else:
+            seconds = float(args) if args else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        await message.answer("❌ Формат: /profile [секунды] или /profile 200u (200 обновлений)")
+        return
+    if (updates is not None and updates <= 0) or not 0 < seconds <= PROFILE_MAX_SECONDS:
+        await message.answer(f"❌ Окно от 1 до {PROFILE_MAX_SECONDS:.0f} секунд, число обновлений больше 0.")
+        return
+    
+    # Ответ придет отдельно: сам обработчик не должен держать обновление все окно профилирования
+    if not update_profiler.start(send_profile_report(message, seconds, updates)):
+        await message.answer("⏳ Профилирование уже идет. Остановить: /profile stop")
+        return
+    target = f"{updates} обновлений (не дольше {format_duration(seconds)})" if updates else format_duration(seconds)
+    await message.answer(f"🔬 Профилирую {target}. Остановить раньше: /profile stop")
+
+async def send_profile_report(message: types.Message, seconds: float, updates: int | None):
+    try:
+        profile, elapsed = await update_profiler.run(seconds, updates)
+        path, lines = await run_io(UpdateProfiler.save, profile, PROFILE_TOP)
+    except Exception as e:
+        logger.exception("Profiling failed")
+        await message.answer(f"❌ Ошибка профилирования: {e}")
         return
     
-    bot = Bot(token=BOT_TOKEN, parse_mode=ParseMode.HTML)
-    dp = Dispatcher()
+    header = f"{'cum, s':>8} {'own, s':>8} {'calls':>8} function"
+    text = (f"🔬 <b>Профиль</b>: {elapsed:.1f} сек, обновлений: {update_profiler.updates}\n"
+            f"Файл: <code>{escape(os.path.relpath(path, DATA_DIR))}</code>\n\n"
+            f"<pre>{escape(header)}\n" + "\n".join(escape(line) for line in lines) + "</pre>")
+    await message.answer(text, parse_mode=ParseMode.HTML)
+
+# ========== ЗАПУСК БОТА ==========
+def create_dispatcher() -> Dispatcher:
+    dp = Dispatcher(storage=create_fsm_storage())
+    dp.update.outer_middleware(LogContextMiddleware())
+    update_profiler.attach(dp)
+
+    # Блокировка проверяется до любых фильтров и FSM
+    dp.message.outer_middleware(BlockedUserMiddleware())
+    dp.callback_query.outer_middleware(BlockedUserMiddleware())
+    dp.inline_query.outer_middleware(BlockedUserMiddleware())
+    # Метрики снимаются только с событий, для которых нашелся обработчик
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
+    dp.inline_query.middleware(HandlerMetricsMiddleware())
 
     # Регистрация обработчиков сообщений
     dp.message.register(start_command, Command("start"))
     dp.message.register(check_files_command, Command("checkfiles"))
+    dp.message.register(stats_command, Command("stats"))
+    dp.message.register(optimize_covers_command, Command("optimizecovers"))
+    dp.message.register(export_command, Command("export"))
+    dp.message.register(profile_command, Command("profile"))
+    dp.message.register(search_command, Command("search"))
     dp.message.register(handle_main_menu_buttons, F.text.in_(["🎮 Список игр", "💖 Донат", "⚙️ Админ-меню"]))
     
     # Регистрация обработчиков состояний админа
@@ -804,32 +4061,162 @@ async def main():
     dp.message.register(handle_original_url_input, AdminStates.waiting_for_original_url)
     dp.message.register(handle_username_to_block_input, AdminStates.waiting_for_username_to_block)
     dp.message.register(handle_username_to_unblock_input, AdminStates.waiting_for_username_to_unblock)
+    dp.message.register(handle_broadcast_message_input, AdminStates.waiting_for_broadcast_message)
+    dp.message.register(handle_users_query_input, AdminStates.waiting_for_users_query)
+    dp.message.register(handle_import_file_input, AdminStates.waiting_for_import_file)
     
     # Регистрация обработчиков callback'
+    # Действия с играми идут первыми: самые частые нажатия разбираются одним фильтром
+    dp.callback_query.register(handle_game_callback, GameCallback.filter())
+    dp.callback_query.register(handle_game_picker_page, PageCallback.filter())
     dp.callback_query.register(handle_back_to_main, F.data == "back_to_main")
     dp.callback_query.register(handle_back_to_admin, F.data == "back_to_admin")
     dp.callback_query.register(handle_back_to_games_list, F.data == "back_to_games_list")
-    dp.callback_query.register(handle_game_selection, F.data.startswith("game_"))
-    dp.callback_query.register(handle_pirate_version, F.data.startswith("pirate_"))
-    dp.callback_query.register(handle_original_version, F.data.startswith("original_"))
     dp.callback_query.register(handle_admin_add_game, F.data == "admin_add_game")
     dp.callback_query.register(handle_admin_add_photo_existing, F.data == "admin_add_photo_existing")
     dp.callback_query.register(handle_admin_add_pirate_existing, F.data == "admin_add_pirate_existing")
     dp.callback_query.register(handle_admin_add_original_existing, F.data == "admin_add_original_existing")
-    dp.callback_query.register(handle_add_photo_to_game, F.data.startswith("add_photo_"))
-    dp.callback_query.register(handle_add_pirate_to_game, F.data.startswith("add_pirate_"))
-    dp.callback_query.register(handle_add_original_to_game, F.data.startswith("add_original_"))
     dp.callback_query.register(handle_admin_delete_game, F.data == "admin_delete_game")
-    dp.callback_query.register(handle_game_deletion, F.data.startswith("delete_"))
     dp.callback_query.register(handle_admin_list_users, F.data == "admin_list_users")
+    dp.callback_query.register(handle_users_page, UsersCallback.filter())
+    dp.callback_query.register(handle_files_page, FilesCallback.filter())
+    dp.callback_query.register(handle_files_rescan, F.data == "checkfiles_rescan")
+    dp.callback_query.register(handle_users_search, F.data.startswith("admin_users_search:"))
     dp.callback_query.register(handle_admin_block_user, F.data == "admin_block_user")
     dp.callback_query.register(handle_admin_unblock_user, F.data == "admin_unblock_user")
+    dp.callback_query.register(handle_admin_broadcast, F.data == "admin_broadcast")
+    dp.callback_query.register(handle_broadcast_cancel, F.data == "broadcast_cancel")
+    dp.callback_query.register(handle_admin_import, F.data == "admin_import")
+    dp.callback_query.register(handle_import_apply, F.data == "import_apply")
+    dp.callback_query.register(handle_import_cancel, F.data == "import_cancel")
+    dp.callback_query.register(handle_admin_export, F.data == "admin_export")
+    # Кнопки со старым форматом callback_data из ранее отправленных сообщений
+    dp.callback_query.register(handle_legacy_game_callback, legacy_game_callback)
+
+    # Inline-режим (@бот запрос) - должен быть включен через BotFather
+    dp.inline_query.register(handle_inline_query)
+
+    return dp
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+async def start_metrics_server() -> web.AppRunner | None:
+    if not METRICS_PORT:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host=METRICS_HOST, port=METRICS_PORT).start()
+    except OSError as e:
+        logger.error("Metrics server failed to start on %s:%s: %s", METRICS_HOST, METRICS_PORT, e)
+        await runner.cleanup()
+        return None
+    logger.info("Metrics available at http://%s:%s/metrics", METRICS_HOST, METRICS_PORT)
+    return runner
+
+async def handle_health(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok", "games": len(games_catalog.all())})
+
+def create_webhook_app(bot: Bot, dp: Dispatcher) -> web.Application:
+    app = web.Application()
+    # Telegram присылает WEBHOOK_SECRET в заголовке X-Telegram-Bot-Api-Secret-Token, остальные запросы получают 401
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    app.router.add_get("/health", handle_health)
+    setup_application(app, dp, bot=bot)
+    return app
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    if not WEBHOOK_BASE_URL:
+        logger.error("WEBHOOK_BASE_URL not set!")
+        return
+    if not WEBHOOK_SECRET:
+        # Без секрета любой, кто знает адрес, может прислать поддельное обновление от имени админа
+        logger.error("WEBHOOK_SECRET not set! Refusing to start webhook mode")
+        return
+    
+    runner = web.AppRunner(create_webhook_app(bot, dp))
+    await runner.setup()
+    await web.TCPSite(runner, host=WEBAPP_HOST, port=WEBAPP_PORT).start()
+    await bot.set_webhook(
+        f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    logger.info("Webhook server listening on %s:%s%s", WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_PATH)
+
+    # Как и start_polling, останавливаемся по SIGINT/SIGTERM
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+async def main():
+    # Инициализация файлов
+    await run_io(init_files)
+    
+    # Проверка токена
+    if not BOT_TOKEN or BOT_TOKEN == '8446569923:AAGon_20FfR_w_8-WYtABwQI95QUe6rj34E':
+        logger.error("BOT_TOKEN not set properly!")
+        return
+    
+    session = AiohttpSession(
+        api=TelegramAPIServer.from_base(TELEGRAM_API_URL, is_local=TELEGRAM_API_LOCAL)
+    ) if TELEGRAM_API_URL else None
+    bot = Bot(token=BOT_TOKEN, parse_mode=ParseMode.HTML, session=session)
+    bot.session.middleware(outbound_limiter)
+    bot.session.middleware(ApiMetricsMiddleware())
+    dp = create_dispatcher()
 
-    logger.info("Бот запущен!")
+    # Индексы пользователей и каталог загружаются до приема обновлений
+    await run_io(user_index.load)
+    await games_catalog.refresh()
+    await activity_stats.load()
+    await broadcaster.resume(bot)
+    if not cover_optimizer.available:
+        logger.warning("Pillow is not installed: covers are sent without optimization")
+    metrics_runner = await start_metrics_server()
+
+    background_tasks = [
+        asyncio.create_task(run_store_flusher()),
+        asyncio.create_task(run_catalog_watcher()),
+        asyncio.create_task(monitor_event_loop_lag()),
+        asyncio.create_task(event_log.run()),
+        asyncio.create_task(run_activity_rollups()),
+        asyncio.create_task(run_media_scanner()),
+    ]
+
+    logger.info("Бот запущен! Режим: %s", BOT_MODE)
     try:
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            # Пока установлен webhook, getUpdates отвечает ошибкой Conflict
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
     except Exception as e:
-        logger.error(f"Bot error: {e}")
+        logger.error("Bot error: %s", e)
+    finally:
+        for task in background_tasks:
+            task.cancel()
+        await broadcaster.stop()
+        await cover_optimizer.stop()
+        await media_scanner.stop()
+        await event_log.flush()
+        await activity_stats.save()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await run_io(storage.close)
+        IO_EXECUTOR.shutdown(wait=True)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if sys.argv[1:] == ["migrate"]:
+        migrate_json_to_sqlite()
+    else:
+        asyncio.run(main())
\ No newline at end of file